@@ -0,0 +1,52 @@
+import time
+import numpy as np
+
+from constants import Constants
+from predict.artifact_bundle import ArtifactBundle
+from predict.lyric_generation.clustered_softmax import ClusteredSoftmax
+from predict.predict import Predictor
+from sentiment import Sentiment
+
+if __name__ == "__main__":
+    # measures the pruning of the clustered output layer on the encodings of real lyrics, against
+    # scoring the whole vocabulary; needs an exported bundle
+    predictor = Predictor()
+    predictor.load_artifacts()
+    models = predictor.models
+    encodings: list[np.ndarray] = []
+
+    def recording_encoder(x: np.ndarray) -> np.ndarray:
+        hidden = models["lyrics_encoder"](x)
+        encodings.extend(hidden)
+        return hidden
+
+    predictor.load_bundle_with_models({**models, "lyrics_encoder": recording_encoder})
+    for sentiment in Sentiment:
+        predictor.generate_lyrics(sentiment, 6, seed=0)
+
+    kernel, bias = ArtifactBundle(Constants.ARTIFACT_BUNDLE_PATH).weights("lyrics")[-2:]
+    softmax = ClusteredSoftmax(
+        recording_encoder,
+        kernel,
+        bias,
+        Constants.LYRICS_SOFTMAX_HEAD_SIZE,
+        Constants.LYRICS_SOFTMAX_CLUSTER_SIZE,
+    )
+    # the number of candidates of the lyric generator
+    k = Constants.LYRICS_MAX_SEQ_LEN + 1
+
+    start = time.perf_counter()
+    for hidden in encodings:
+        softmax.top_k_of_hidden(hidden, k)
+    clustered_time = (time.perf_counter() - start) / len(encodings)
+
+    start = time.perf_counter()
+    for hidden in encodings:
+        logits = hidden @ kernel + bias
+        top = np.argpartition(logits, -k)[-k:]
+        top[np.argsort(-logits[top])]
+    full_time = (time.perf_counter() - start) / len(encodings)
+
+    print(f"{len(encodings)} encodings, vocabulary of {len(bias)} words")
+    print(f"Scored {softmax.scored_fraction:.1%} of the vocabulary per encoding")
+    print(f"Clustered: {clustered_time * 1e6:.0f} us, full: {full_time * 1e6:.0f} us per encoding")
@@ -5,11 +5,50 @@ class Constants:
 
     MUSIC_MODEL_PATH = "../data/Models/model_music.keras"
     MUSIC_FEATURE_LENGTH = 8
+    MUSIC_GROUP_SIZE = 8
+    # notes and chords per token: MUSIC_GROUP_SIZE for whole groups, 1 for single notes / chords
+    MUSIC_NOTES_PER_TOKEN = 8
     MUSIC_REVERSE_INDEX_PATH = "../data/Tokenizers/reverse_index_music.pkl"
+    # token settings the music model was trained with, saved next to its reverse index
+    MUSIC_TOKEN_INFO_PATH = "../data/Tokenizers/token_info_music.json"
     MUSIC_SEED_PATH = "../data/Seeds/music_seed.npy"
 
     LYRICS_MODEL_PATH = "../data/Models/model_lyrics.keras"
     LYRICS_TOKENIZER_PATH = "../data/Tokenizers/tokenizer_lyrics.pkl"
     LYRICS_MAX_SEQ_LEN = 34
+    LYRICS_SEEDS_PATH = "../data/Seeds/lyrics_seeds.csv"
+    LYRICS_SOFTMAX_HEAD_SIZE = 2048
+    LYRICS_SOFTMAX_CLUSTER_SIZE = 1024
+
+    CHECKPOINTS_DIR = "../data/Checkpoints"
+    HYPERPARAMETER_SEARCH_DIR = "../data/Search"
+
+    ARTIFACT_BUNDLE_PATH = "../data/Bundles/moodsic.bundle"
 
     OUTPUT_SAVE_DIR = "../Outputs"
+
+    # fraction of a time budget kept for saving and rendering, which cannot be cut
+    DEADLINE_RESERVE = 0.2
+
+    # rendered audio, by the hash of the MIDI file and of the renderer settings
+    RENDER_CACHE_DIR = "../Outputs/RenderCache"
+
+    # ready songs are kept in this directory, inside OUTPUT_SAVE_DIR
+    SONG_POOL_DIR = "Pool"
+    SONG_POOL_SIZE = 2
+    SONG_POOL_N_VERSES = [6]
+    SONG_POOL_NICENESS = 19
+
+    SERVICE_HOST = "127.0.0.1"
+    SERVICE_PORT = 8080
+    SERVICE_MAX_CONCURRENT_REQUESTS = 4
+    SERVICE_MAX_QUEUED_REQUESTS = 32
+    SERVICE_REQUEST_TIMEOUT = 300.0
+    # generation starts cutting work before the timeout, so the request can still be answered
+    SERVICE_TIME_BUDGET = 240.0
+    SERVICE_MAX_BATCH_SIZE = 64
+    # number of pre-forked worker processes, 0 to handle the requests in the service process
+    SERVICE_N_WORKERS = 0
+
+    BATCH_OUTPUT_DIR = "../Outputs/Batch"
+    BATCH_MAX_BATCH_SIZE = 64
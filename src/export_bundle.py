@@ -0,0 +1,5 @@
+from constants import Constants
+from predict.artifact_bundle import ArtifactBundle
+
+if __name__ == "__main__":
+    ArtifactBundle.export_from_artifacts(Constants.ARTIFACT_BUNDLE_PATH)
@@ -0,0 +1,35 @@
+import argparse
+import os
+
+from constants import Constants
+from predict.batch_generation import BatchGenerator
+from predict.predict import Predictor
+from predict.predictor_pool import PredictorPool
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates songs for a file of jobs")
+    parser.add_argument(
+        "jobs",
+        help="file with one prompt per line, or a .jsonl file with one job per line "
+        '({"id", "prompt" or "sentiment", "n_verses", "song_length", "seed"})',
+    )
+    parser.add_argument("--output-dir", default=Constants.BATCH_OUTPUT_DIR)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes, 0 to generate in this process",
+    )
+    args = parser.parse_args()
+
+    jobs = BatchGenerator.load_jobs(args.jobs)
+    predictor = Predictor()
+    if args.workers:
+        # the workers are forked before the artifacts are loaded
+        predictor = PredictorPool(predictor, args.workers, Constants.BATCH_MAX_BATCH_SIZE)
+    else:
+        predictor.load_artifacts(Constants.BATCH_MAX_BATCH_SIZE)
+    succeeded, failed = BatchGenerator(predictor, args.output_dir, max(args.workers, 1)).run(jobs)
+    print(f"{succeeded} jobs succeeded, {failed} failed")
+    if isinstance(predictor, PredictorPool):
+        predictor.close()
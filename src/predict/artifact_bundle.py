@@ -0,0 +1,265 @@
+import hashlib
+import json
+import mmap
+import pickle
+import struct
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+from tensorflow.keras.models import Model, load_model, model_from_json
+
+from constants import Constants
+from predict.lyric_generation.lyric_generator import LyricGenerator
+
+
+class ArtifactBundle:
+    """Single file holding every artifact used at runtime. The file starts with a fixed header
+    and a JSON manifest (offset, size, type and SHA-256 of every entry), followed by the entries
+    themselves, each one starting at an aligned offset. The file is memory-mapped, so arrays are
+    read-only views of the mapping and processes on the same host share the same physical pages.
+    """
+
+    MAGIC = b"MOODSIC\x00"
+    VERSION = 1
+    DATA_ALIGNMENT = 4096
+    ENTRY_ALIGNMENT = 64
+    _HEADER = struct.Struct("<8sIIQ")  # magic, version, reserved, manifest length
+
+    def __init__(self, path: str, verify: bool = True) -> None:
+        """Maps a bundle into memory and parses its manifest
+
+        Args:
+            path (str): Location of the bundle
+            verify (bool, optional): If set, the hashes of all entries are checked.
+                Defaults to True.
+
+        Raises:
+            ValueError: If the file is not a valid bundle or an entry is corrupted
+        """
+        with open(path, "rb") as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            # ask the kernel for one sequential read-ahead of the whole file
+            self._buffer.madvise(mmap.MADV_SEQUENTIAL)
+            self._buffer.madvise(mmap.MADV_WILLNEED)
+
+        magic, version, _, manifest_length = self._HEADER.unpack_from(self._buffer, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f"{path} is not an artifact bundle")
+        if version != self.VERSION:
+            raise ValueError(f"Unsupported bundle version {version} in {path}")
+        manifest_start = self._HEADER.size
+        self._manifest: dict = json.loads(
+            self._buffer[manifest_start : manifest_start + manifest_length].decode("utf-8")
+        )
+        if verify:
+            self.verify()
+
+    @property
+    def manifest(self) -> dict:
+        return self._manifest
+
+    def _entry(self, name: str) -> dict:
+        try:
+            return self._manifest["entries"][name]
+        except KeyError:
+            raise ValueError(f"Bundle has no entry named {name}") from None
+
+    def _raw(self, name: str) -> memoryview:
+        entry = self._entry(name)
+        return memoryview(self._buffer)[entry["offset"] : entry["offset"] + entry["size"]]
+
+    def verify(self) -> None:
+        """Checks the hash of every entry against the manifest
+
+        Raises:
+            ValueError: If an entry does not match its hash
+        """
+        for name, entry in self._manifest["entries"].items():
+            if hashlib.sha256(self._raw(name)).hexdigest() != entry["sha256"]:
+                raise ValueError(f"Bundle entry {name} is corrupted")
+
+    def array(self, name: str) -> np.ndarray:
+        """Retrieves an array entry, without copying it
+
+        Args:
+            name (str): Name of the entry
+
+        Returns:
+            np.ndarray: Read-only view of the array
+        """
+        entry = self._entry(name)
+        return np.frombuffer(
+            self._buffer,
+            dtype=np.dtype(entry["dtype"]),
+            count=int(np.prod(entry["shape"], dtype=np.int64)),
+            offset=entry["offset"],
+        ).reshape(entry["shape"])
+
+    def object(self, name: str) -> Any:
+        """Retrieves a pickled or JSON entry
+
+        Args:
+            name (str): Name of the entry
+
+        Returns:
+            Any: The deserialized object
+        """
+        entry = self._entry(name)
+        if entry["kind"] == "json":
+            return json.loads(bytes(self._raw(name)).decode("utf-8"))
+        return pickle.loads(self._raw(name))
+
+    def weights(self, name: str) -> list[np.ndarray]:
+        """Retrieves the weights of a model, without copying them and without TensorFlow
+
+        Args:
+            name (str): Name of the model
+
+        Returns:
+            list[np.ndarray]: Read-only views of the weights, in the order of `Model.get_weights`
+        """
+        return [self.array(weight) for weight in self._manifest["models"][name]["weights"]]
+
+    def model(self, name: str) -> Model:
+        """Rebuilds a model from its configuration and the weight arrays in the bundle
+
+        Args:
+            name (str): Name of the model
+
+        Returns:
+            Model: The model, with its weights set
+        """
+        model = model_from_json(self._manifest["models"][name]["config"])
+        model.set_weights(self.weights(name))
+        return model
+
+    @staticmethod
+    def _align(position: int, alignment: int) -> int:
+        return (position + alignment - 1) // alignment * alignment
+
+    @staticmethod
+    def export(
+        path: str,
+        arrays: dict[str, np.ndarray],
+        objects: dict[str, bytes],
+        json_objects: dict[str, Any],
+        models: dict[str, Model],
+    ) -> None:
+        """Writes a new bundle to disk
+
+        Args:
+            path (str): Location of the bundle
+            arrays (dict[str, np.ndarray]): Arrays, stored in their raw form
+            objects (dict[str, bytes]): Already pickled objects
+            json_objects (dict[str, Any]): Objects stored as JSON
+            models (dict[str, Model]): Models, stored as their configuration and weight arrays
+        """
+        payloads: dict[str, tuple[dict, bytes]] = {}
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            payloads[name] = (
+                {"kind": "array", "dtype": array.dtype.str, "shape": list(array.shape)},
+                array.tobytes(),
+            )
+        for name, data in objects.items():
+            payloads[name] = ({"kind": "pickle"}, data)
+        for name, obj in json_objects.items():
+            payloads[name] = ({"kind": "json"}, json.dumps(obj).encode("utf-8"))
+
+        model_manifest = {}
+        for model_name, model in models.items():
+            weight_names = []
+            for i, weight in enumerate(model.get_weights()):
+                weight_name = f"models/{model_name}/{i}"
+                weight = np.ascontiguousarray(weight)
+                payloads[weight_name] = (
+                    {"kind": "array", "dtype": weight.dtype.str, "shape": list(weight.shape)},
+                    weight.tobytes(),
+                )
+                weight_names.append(weight_name)
+            model_manifest[model_name] = {"config": model.to_json(), "weights": weight_names}
+
+        # offsets are relative to the data section until the manifest size is known
+        entries = {}
+        position = 0
+        for name, (entry, data) in payloads.items():
+            position = ArtifactBundle._align(position, ArtifactBundle.ENTRY_ALIGNMENT)
+            entries[name] = {
+                **entry,
+                "offset": position,
+                "size": len(data),
+                "sha256": hashlib.sha256(data).hexdigest(),
+            }
+            position += len(data)
+
+        def encode_manifest(data_start: int) -> bytes:
+            absolute = {
+                name: {**entry, "offset": entry["offset"] + data_start}
+                for name, entry in entries.items()
+            }
+            manifest = {
+                "version": ArtifactBundle.VERSION,
+                "entries": absolute,
+                "models": model_manifest,
+            }
+            return json.dumps(manifest).encode("utf-8")
+
+        # the manifest length depends on the offsets it contains, so grow the data start until
+        # the manifest fits in front of it
+        data_start = ArtifactBundle.DATA_ALIGNMENT
+        manifest = encode_manifest(data_start)
+        while ArtifactBundle._HEADER.size + len(manifest) > data_start:
+            data_start = ArtifactBundle._align(
+                ArtifactBundle._HEADER.size + len(manifest), ArtifactBundle.DATA_ALIGNMENT
+            )
+            manifest = encode_manifest(data_start)
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                ArtifactBundle._HEADER.pack(
+                    ArtifactBundle.MAGIC, ArtifactBundle.VERSION, 0, len(manifest)
+                )
+            )
+            f.write(manifest)
+            for name, (_, data) in payloads.items():
+                f.seek(data_start + entries[name]["offset"])
+                f.write(data)
+        Path(tmp_path).replace(path)
+
+    @staticmethod
+    def export_from_artifacts(path: str = Constants.ARTIFACT_BUNDLE_PATH) -> None:
+        """Collects the separate runtime artifacts (tokenizers, indices, seeds and models) and
+        writes them to a single bundle
+
+        Args:
+            path (str, optional): Location of the bundle. Defaults to Constants.ARTIFACT_BUNDLE_PATH.
+        """
+        with open(Constants.MUSIC_SEED_PATH, "rb") as music_seed_path:
+            music_seed = np.load(music_seed_path)
+        # artifacts saved before the number of notes per token was recorded used the default
+        music_token_info = {"notes_per_token": Constants.MUSIC_NOTES_PER_TOKEN}
+        if Path(Constants.MUSIC_TOKEN_INFO_PATH).exists():
+            with open(Constants.MUSIC_TOKEN_INFO_PATH, "r") as token_info_path:
+                music_token_info = json.load(token_info_path)
+        ArtifactBundle.export(
+            path,
+            arrays={"music_seed": music_seed},
+            objects={
+                "sentiment_tokenizer": Path(Constants.SENTIMENT_TOKENIZER_PATH).read_bytes(),
+                "music_reverse_index": Path(Constants.MUSIC_REVERSE_INDEX_PATH).read_bytes(),
+                "lyrics_tokenizer": Path(Constants.LYRICS_TOKENIZER_PATH).read_bytes(),
+            },
+            json_objects={
+                "lyrics_seeds": LyricGenerator.load_seeds(),
+                "music_token_info": music_token_info,
+            },
+            models={
+                "sentiment": load_model(Constants.SENTIMENT_MODEL_PATH),
+                "music": load_model(Constants.MUSIC_MODEL_PATH),
+                "lyrics": load_model(Constants.LYRICS_MODEL_PATH),
+            },
+        )
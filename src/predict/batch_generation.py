@@ -0,0 +1,234 @@
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import json
+import re
+from pathlib import Path
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from predict.predict import Predictor
+from predict.predictor_pool import PredictorPool
+from predict.request_seed import RequestSeed
+from sentiment import Sentiment
+
+
+@dataclass
+class BatchJob:
+    job_id: str
+    prompt: Optional[str] = None
+    sentiment: Optional[Sentiment] = None
+    n_verses: int = 6
+    song_length: int = 128
+    seed: Optional[int] = None
+
+
+class BatchGenerator:
+    """Generates songs offline, for a file of jobs. Every job makes the lyrics, the MIDI and the
+    WAV of a song, and is recorded in a JSONL manifest (with the time spent on every stage) once
+    all its outputs are written, so a run which is interrupted continues with the jobs that are
+    not in the manifest yet. With a pool of worker processes, the jobs run in parallel"""
+
+    MANIFEST_FILE = "manifest.jsonl"
+    JOB_ID_PATTERN = re.compile(r"^[\w-]+$")
+    OUTPUT_EXTENSIONS = ("txt", "mid", "wav")
+
+    def __init__(self, predictor: Predictor | PredictorPool, output_dir: str, n_jobs: int) -> None:
+        """
+        Args:
+            predictor (Predictor | PredictorPool): Predictor with loaded artifacts, or a pool of
+                worker processes
+            output_dir (str): Directory of the outputs and of the manifest
+            n_jobs (int): Number of jobs which are run at once
+        """
+        self._predictor = predictor
+        # the predictor puts its outputs under its own directory, unless the path is absolute
+        self._output_dir = Path(output_dir).resolve()
+        self._n_jobs = n_jobs
+        self._manifest_lock = threading.Lock()
+        # every job makes its music while its own thread makes the lyrics
+        self._music_executor = ThreadPoolExecutor(n_jobs)
+
+    @property
+    def manifest_path(self) -> Path:
+        return Path(self._output_dir, self.MANIFEST_FILE)
+
+    @staticmethod
+    def _parse_job(line: str, line_number: int, is_jsonl: bool) -> BatchJob:
+        """Parses a line of the jobs file
+
+        Args:
+            line (str): Prompt, or JSON object with a prompt or a sentiment and, optionally, an id,
+                the number of verses, the song length and the seed
+            line_number (int): Number of the line, used as id if there is none
+            is_jsonl (bool): Whether the line is a JSON object
+
+        Raises:
+            ValueError: If the job is not valid
+
+        Returns:
+            BatchJob: Job
+        """
+        job_id = f"job_{line_number:06d}"
+        if not is_jsonl:
+            return BatchJob(job_id, prompt=line)
+
+        data = json.loads(line)
+        if not isinstance(data, dict):
+            raise ValueError(f"Line {line_number}: a job must be a JSON object")
+        job = BatchJob(
+            str(data.get("id", job_id)),
+            data.get("prompt"),
+            Sentiment(data["sentiment"]) if "sentiment" in data else None,
+            data.get("n_verses", BatchJob.n_verses),
+            data.get("song_length", BatchJob.song_length),
+            data.get("seed"),
+        )
+        if not BatchGenerator.JOB_ID_PATTERN.match(job.job_id):
+            raise ValueError(
+                f"Line {line_number}: a job id can only contain letters, digits, - and _"
+            )
+        if job.sentiment is None and not job.prompt:
+            raise ValueError(f"Line {line_number}: a job needs a prompt or a sentiment")
+        if not isinstance(job.n_verses, int) or not isinstance(job.song_length, int):
+            raise ValueError(f"Line {line_number}: n_verses and song_length must be integers")
+        if job.seed is not None and (not isinstance(job.seed, int) or job.seed < 0):
+            raise ValueError(f"Line {line_number}: the seed must be a non-negative integer")
+        if job.n_verses < 1 or job.song_length < 1:
+            raise ValueError(f"Line {line_number}: n_verses and song_length must be positive")
+        return job
+
+    @staticmethod
+    def load_jobs(jobs_path: str) -> list[BatchJob]:
+        """Reads the jobs: one prompt per line, or one JSON object per line for .jsonl files
+
+        Args:
+            jobs_path (str): Location of the jobs file
+
+        Raises:
+            ValueError: If a job is not valid, or two jobs have the same id
+
+        Returns:
+            list[BatchJob]: Jobs, in the order of the file
+        """
+        is_jsonl = Path(jobs_path).suffix == ".jsonl"
+        jobs = []
+        with open(jobs_path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                if line.strip():
+                    jobs.append(BatchGenerator._parse_job(line.strip(), line_number, is_jsonl))
+        job_ids = [job.job_id for job in jobs]
+        if len(set(job_ids)) != len(job_ids):
+            raise ValueError("Job ids must be unique")
+        return jobs
+
+    def _completed_job_ids(self) -> set[str]:
+        if not self.manifest_path.is_file():
+            return set()
+        with open(self.manifest_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return {record["job_id"] for record in records if record["status"] == "ok"}
+
+    def _record(self, record: dict[str, Any]) -> None:
+        with self._manifest_lock, open(self.manifest_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    @staticmethod
+    def _timed(timings: dict[str, float], stage: str, function: Callable, *args) -> Any:
+        start = time.perf_counter()
+        result = function(*args)
+        timings[stage] = time.perf_counter() - start
+        return result
+
+    def _run_job(self, job: BatchJob) -> dict[str, Any]:
+        """Generates the song of a job. The lyrics and the music are made at the same time
+
+        Args:
+            job (BatchJob): Job
+
+        Returns:
+            dict[str, Any]: Manifest record of the job
+
+        Raises:
+            RuntimeError: If an output file is missing, for instance because the audio could not be
+                rendered, so the job is recorded as failed and run again
+        """
+        output_name = str(Path(self._output_dir, job.job_id))
+        seed = RequestSeed.new() if job.seed is None else job.seed
+        timings = {}
+        start = time.perf_counter()
+        sentiment = job.sentiment
+        if sentiment is None:
+            sentiment = self._predictor.classify(job.prompt)
+            timings["classify"] = time.perf_counter() - start
+
+        music = self._music_executor.submit(
+            self._timed,
+            timings,
+            "song",
+            self._predictor.generate_song,
+            sentiment,
+            output_name,
+            job.song_length,
+            seed,
+        )
+        try:
+            lyrics = self._timed(
+                timings,
+                "lyrics",
+                self._predictor.generate_lyrics,
+                sentiment,
+                job.n_verses,
+                output_name,
+                seed,
+            )
+        finally:
+            # the job only counts as completed once the music is saved too
+            music.result()
+        timings["total"] = time.perf_counter() - start
+
+        paths = {
+            extension: Predictor.output_path(output_name, extension)
+            for extension in self.OUTPUT_EXTENSIONS
+        }
+        missing = [str(path) for path in paths.values() if not path.is_file()]
+        if missing:
+            raise RuntimeError(f"Missing outputs: {', '.join(missing)}")
+        return {
+            **asdict(job),
+            "sentiment": sentiment.value,
+            "seed": seed,
+            "status": "ok",
+            "lyrics": lyrics,
+            "lyrics_path": str(paths["txt"]),
+            "midi_path": str(paths["mid"]),
+            "wav_path": str(paths["wav"]),
+            "timings": timings,
+        }
+
+    def _run_and_record(self, job: BatchJob) -> bool:
+        try:
+            record = self._run_job(job)
+        except Exception as e:
+            record = {**asdict(job), "status": "failed", "error": repr(e)}
+        self._record(record)
+        print(f"{job.job_id}: {record['status']}")
+        return record["status"] == "ok"
+
+    def run(self, jobs: list[BatchJob]) -> tuple[int, int]:
+        """Runs the jobs which are not completed yet. Failed jobs are recorded, and run again by
+        the next run
+
+        Args:
+            jobs (list[BatchJob]): Jobs
+
+        Returns:
+            tuple[int, int]: Number of jobs which succeeded and failed in this run
+        """
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        completed = self._completed_job_ids()
+        pending = [job for job in jobs if job.job_id not in completed]
+        print(f"{len(jobs) - len(pending)} of {len(jobs)} jobs are already completed")
+        with ThreadPoolExecutor(self._n_jobs) as executor:
+            succeeded = sum(executor.map(self._run_and_record, pending))
+        return succeeded, len(pending) - succeeded
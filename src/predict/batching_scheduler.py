@@ -0,0 +1,96 @@
+from concurrent.futures import Future
+import queue
+import threading
+from typing import Optional
+import numpy as np
+from tensorflow.keras.models import Model
+
+from predict.inference_model import InferenceModel
+
+
+class BatchingScheduler:
+    """Batches the forward passes of concurrent decoding loops. Every loop still calls the model
+    one step at a time, but the calls are queued, and a scheduler thread runs all the steps that
+    are waiting as a single batch. While a batch runs, the next steps pile up, so no time is spent
+    waiting for a batch to fill, and sequences join or leave the batch at any step, simply by
+    calling or no longer calling the model. Has the same interface as `InferenceModel`"""
+
+    def __init__(self, model: InferenceModel, max_batch_size: int) -> None:
+        """
+        Args:
+            model (InferenceModel): Model which runs the batches
+            max_batch_size (int): Maximum number of rows in a batch
+        """
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._steps: queue.Queue[Optional[tuple[np.ndarray, Future]]] = queue.Queue()
+        self._scheduler = threading.Thread(target=self._run_batches, daemon=True)
+        self._scheduler.start()
+
+    @property
+    def model(self) -> Model:
+        return self._model.model
+
+    @property
+    def input_shape(self) -> tuple[int, ...]:
+        return self._model.input_shape
+
+    def warm_up(self) -> None:
+        self._model.warm_up()
+
+    def _next_batch(self) -> Optional[list[tuple[np.ndarray, Future]]]:
+        """Waits for a step, then takes all the other steps which are waiting, up to the batch size
+
+        Returns:
+            Optional[list[tuple[np.ndarray, Future]]]: Inputs and pending results of the steps, or
+                None if the scheduler is closed
+        """
+        step = self._steps.get()
+        if step is None:
+            return None
+        batch = [step]
+        n_rows = len(step[0])
+        while n_rows < self._max_batch_size:
+            try:
+                step = self._steps.get_nowait()
+            except queue.Empty:
+                break
+            if step is None:
+                # the batch is still run, the scheduler stops afterwards
+                self._steps.put(None)
+                break
+            batch.append(step)
+            n_rows += len(step[0])
+        return batch
+
+    def _run_batches(self) -> None:
+        """Runs the batches of steps, in a loop. Runs in the scheduler thread"""
+        while (batch := self._next_batch()) is not None:
+            inputs = [x for x, _ in batch]
+            try:
+                outputs = self._model(np.concatenate(inputs))
+            except Exception as e:
+                for _, result in batch:
+                    result.set_exception(e)
+                continue
+            ends = np.cumsum([len(x) for x in inputs])
+            for (_, result), output in zip(batch, np.split(outputs, ends[:-1])):
+                result.set_result(output)
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Runs the model on a batch of inputs, together with the inputs of the other callers
+
+        Args:
+            x (np.ndarray): Batch of inputs, usually the next step of a single sequence
+
+        Returns:
+            np.ndarray: Model outputs for the given inputs
+        """
+        result: Future = Future()
+        self._steps.put((np.asarray(x), result))
+        return result.result()
+
+    def close(self) -> None:
+        """Stops the scheduler thread, once the waiting steps are run"""
+        self._steps.put(None)
+        self._scheduler.join()
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Any
+
+from constants import Constants
+
+
+class Deadline:
+    """Time budget of a request, shared by all its stages. Stages which can do less work check
+    the deadline and cut their work when the rest of the budget would not be enough, recording
+    what they gave up, so the result can say how it was degraded. Part of the budget is kept for
+    the work which cannot be cut (saving and rendering the song)"""
+
+    ACCEPTED_GROUP = "accepted_repetitive_group"
+    ACCEPTED_MELODY = "accepted_melody_in_wrong_mode"
+    ACCEPTED_VERSE = "accepted_repetitive_verse"
+    FEWER_VERSES = "fewer_verses"
+
+    def __init__(self, budget: float, reserve: float = Constants.DEADLINE_RESERVE) -> None:
+        """
+        Args:
+            budget (float): Seconds the request may take, from now
+            reserve (float, optional): Fraction of the budget kept for the work which cannot be
+                cut. Defaults to Constants.DEADLINE_RESERVE.
+        """
+        # the monotonic clock is shared by all processes, so the deadline holds in workers too
+        self._end = time.monotonic() + budget
+        self._reserve = reserve * budget
+        self._degradations: list[str] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self._end - time.monotonic()
+
+    def allows(self, seconds: float) -> bool:
+        """Checks whether some more work fits in the budget, without using the reserve
+
+        Args:
+            seconds (float): Expected duration of the work
+
+        Returns:
+            bool: Whether the work can be done
+        """
+        return self.remaining() - self._reserve >= seconds
+
+    def is_tight(self) -> bool:
+        return not self.allows(0.0)
+
+    def degrade(self, degradation: str) -> None:
+        """Records that some work was cut
+
+        Args:
+            degradation (str): What was cut
+        """
+        with self._lock:
+            if degradation not in self._degradations:
+                self._degradations.append(degradation)
+
+    @property
+    def degradations(self) -> list[str]:
+        with self._lock:
+            return list(self._degradations)
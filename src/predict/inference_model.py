@@ -0,0 +1,46 @@
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import Model
+
+
+class InferenceModel:
+    def __init__(self, model: Model, input_shape: tuple[int, ...], input_dtype: tf.DType) -> None:
+        """Wraps a model in a compiled function with a fixed input signature. Only the batch
+        dimension is left unspecified, so the function is traced a single time
+
+        Args:
+            model (Model): Model used for inference
+            input_shape (tuple[int, ...]): Shape of a single input, without the batch dimension
+            input_dtype (tf.DType): Type of the input values
+        """
+        self._model = model
+        self._input_shape = input_shape
+        self._input_dtype = input_dtype
+        self._forward = tf.function(
+            lambda x: model(x, training=False),
+            input_signature=[tf.TensorSpec(shape=(None, *input_shape), dtype=input_dtype)],
+        )
+
+    @property
+    def model(self) -> Model:
+        return self._model
+
+    @property
+    def input_shape(self) -> tuple[int, ...]:
+        return self._input_shape
+
+    def warm_up(self) -> None:
+        """Runs a forward pass on a dummy input, so that the graph is traced before the first
+        actual request"""
+        self(np.zeros((1, *self._input_shape), dtype=self._input_dtype.as_numpy_dtype))
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        """Runs the model on a batch of inputs
+
+        Args:
+            x (np.ndarray): Batch of inputs, with the shape given in the signature
+
+        Returns:
+            np.ndarray: Model outputs
+        """
+        return self._forward(np.asarray(x, dtype=self._input_dtype.as_numpy_dtype)).numpy()
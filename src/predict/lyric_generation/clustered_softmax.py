@@ -0,0 +1,133 @@
+import threading
+from typing import Callable
+import numpy as np
+
+
+class ClusteredSoftmax:
+    """Finds the top candidates of the output layer of the lyrics model without scoring the whole
+    vocabulary. Word ids are given by the tokenizer in decreasing order of frequency, so they are
+    split into a head cluster of frequent words, which is always scored, and tail clusters. A tail
+    cluster is only scored when an upper bound of its logits (Cauchy-Schwarz) can beat the current
+    k-th best logit, so the result is exact. The output weights are used as given, so weights
+    read from the memory-mapped bundle are shared by every process which maps it. Only numpy is
+    used here, the encoder is given"""
+
+    def __init__(
+        self,
+        encoder: Callable[[np.ndarray], np.ndarray],
+        kernel: np.ndarray,
+        bias: np.ndarray,
+        head_size: int,
+        cluster_size: int,
+    ) -> None:
+        """
+        Args:
+            encoder (Callable[[np.ndarray], np.ndarray]): Maps a batch of sequences to the inputs
+                of the output layer, or a proxy which forwards the calls to another process
+            kernel (np.ndarray): Kernel of the output layer (hidden size x vocabulary size)
+            bias (np.ndarray): Bias of the output layer
+            head_size (int): Number of most frequent words which are always scored
+            cluster_size (int): Number of words in every tail cluster
+        """
+        self._encoder = encoder
+        self._kernel = kernel
+        self._bias = bias
+
+        vocabulary_size = len(self._bias)
+        self._clusters = [(0, min(head_size, vocabulary_size))] + [
+            (start, min(start + cluster_size, vocabulary_size))
+            for start in range(head_size, vocabulary_size, cluster_size)
+        ]
+        # computed cluster by cluster, so the kernel is never copied as a whole
+        self._max_norms = np.array(
+            [np.linalg.norm(kernel[:, start:end], axis=0).max() for start, end in self._clusters]
+        )
+        self._max_biases = np.array([self._bias[start:end].max() for start, end in self._clusters])
+        # number of searches and of words scored by them, to measure the pruning
+        self._stats_lock = threading.Lock()
+        self._n_searches = 0
+        self._n_scored = 0
+
+    @property
+    def encoder(self) -> Callable[[np.ndarray], np.ndarray]:
+        return self._encoder
+
+    @property
+    def scored_fraction(self) -> float:
+        """Average fraction of the vocabulary scored by a search so far; 1 means that no cluster
+        was pruned"""
+        with self._stats_lock:
+            if not self._n_searches:
+                return 0.0
+            return self._n_scored / (self._n_searches * len(self._bias))
+
+    def warm_up(self) -> None:
+        self._encoder.warm_up()
+
+    def _score(self, hidden: np.ndarray, start: int, end: int) -> np.ndarray:
+        # a column slice of the kernel is strided, which matrix products handle without a copy
+        return hidden @ self._kernel[:, start:end] + self._bias[start:end]
+
+    def top_k_of_hidden(self, hidden: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Finds the k most probable words for the encoding of a single sequence
+
+        Args:
+            hidden (np.ndarray): Input of the output layer for the sequence
+            k (int): Number of candidates
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Ids of the candidates and their logits, sorted in
+                decreasing order of the logits
+        """
+        bounds = np.linalg.norm(hidden) * self._max_norms + self._max_biases
+
+        head_start, head_end = self._clusters[0]
+        ids = np.arange(head_start, head_end)
+        logits = self._score(hidden, head_start, head_end)
+        n_scored = head_end - head_start
+        for cluster in np.argsort(-bounds[1:]) + 1:
+            threshold = np.partition(logits, -k)[-k] if len(logits) >= k else -np.inf
+            if bounds[cluster] <= threshold:
+                # clusters are visited in decreasing order of their bounds
+                break
+            start, end = self._clusters[cluster]
+            n_scored += end - start
+            ids = np.concatenate([ids, np.arange(start, end)])
+            logits = np.concatenate([logits, self._score(hidden, start, end)])
+            if len(logits) > k:
+                best = np.argpartition(logits, -k)[-k:]
+                ids, logits = ids[best], logits[best]
+
+        with self._stats_lock:
+            self._n_searches += 1
+            self._n_scored += n_scored
+        top = np.argsort(-logits, kind="stable")[:k]
+        return ids[top], logits[top]
+
+    def top_k(self, x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        """Finds the k most probable words after a single input sequence
+
+        Args:
+            x (np.ndarray): Batch containing one padded sequence of token ids
+            k (int): Number of candidates
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Ids of the candidates and their logits, sorted in
+                decreasing order of the logits. Differences of logits are log-ratios of
+                probabilities, so no normalization is needed
+        """
+        return self.top_k_of_hidden(self._encoder(x)[0], k)
+
+    def top_k_batch(self, x: np.ndarray, k: int) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Finds the k most probable words after every sequence of a batch. The encoder runs once
+        for the whole batch
+
+        Args:
+            x (np.ndarray): Batch of padded sequences of token ids
+            k (int): Number of candidates
+
+        Returns:
+            list[tuple[np.ndarray, np.ndarray]]: Ids and logits of the candidates of every
+                sequence, as returned by `top_k`
+        """
+        return [self.top_k_of_hidden(hidden, k) for hidden in self._encoder(x)]
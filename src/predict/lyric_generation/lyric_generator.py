@@ -1,51 +1,105 @@
 import re
-from tensorflow.keras.models import Model
+import numpy as np
 from tensorflow.keras.preprocessing.text import Tokenizer
 from tensorflow.keras.preprocessing.sequence import pad_sequences
 import random
+import time
+from typing import Callable, Optional
 import pandas as pd
+from constants import Constants
+from predict.batching_scheduler import BatchingScheduler
+from predict.deadline import Deadline
+from predict.inference_model import InferenceModel
+from predict.lyric_generation.clustered_softmax import ClusteredSoftmax
 from sentiment import Sentiment
 
 
 class LyricGenerator:
-    def __init__(self, max_sequence_len: int, tokenizer: Tokenizer, model: Model) -> None:
+    def __init__(
+        self,
+        max_sequence_len: int,
+        tokenizer: Tokenizer,
+        model: InferenceModel | BatchingScheduler | ClusteredSoftmax,
+        seeds: dict[str, list[str]],
+    ) -> None:
         self._max_sequence_len = max_sequence_len
         self._tokenizer = tokenizer
         self._model = model
+        self._seeds = seeds
 
-    def _get_next_word(self, current_seed: str) -> str:
-        """Given a seed, determines the next word. Some degree of randomness is used to ensure
-        non-determinism.
+    def _get_candidates(
+        self, token_lists: np.ndarray, k: int
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """Finds the most probable next words of every sequence of a batch
 
         Args:
-            current_seed (str): Current seed word
+            token_lists (np.ndarray): Batch containing the padded seeds
+            k (int): Number of candidates
 
         Returns:
-            str: Next word to be used
+            list[tuple[np.ndarray, np.ndarray]]: Word ids and their log-probabilities (up to a
+                constant) for every seed, sorted in decreasing order
         """
-        token_list = self._tokenizer.texts_to_sequences([current_seed])[0]
-        token_list = pad_sequences([token_list], maxlen=self._max_sequence_len, padding="pre")
-        prediction = self._model.predict(token_list, verbose=0)[0]
-
-        # choose a random prediction which is at least half of the most probable one
-        pred_with_pos = [(pred, idx) for idx, pred in enumerate(prediction)]
-        sorted_pred = sorted(pred_with_pos, key=lambda pair: pair[0], reverse=True)
-        max_position = 1
-        while (
-            max_position < self._max_sequence_len - 1
-            and sorted_pred[0][0] <= 1.75 * sorted_pred[max_position + 1][0]
+        if isinstance(self._model, ClusteredSoftmax):
+            return self._model.top_k_batch(token_lists, k)
+        candidates = []
+        for prediction in self._model(token_lists):
+            sorted_pos = np.argsort(-prediction, kind="stable")[:k]
+            with np.errstate(divide="ignore"):
+                candidates.append((sorted_pos, np.log(prediction[sorted_pos])))
+        return candidates
+
+    def _get_next_words(self, current_seeds: list[str], rngs: list[random.Random]) -> list[str]:
+        """Given a number of seeds, determines the next word of each of them, with a single
+        model call. Some degree of randomness is used to ensure non-determinism.
+
+        Args:
+            current_seeds (list[str]): Current seeds
+            rngs (list[random.Random]): Random generator of every seed
+
+        Returns:
+            list[str]: Next word of every seed
+        """
+        token_lists = self._tokenizer.texts_to_sequences(current_seeds)
+        token_lists = pad_sequences(token_lists, maxlen=self._max_sequence_len, padding="pre")
+        words = []
+        for rng, (sorted_pos, sorted_scores) in zip(
+            rngs, self._get_candidates(token_lists, self._max_sequence_len + 1)
         ):
-            max_position += 1
-        random_idx = random.randint(0, max_position - 1) if max_position > 1 else 0
-        pos = sorted_pred[random_idx][1]
+            # a candidate is at least half as probable as the best one if the difference between
+            # their log-probabilities is small enough
+            max_position = 1
+            while max_position < self._max_sequence_len - 1 and sorted_scores[0] - sorted_scores[
+                max_position + 1
+            ] <= np.log(1.75):
+                max_position += 1
+            random_idx = rng.randint(0, max_position - 1) if max_position > 1 else 0
+            pos = int(sorted_pos[random_idx])
+            words.append(self._tokenizer.index_word.get(pos, ""))
+        return words
+
+    @staticmethod
+    def load_seeds(seeds_path: str = Constants.LYRICS_SEEDS_PATH) -> dict[str, list[str]]:
+        """Reads the list of seeds and parses them, grouped by sentiment
+
+        Args:
+            seeds_path (str, optional): CSV file with the seeds. Defaults to Constants.LYRICS_SEEDS_PATH.
 
-        for word, index in self._tokenizer.word_index.items():
-            if index == pos:
-                return word
-        return ""
+        Returns:
+            dict[str, list[str]]: Parsed seeds of every sentiment
+        """
+        seeds = pd.read_csv(seeds_path, encoding="utf-8")
+        seed_lines: dict[str, list[str]] = {s: [] for s in Sentiment.class_names()}
+        for sentiment, line in zip(seeds["Emotion"], seeds["Text"]):
+            if sentiment not in seed_lines:
+                continue
+            line = re.sub(r"\(.*\)", "", line)
+            line = re.sub(r"[^ a-zA-Z]", "", line)
+            seed_lines[sentiment].append(line)
+        return seed_lines
 
     def _get_seeds_for_sentiment(self, sentiment: Sentiment) -> list[str]:
-        """Reads list of seeds for a given sentiment and parses them
+        """Retrieves the parsed seeds for a given sentiment
 
         Args:
             sentiment (Sentiment): The sentiment whose seeds are retrieved
@@ -53,14 +107,7 @@ class LyricGenerator:
         Returns:
             list[str]: List of parsed seeds
         """
-        seeds = pd.read_csv(f"../data/Seeds/lyrics_seeds.csv", encoding="utf-8")
-        filtered_seeds = seeds[seeds["Emotion"] == sentiment.value]
-        seed_lines = []
-        for line in filtered_seeds["Text"]:
-            line = re.sub(r"\(.*\)", "", line)
-            line = re.sub(r"[^ a-zA-Z]", "", line)
-            seed_lines.append(line)
-        return seed_lines
+        return self._seeds[sentiment.value]
 
     def _beautify_verse(self, verse: str) -> str:
         """Improves the content of a verse in order to make it more suitable
@@ -86,40 +133,116 @@ class LyricGenerator:
             verse = re.sub(rf"\b{pair[0]}\b", pair[1], verse)
         return verse
 
-    def run(self, n_verses: int, sentiment: Sentiment) -> list[str]:
-        """Creates a number of verses following a particular sentiment
+    def run_batch(
+        self,
+        n_verses: int,
+        sentiment: Sentiment,
+        rngs: list[random.Random],
+        deadline: Optional[Deadline] = None,
+        on_verse: Optional[Callable[[int, int, str], None]] = None,
+    ) -> list[list[str]]:
+        """Creates several sets of verses following a particular sentiment. The sets are
+        decoded together, so every word of all the sets is predicted with one model call.
+        Repetitive verses are rejected, unless the set had too many of them in a row or the
+        deadline gets close, and when the next verse would not fit in the deadline, the sets are
+        returned with fewer verses
 
         Args:
-            n_verses (int): Number of output verses
+            n_verses (int): Number of output verses of every set
             sentiment (Sentiment): Sentiment which the verses follow
+            rngs (list[random.Random]): Random generator of every set; a set only depends on its
+                own generator
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_verse (Optional[Callable[[int, int, str], None]], optional): Called with the set,
+                position and text of every verse as soon as it is accepted. Defaults to None.
 
         Returns:
-            list[str]: List of verses
+            list[list[str]]: Verses of every set
         """
+        n_variants = len(rngs)
         seeds = self._get_seeds_for_sentiment(sentiment)
-        current_seed = random.choice(seeds)
+        current_seeds = [rng.choice(seeds) for rng in rngs]
         verse_length = 8
-        lyrics = []
-
-        i = 0
-        while i < n_verses:
-            for _ in range(verse_length):
-                output_word = self._get_next_word(current_seed)
-                current_seed += " " + output_word
-
-            # verse has less than 3 unique words,
-            # or previous verse identical to current one
-            if len(set(current_seed.split()[-verse_length:])) <= 2 or (
-                i > 1 and current_seed == lyrics[i - 1]
+        lyrics: list[list[str]] = [[] for _ in range(n_variants)]
+
+        active = list(range(n_variants)) if n_verses > 0 else []
+        max_rejections = 10
+        rejections = [0 for _ in range(n_variants)]
+        verse_duration = 0.0
+        while active:
+            if (
+                deadline is not None
+                and all(lyrics[v] for v in active)
+                and not deadline.allows(verse_duration)
             ):
-                current_seed = random.choice(seeds)
-            else:
+                deadline.degrade(Deadline.FEWER_VERSES)
+                break
+            verse_start = time.monotonic()
+            accept_any = deadline is not None and deadline.is_tight()
+            for _ in range(verse_length):
+                output_words = self._get_next_words(
+                    [current_seeds[v] for v in active], [rngs[v] for v in active]
+                )
+                for v, output_word in zip(active, output_words):
+                    current_seeds[v] += " " + output_word
+
+            for v in active:
+                current_seed = current_seeds[v]
+                i = len(lyrics[v])
+                # verse has less than 3 unique words,
+                # or previous verse identical to current one
+                is_repetitive = len(set(current_seed.split()[-verse_length:])) <= 2 or (
+                    i > 1 and current_seed == lyrics[v][i - 1]
+                )
+                if is_repetitive and (accept_any or rejections[v] >= max_rejections):
+                    # a degenerate model or seed would otherwise never finish the set
+                    if deadline is not None:
+                        deadline.degrade(Deadline.ACCEPTED_VERSE)
+                elif is_repetitive:
+                    rejections[v] += 1
+                    current_seeds[v] = rngs[v].choice(seeds)
+                    continue
+                rejections[v] = 0
                 new_seed = " ".join(current_seed.split()[-verse_length:])
                 verse = self._beautify_verse(new_seed)
                 # capitalize first letter, without modifying the others
                 verse = verse[:1].upper() + verse[1:]
-                lyrics.append(verse)
-                current_seed = new_seed
-                i += 1
+                lyrics[v].append(verse)
+                current_seeds[v] = new_seed
+                if on_verse is not None:
+                    on_verse(v, i, verse)
+            active = [v for v in active if len(lyrics[v]) < n_verses]
+            verse_duration = time.monotonic() - verse_start
 
         return lyrics
+
+    def run(
+        self,
+        n_verses: int,
+        sentiment: Sentiment,
+        rng: Optional[random.Random] = None,
+        deadline: Optional[Deadline] = None,
+        on_verse: Optional[Callable[[int, str], None]] = None,
+    ) -> list[str]:
+        """Creates a number of verses following a particular sentiment
+
+        Args:
+            n_verses (int): Number of output verses
+            sentiment (Sentiment): Sentiment which the verses follow
+            rng (Optional[random.Random], optional): Random generator of the verses. Defaults to
+                a new unseeded generator.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_verse (Optional[Callable[[int, str], None]], optional): Called with the position
+                and text of every verse as soon as it is accepted. Defaults to None.
+
+        Returns:
+            list[str]: List of verses
+        """
+        on_set_verse = None
+        if on_verse is not None:
+            on_set_verse = lambda _, i, verse: on_verse(i, verse)
+        return self.run_batch(
+            n_verses, sentiment, [rng or random.Random()], deadline, on_set_verse
+        )[0]
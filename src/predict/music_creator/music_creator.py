@@ -1,9 +1,14 @@
 import copy
+import random
+import time
+from typing import Callable, Optional
 from music21 import chord, note, stream, duration, pitch, interval, key
 import numpy as np
-from tensorflow.keras.models import Model
 
 from constants import Constants
+from predict.batching_scheduler import BatchingScheduler
+from predict.deadline import Deadline
+from predict.inference_model import InferenceModel
 from predict.music_creator.sentiment_to_melodies import MelodyInfo
 
 
@@ -12,14 +17,49 @@ class MusicCreator:
 
     def __init__(
         self,
-        model: Model,
+        model: InferenceModel | BatchingScheduler,
         x_seed: np.array,
         reverse_index: dict[int, str],
+        notes_per_token: int,
     ) -> None:
+        """
+        Args:
+            model (InferenceModel): Music model
+            x_seed (np.array): Seed windows of the music model
+            reverse_index (dict[int, str]): Mapping of numerical values to tokens
+            notes_per_token (int): Number of notes and chords in a token, as saved when the model
+                was trained
+        """
         self._model = model
         self._x_seed = x_seed
         self._vocab_size = len(reverse_index)
         self._reverse_index = reverse_index
+        self._steps_per_group = Constants.MUSIC_GROUP_SIZE // notes_per_token
+
+    @staticmethod
+    def check_notes_per_token(reverse_index: dict[int, str], notes_per_token: int) -> None:
+        """Checks that the tokens of the reverse index hold the given number of notes and chords.
+        With a wrong number, every predicted group would be rejected, so the melodies would never
+        be finished
+
+        Args:
+            reverse_index (dict[int, str]): Mapping of numerical values to tokens
+            notes_per_token (int): Number of notes and chords in a token
+
+        Raises:
+            ValueError: If the number does not divide the group size, or the tokens do not hold
+                this many notes and chords
+        """
+        if notes_per_token < 1 or Constants.MUSIC_GROUP_SIZE % notes_per_token:
+            raise ValueError(
+                f"Notes per token must divide the group size ({Constants.MUSIC_GROUP_SIZE})"
+            )
+        # only the last token of the training data may be shorter
+        token_length = max((len(token.split("/")) for token in reverse_index.values()), default=0)
+        if token_length != notes_per_token:
+            raise ValueError(
+                f"The music tokens hold {token_length} notes, but {notes_per_token} were expected"
+            )
 
     def _create_final_note(self, melody: list[Sound], offset: float) -> Sound:
         """Creates the final note of the melody, which is just a longer version
@@ -92,39 +132,75 @@ class MusicCreator:
         melody.append(self._create_final_note(melody, offset))
         return melody
 
-    def _measure_generator(self, n_groups: int) -> list[str]:
-        """Given the song length, expressed in number of 8-note groups, predicts
-        the notes and chords that the melody will contain (string form), using the
-        existing seeds.
+    def _measures_generator(
+        self, n_groups: list[int], rngs: list[random.Random], deadline: Optional[Deadline]
+    ) -> list[list[str]]:
+        """Predicts the notes and chords (string form) of several melodies at once, using the
+        existing seeds. Every step runs the model once for all the melodies which still need
+        groups, so the cost of a batch is close to the cost of its longest melody. Groups made of
+        a single repeated sound are predicted again, unless the melody had too many of them in a
+        row or another step does not fit in the deadline
 
         Args:
-            n_groups (int): Number of 8-note groups in the melody
+            n_groups (list[int]): Number of 8-note groups in every melody
+            rngs (list[random.Random]): Random generator of every melody, used to pick its seed
+            deadline (Optional[Deadline]): Time budget of the request, if any
 
         Returns:
-            list[str]: Notes and chords that will be used in the melody
+            list[list[str]]: Notes and chords that will be used in every melody
         """
-        seed = self._x_seed[np.random.randint(0, len(self._x_seed) - 1)][:]
-        measure: list[str] = []
-        while len(measure) < n_groups:
-            seed = seed.reshape(1, Constants.MUSIC_FEATURE_LENGTH, 1)
-            prediction = self._model.predict(seed, verbose=0)[0]
-            pos = np.argmax(prediction)
-            pos_n = pos / float(self._vocab_size)
-            group = self._reverse_index[pos]
-            if len(set(group.split("/"))) > 1:
-                measure.append(group)
-            seed = np.insert(seed[0], len(seed[0]), pos_n)
-            seed = seed[1:]
-
-        return measure
-
-    def _melody_generator(self, song_length: int, melody_info: MelodyInfo) -> list[str]:
-        """Wrapper over method that predicts the song notes and chords; responsible for
-        determining the exact number of groups that will be used, based on the song length
+        seed_indices = [rng.randrange(len(self._x_seed) - 1) for rng in rngs]
+        seeds = self._x_seed[seed_indices].reshape(len(n_groups), Constants.MUSIC_FEATURE_LENGTH)
+        measures: list[list[str]] = [[] for _ in n_groups]
+        active = [i for i, n in enumerate(n_groups) if n > 0]
+        max_rejections = 10
+        rejections = [0 for _ in n_groups]
+        step_duration = 0.0
+        while active:
+            step_start = time.monotonic()
+            # a group is predicted in one step, or note by note when the tokens are single notes
+            rows = seeds[active]
+            tokens: list[list[str]] = [[] for _ in active]
+            for _ in range(self._steps_per_group):
+                predictions = self._model(
+                    rows.reshape(len(active), Constants.MUSIC_FEATURE_LENGTH, 1)
+                )
+                positions = np.argmax(predictions, axis=-1)
+                for row_tokens, pos in zip(tokens, positions):
+                    row_tokens.append(self._reverse_index[pos])
+                rows = np.concatenate([rows[:, 1:], positions[:, None] / self._vocab_size], axis=1)
+            seeds[active] = rows
+            # a step usually takes as long as the previous one, or less
+            step_duration = time.monotonic() - step_start
+            for i, row_tokens in zip(active, tokens):
+                group = "/".join(row_tokens)
+                if len(set(group.split("/"))) > 1:
+                    measures[i].append(group)
+                    rejections[i] = 0
+                elif rejections[i] >= max_rejections or (
+                    deadline is not None and not deadline.allows(step_duration)
+                ):
+                    # a degenerate model or seed would otherwise never finish the melody
+                    if deadline is not None:
+                        deadline.degrade(Deadline.ACCEPTED_GROUP)
+                    measures[i].append(group)
+                    rejections[i] = 0
+                else:
+                    rejections[i] += 1
+            active = [i for i in active if len(measures[i]) < n_groups[i]]
+
+        return measures
+
+    def _melody_generator(
+        self, song_length: int, melody_info: MelodyInfo, measure: list[str]
+    ) -> list[str]:
+        """Determines the exact number of times the predicted groups are repeated, based on the
+        song length
 
         Args:
             song_length (int): Song length expressed in number of notes/chords
             melody_info (MelodyInfo): Information about the melody (ex. note durations)
+            measure (list[str]): Predicted groups of the melody
 
         Returns:
             list[str]: Notes and chords that will be used in the melody
@@ -133,35 +209,70 @@ class MusicCreator:
         assert (
             song_length >= group_duration * melody_info.n_groups
         ), "Song is too short for the given note durations and measure lengths"
-        measure = self._measure_generator(melody_info.n_groups)
         n_measures_in_song = int(song_length // group_duration // melody_info.n_groups)
         music = measure * n_measures_in_song
         return music
 
-    def _compose_melody_correct_mode(
-        self, song_length: int, melody_info: MelodyInfo
-    ) -> stream.Part:
-        """Repeatedly attempts to create a melody that is in the same mode (major / minor)
-        as the key provided in the melody info, so that it can easily be converted to it
+    def _compose_melodies_correct_mode(
+        self,
+        song_length: int,
+        melodies: list[MelodyInfo],
+        rngs: list[random.Random],
+        deadline: Optional[Deadline],
+    ) -> list[stream.Part]:
+        """Repeatedly attempts to create melodies that are in the same mode (major / minor)
+        as the keys provided in the melody infos, so that they can easily be converted to them.
+        Every attempt predicts the melodies which are still in the wrong mode as one batch.
+        Another attempt is only made if it fits in the deadline, otherwise the current melodies
+        are kept
 
         Args:
             song_length (int): Song length expressed in number of notes/chords
-            melody_info (MelodyInfo): Information about the melody (ex. note durations)
+            melodies (list[MelodyInfo]): Information about every melody (ex. note durations)
+            rngs (list[random.Random]): Random generator of every melody
+            deadline (Optional[Deadline]): Time budget of the request, if any
 
         Returns:
-            stream.Part: Melody object
+            list[stream.Part]: Melody objects
         """
-        major_target_key = any(c.isupper() for c in melody_info.key)
-        attempts = 5
-        while attempts:
-            notes = self._melody_generator(song_length, melody_info)
-            melody = self._create_notes_and_chords(notes, melody_info)
-            melody_midi = stream.Part(melody)
-            k: key.Key = melody_midi.analyze("key")
-            if k.mode == "major" and major_target_key or k.mode == "minor" and not major_target_key:
-                return melody_midi
+        melody_midis: list[stream.Part] = [stream.Part() for _ in melodies]
+        pending = list(range(len(melodies)))
+        max_attempts = 5
+        attempts = max_attempts
+        attempt_duration = 0.0
+        while pending and attempts:
+            # the first attempt is always made, so every melody exists
+            if (
+                deadline is not None
+                and attempts < max_attempts
+                and not deadline.allows(attempt_duration)
+            ):
+                deadline.degrade(Deadline.ACCEPTED_MELODY)
+                break
+            attempt_start = time.monotonic()
+            measures = self._measures_generator(
+                [melodies[i].n_groups for i in pending], [rngs[i] for i in pending], deadline
+            )
+            wrong_mode = []
+            for i, measure in zip(pending, measures):
+                melody_info = melodies[i]
+                notes = self._melody_generator(song_length, melody_info, measure)
+                melody = self._create_notes_and_chords(notes, melody_info)
+                melody_midis[i] = stream.Part(melody)
+                k: key.Key = melody_midis[i].analyze("key")
+                major_target_key = any(c.isupper() for c in melody_info.key)
+                if not (
+                    k.mode == "major"
+                    and major_target_key
+                    or k.mode == "minor"
+                    and not major_target_key
+                ):
+                    wrong_mode.append(i)
+            pending = wrong_mode
             attempts -= 1
-        return melody_midi
+            # an attempt usually takes as long as the previous one, or less
+            attempt_duration = time.monotonic() - attempt_start
+        return melody_midis
 
     def _transpose_melody(self, melody_midi: stream.Part, melody_info: MelodyInfo) -> stream.Part:
         """Transposes a melody to the key provided in the melody info. Both the source and the
@@ -181,33 +292,88 @@ class MusicCreator:
 
         return melody_midi
 
-    def _compose_melody(self, song_length: int, melody_info: MelodyInfo) -> stream.Part:
-        """Composes a melody with the correct key and instrument
+    def _finish_melody(self, melody_midi: stream.Part, melody_info: MelodyInfo) -> stream.Part:
+        """Sets the instrument of a melody and converts it to the correct key
 
         Args:
-            song_length (int): Song length expressed in number of notes/chords
+            melody_midi (stream.Part): Melody object, in the correct mode
             melody_info (MelodyInfo): Information about the melody
 
         Returns:
             stream.Part: Melody object
         """
-        melody_midi = self._compose_melody_correct_mode(song_length, melody_info)
         melody_midi.insert(0, melody_info.instrument)
         melody_midi = self._transpose_melody(melody_midi, melody_info)
         return melody_midi
 
-    def run(self, song_length: int, melodies: list[MelodyInfo]) -> stream.Score:
+    def run_batch(
+        self,
+        song_length: int,
+        songs: list[list[MelodyInfo]],
+        rngs: Optional[list[random.Random]] = None,
+        deadline: Optional[Deadline] = None,
+        on_melody: Optional[Callable[[int, int, int], None]] = None,
+    ) -> list[stream.Score]:
+        """Composes several songs at once. The melodies of all the songs are predicted together
+
+        Args:
+            song_length (int): Song length expressed in number of notes/chords
+            songs (list[list[MelodyInfo]]): Information about every melody of every song
+            rngs (Optional[list[random.Random]], optional): Random generator of every song.
+                Defaults to new unseeded generators.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_melody (Optional[Callable[[int, int, int], None]], optional): Called with the
+                song, position and number of melodies of the song as soon as a melody is
+                finished. Defaults to None.
+
+        Returns:
+            list[stream.Score]: Song objects
+        """
+        if rngs is None:
+            rngs = [random.Random() for _ in songs]
+        melodies = [melody_info for song in songs for melody_info in song]
+        # the melodies of a song share its generator, so a song does not depend on the others
+        melody_rngs = [rng for song, rng in zip(songs, rngs) for _ in song]
+        melody_midis = iter(
+            self._compose_melodies_correct_mode(song_length, melodies, melody_rngs, deadline)
+        )
+        scores = []
+        for s, song in enumerate(songs):
+            main_score = stream.Score()
+            for i, melody_info in enumerate(song):
+                main_score.insert(0, self._finish_melody(next(melody_midis), melody_info))
+                if on_melody is not None:
+                    on_melody(s, i, len(song))
+            scores.append(main_score)
+        return scores
+
+    def run(
+        self,
+        song_length: int,
+        melodies: list[MelodyInfo],
+        rng: Optional[random.Random] = None,
+        deadline: Optional[Deadline] = None,
+        on_melody: Optional[Callable[[int, int], None]] = None,
+    ) -> stream.Score:
         """Composes an entire song (can have multiple melodies)
 
         Args:
             song_length (int): Song length expressed in number of notes/chords
             melodies (list[MelodyInfo]): Information about every melody
+            rng (Optional[random.Random], optional): Random generator of the song. Defaults to a
+                new unseeded generator.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_melody (Optional[Callable[[int, int], None]], optional): Called with the position
+                and number of melodies as soon as a melody is finished. Defaults to None.
 
         Returns:
             stream.Score: Song object
         """
-        main_score = stream.Score()
-        for melody_info in melodies:
-            melody_midi = self._compose_melody(song_length, melody_info)
-            main_score.insert(0, melody_midi)
-        return main_score
+        on_song_melody = None
+        if on_melody is not None:
+            on_song_melody = lambda _, i, n_melodies: on_melody(i, n_melodies)
+        return self.run_batch(
+            song_length, [melodies], [rng or random.Random()], deadline, on_song_melody
+        )[0]
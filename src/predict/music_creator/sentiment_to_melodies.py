@@ -247,6 +247,14 @@ class SentimentToMelodies:
         Sentiment.TRUST: [1, 2],
     }
 
+    def __init__(self, rng: Optional[random.Random] = None) -> None:
+        """
+        Args:
+            rng (Optional[random.Random], optional): Random generator of the choices. Defaults
+                to a new unseeded generator.
+        """
+        self._rng = rng or random.Random()
+
     def _sample_properties(
         self,
         property_list: list,
@@ -267,8 +275,8 @@ class SentimentToMelodies:
         """
         n_properties = len(property_list)
         if identical:
-            return [random.choice(property_list)] * n_items
-        samples = random.sample(property_list * (n_items // n_properties + 1), n_items)
+            return [self._rng.choice(property_list)] * n_items
+        samples = self._rng.sample(property_list * (n_items // n_properties + 1), n_items)
         if durations:
             return sorted(samples, reverse=True)
         return samples
@@ -282,7 +290,7 @@ class SentimentToMelodies:
         Returns:
             list[MelodyInfo]: Information about every melody
         """
-        n_melodies: int = random.choice(self.N_MELODIES[sentiment])
+        n_melodies: int = self._rng.choice(self.N_MELODIES[sentiment])
         instrument_types: list[Type[instrument.Instrument]] = self._sample_properties(
             self.INSTRUMENTS[sentiment], n_melodies
         )
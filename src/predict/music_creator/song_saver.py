@@ -1,10 +1,19 @@
+import hashlib
+import json
+import os
 from pathlib import Path
-from typing import Optional
+import shutil
+from typing import Callable, Optional
+import uuid
 from music21 import stream
 import subprocess
 
+from constants import Constants
+
 
 class SongSaver:
+    SAMPLE_RATE = 44100
+
     @staticmethod
     def _save_midi_to_disk(
         main_score: stream.Score,
@@ -12,14 +21,48 @@ class SongSaver:
     ) -> None:
         main_score.write("midi", f"{output_name}.mid")
 
+    @staticmethod
+    def _render_key(output_name: str, fluidsynth_exe: Path, soundfont: Path) -> str:
+        """Identifies a rendering by the MIDI bytes and the renderer settings, so identical
+        scores rendered the same way share their audio
+
+        Args:
+            output_name (str): Name of the output files, without extension
+            fluidsynth_exe (Path): Synthesizer
+            soundfont (Path): Sound font used by the synthesizer
+
+        Returns:
+            str: Key of the rendering
+        """
+        soundfont_stat = soundfont.stat()
+        settings = [
+            str(fluidsynth_exe),
+            str(soundfont),
+            soundfont_stat.st_size,
+            soundfont_stat.st_mtime_ns,
+            SongSaver.SAMPLE_RATE,
+        ]
+        digest = hashlib.sha256(Path(f"{output_name}.mid").read_bytes())
+        digest.update(json.dumps(settings).encode())
+        return digest.hexdigest()
+
     @staticmethod
     def _save_audio_to_disk(
         output_name: str,
         fluidsynth_exe: Optional[Path],
         soundfont: Optional[Path],
+        cache_dir: Optional[str],
     ) -> None:
         if fluidsynth_exe and soundfont:
             try:
+                cached_path = None
+                if cache_dir:
+                    key = SongSaver._render_key(output_name, fluidsynth_exe, soundfont)
+                    cached_path = Path(cache_dir, f"{key}.wav")
+                    if cached_path.is_file():
+                        shutil.copyfile(cached_path, f"{output_name}.wav")
+                        return
+
                 subprocess.run(
                     [
                         str(fluidsynth_exe),
@@ -28,11 +71,18 @@ class SongSaver:
                         "-F",
                         f"{output_name}.wav",
                         "-r",
-                        "44100",
+                        str(SongSaver.SAMPLE_RATE),
                         "-q",
                     ],
                     check=True,
                 )
+
+                if cached_path is not None:
+                    # concurrent renderings of the same score never see a partial file
+                    cached_path.parent.mkdir(parents=True, exist_ok=True)
+                    temporary_path = cached_path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+                    shutil.copyfile(f"{output_name}.wav", temporary_path)
+                    os.replace(temporary_path, cached_path)
             except:
                 print("Could not convert to audio")
 
@@ -42,6 +92,23 @@ class SongSaver:
         output_name: str,
         fluidsynth_exe: Optional[Path],
         soundfont: Optional[Path],
+        cache_dir: Optional[str] = Constants.RENDER_CACHE_DIR,
+        on_midi_written: Optional[Callable[[], None]] = None,
     ) -> None:
+        """Saves a song as MIDI and, if a synthesizer is given, as WAV. The audio of a score which
+        was already rendered with the same settings is taken from the cache
+
+        Args:
+            main_score (stream.Score): Song object
+            output_name (str): Location of the output files, without extension
+            fluidsynth_exe (Optional[Path]): Synthesizer
+            soundfont (Optional[Path]): Sound font used by the synthesizer
+            cache_dir (Optional[str], optional): Directory of the rendered audio, by content, or
+                None to always render. Defaults to Constants.RENDER_CACHE_DIR.
+            on_midi_written (Optional[Callable[[], None]], optional): Called once the MIDI file
+                is written, before the audio is rendered. Defaults to None.
+        """
         SongSaver._save_midi_to_disk(main_score, output_name)
-        SongSaver._save_audio_to_disk(output_name, fluidsynth_exe, soundfont)
+        if on_midi_written is not None:
+            on_midi_written()
+        SongSaver._save_audio_to_disk(output_name, fluidsynth_exe, soundfont, cache_dir)
@@ -1,23 +1,71 @@
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass, field
 from datetime import datetime
+import json
 import pickle
 import threading
+import uuid
 
+from typing import Callable, Optional
 import numpy as np
+import tensorflow as tf
 from constants import Constants
 from sentiment import Sentiment
 from pathlib import Path
+from predict.artifact_bundle import ArtifactBundle
+from predict.batching_scheduler import BatchingScheduler
+from predict.deadline import Deadline
+from predict.inference_model import InferenceModel
+from predict.lyric_generation.clustered_softmax import ClusteredSoftmax
 from predict.lyric_generation.lyric_generator import LyricGenerator
 from predict.music_creator.music_creator import MusicCreator
 from predict.music_creator.sentiment_to_melodies import SentimentToMelodies
 from predict.music_creator.song_saver import SongSaver
+from predict.progress import (
+    AudioReady,
+    Classified,
+    GenerationFailed,
+    MelodyComposed,
+    MidiWritten,
+    ProgressCallback,
+    ProgressEvent,
+    VerseReady,
+)
+from predict.request_seed import RequestSeed
 from predict.sentiment_classifier.sentiment_classifier import SentimentClassifier
-from tensorflow.keras.models import load_model
+from predict.song_pool import SongPool
+from tensorflow.keras.models import Model, load_model
+
+
+@dataclass
+class GenerationResult:
+    sentiment: Sentiment
+    lyrics: list[str]
+    output_name: str
+    seed: int
+    # work which was cut to meet the time budget
+    degradations: list[str] = field(default_factory=list)
+
+    @property
+    def midi_path(self) -> Path:
+        return Predictor.output_path(self.output_name, "mid")
+
+    @property
+    def wav_path(self) -> Path:
+        return Predictor.output_path(self.output_name, "wav")
 
 
 class Predictor:
+    FLUIDSYNTH_EXE = Path("..\\FluidSynth\\fluidsynth.exe")
+    SOUNDFONT = Path("..\\FluidSynth\\GeneralUser GS v1.471.sf2")
+    # keys of `models`, known before the artifacts are loaded
+    MODEL_NAMES = ("sentiment", "music", "lyrics_encoder")
+
     def __init__(self) -> None:
         self._lyrics: list[str] = []
         self._sentiment: Sentiment
+        self._song_pool: Optional[SongPool] = None
+        self._deadline: Optional[Deadline] = None
 
     @property
     def lyrics(self) -> list[str]:
@@ -31,23 +79,165 @@ class Predictor:
     def output_name(self) -> str:
         return self._output_name
 
-    def load_artifacts(self) -> None:
-        """Loads the artifacts necessary for the classification and predictions"""
+    @property
+    def seed(self) -> int:
+        return self._seed
+
+    @property
+    def degradations(self) -> list[str]:
+        """Work which was cut to meet the time budget of the last request; the music is saved in
+        the background, so its degradations may still be added"""
+        return [] if self._deadline is None else self._deadline.degradations
+
+    def _load_artifacts_from_files(self) -> tuple[Model, Model, Model]:
+        """Loads the tokenizers, indices and seeds from their separate files
+
+        Returns:
+            tuple[Model, Model, Model]: Sentiment, music and lyrics models
+        """
         with open(Constants.SENTIMENT_TOKENIZER_PATH, "rb") as tokenizer_path:
             self._sentiment_tokenizer = pickle.load(tokenizer_path)
-        self._sentiment_model = load_model(Constants.SENTIMENT_MODEL_PATH)
-
         with open(Constants.MUSIC_REVERSE_INDEX_PATH, "rb") as reverse_index_path:
             self._music_reverse_index = pickle.load(reverse_index_path)
+        if Path(Constants.MUSIC_TOKEN_INFO_PATH).exists():
+            with open(Constants.MUSIC_TOKEN_INFO_PATH, "r") as token_info_path:
+                self._music_notes_per_token = json.load(token_info_path)["notes_per_token"]
         with open(Constants.MUSIC_SEED_PATH, "rb") as music_seed_path:
             self._music_seed = np.load(music_seed_path)
-        self._music_model = load_model(Constants.MUSIC_MODEL_PATH)
-
         with open(Constants.LYRICS_TOKENIZER_PATH, "rb") as tokenizer_path:
             self._lyrics_tokenizer = pickle.load(tokenizer_path)
-        self._lyrics_model = load_model(Constants.LYRICS_MODEL_PATH)
+        self._lyrics_seeds = LyricGenerator.load_seeds()
+        lyrics_model = load_model(Constants.LYRICS_MODEL_PATH)
+        kernel, bias = lyrics_model.layers[-1].get_weights()
+        self._lyrics_output_weights = (kernel, bias)
+        return (
+            load_model(Constants.SENTIMENT_MODEL_PATH),
+            load_model(Constants.MUSIC_MODEL_PATH),
+            lyrics_model,
+        )
+
+    def _load_data_from_bundle(self) -> None:
+        """Loads the tokenizers, indices, seeds and output weights of the lyrics model from the
+        memory-mapped artifact bundle, without TensorFlow. The music seed and the weights are read
+        directly from the mapping, so every process which maps the bundle shares their pages"""
+        self._bundle = ArtifactBundle(Constants.ARTIFACT_BUNDLE_PATH)
+        self._sentiment_tokenizer = self._bundle.object("sentiment_tokenizer")
+        self._music_reverse_index = self._bundle.object("music_reverse_index")
+        if "music_token_info" in self._bundle.manifest["entries"]:
+            token_info = self._bundle.object("music_token_info")
+            self._music_notes_per_token = token_info["notes_per_token"]
+        self._music_seed = self._bundle.array("music_seed")
+        self._lyrics_tokenizer = self._bundle.object("lyrics_tokenizer")
+        self._lyrics_seeds = self._bundle.object("lyrics_seeds")
+        # the output layer comes last, so its kernel and bias are the last weights
+        kernel, bias = self._bundle.weights("lyrics")[-2:]
+        self._lyrics_output_weights = (kernel, bias)
+
+    def _load_artifacts_from_bundle(self) -> tuple[Model, Model, Model]:
+        """Loads the tokenizers, indices and seeds from the memory-mapped artifact bundle. The
+        music seed and the model weights are read directly from the mapping
+
+        Returns:
+            tuple[Model, Model, Model]: Sentiment, music and lyrics models
+        """
+        self._load_data_from_bundle()
+        return (
+            self._bundle.model("sentiment"),
+            self._bundle.model("music"),
+            self._bundle.model("lyrics"),
+        )
+
+    def load_artifacts(self, max_batch_size: Optional[int] = None) -> None:
+        """Loads the artifacts necessary for the classification and predictions, from the bundle
+        if one was exported, otherwise from the separate files. The models are wrapped in compiled
+        inference functions, which are traced here, before the first request
+
+        Args:
+            max_batch_size (Optional[int], optional): If set, the model calls of concurrent
+                requests are batched, up to this many rows, which is useful when serving many
+                requests at once. Defaults to None.
+
+        Raises:
+            ValueError: If the music tokens do not match the number of notes per token they were
+                saved with
+        """
+        # artifacts saved before the number of notes per token was recorded used the default
+        self._music_notes_per_token = Constants.MUSIC_NOTES_PER_TOKEN
+        if Path(Constants.ARTIFACT_BUNDLE_PATH).exists():
+            sentiment_model, music_model, lyrics_model = self._load_artifacts_from_bundle()
+        else:
+            sentiment_model, music_model, lyrics_model = self._load_artifacts_from_files()
+        MusicCreator.check_notes_per_token(self._music_reverse_index, self._music_notes_per_token)
 
-    def _classify_sentiment(self, prompt: str) -> Sentiment:
+        self._sentiment_model: InferenceModel | BatchingScheduler = InferenceModel(
+            sentiment_model, (Constants.SENTIMENT_MAX_SEQ_LEN,), tf.int32
+        )
+        self._music_model: InferenceModel | BatchingScheduler = InferenceModel(
+            music_model, (Constants.MUSIC_FEATURE_LENGTH, 1), tf.float32
+        )
+        if max_batch_size:
+            self._sentiment_model = BatchingScheduler(self._sentiment_model, max_batch_size)
+            self._music_model = BatchingScheduler(self._music_model, max_batch_size)
+        lyrics_encoder: InferenceModel | BatchingScheduler = InferenceModel(
+            Model(lyrics_model.inputs, lyrics_model.layers[-1].input),
+            tuple(lyrics_model.input_shape[1:]),
+            tf.int32,
+        )
+        if max_batch_size:
+            lyrics_encoder = BatchingScheduler(lyrics_encoder, max_batch_size)
+        self._lyrics_model = ClusteredSoftmax(
+            lyrics_encoder,
+            *self._lyrics_output_weights,
+            Constants.LYRICS_SOFTMAX_HEAD_SIZE,
+            Constants.LYRICS_SOFTMAX_CLUSTER_SIZE,
+        )
+
+        for model in [self._sentiment_model, self._music_model, self._lyrics_model]:
+            model.warm_up()
+
+    @property
+    def models(self) -> dict[str, InferenceModel | BatchingScheduler]:
+        """Models which run on TensorFlow, by name; the output layer of the lyrics model runs on
+        numpy, so only its encoder is included"""
+        return {
+            "sentiment": self._sentiment_model,
+            "music": self._music_model,
+            "lyrics_encoder": self._lyrics_model.encoder,
+        }
+
+    def load_bundle_with_models(
+        self, models: dict[str, Callable[[np.ndarray], np.ndarray]]
+    ) -> None:
+        """Loads the artifacts from the bundle without TensorFlow, for processes which call the
+        models through proxies which forward the calls to another process. The music seed and
+        the output weights of the lyrics model stay in the mapping of the bundle, so they are
+        shared with the other processes instead of being copied
+
+        Args:
+            models (dict[str, Callable[[np.ndarray], np.ndarray]]): Models, by name (see
+                `MODEL_NAMES`)
+
+        Raises:
+            ValueError: If no bundle was exported, or the music tokens do not match the number
+                of notes per token they were saved with
+        """
+        if not Path(Constants.ARTIFACT_BUNDLE_PATH).exists():
+            raise ValueError(
+                f"No artifact bundle at {Constants.ARTIFACT_BUNDLE_PATH}, export it first"
+            )
+        self._music_notes_per_token = Constants.MUSIC_NOTES_PER_TOKEN
+        self._load_data_from_bundle()
+        MusicCreator.check_notes_per_token(self._music_reverse_index, self._music_notes_per_token)
+        self._sentiment_model = models["sentiment"]
+        self._music_model = models["music"]
+        self._lyrics_model = ClusteredSoftmax(
+            models["lyrics_encoder"],
+            *self._lyrics_output_weights,
+            Constants.LYRICS_SOFTMAX_HEAD_SIZE,
+            Constants.LYRICS_SOFTMAX_CLUSTER_SIZE,
+        )
+
+    def classify(self, prompt: str) -> Sentiment:
         """Classifies the sentiment expressed in the prompt
 
         Args:
@@ -62,44 +252,414 @@ class Predictor:
         sentiment: Sentiment = sentiment_classifier.run(prompt)
         return sentiment
 
-    def _generate_music(self) -> None:
-        """Generates music and saves it to disk"""
-        music_creator = MusicCreator(self._music_model, self._music_seed, self._music_reverse_index)
-        melodies = SentimentToMelodies().run(self._sentiment)
-        main_score = music_creator.run(128, melodies)
-        SongSaver.save_song_to_disk(
-            main_score,
-            f"{Constants.OUTPUT_SAVE_DIR}/{self._output_name}",
-            Path("..\\FluidSynth\\fluidsynth.exe"),
-            Path("..\\FluidSynth\\GeneralUser GS v1.471.sf2"),
+    @staticmethod
+    def new_output_name() -> str:
+        """Creates a name for the output files of a request. The timestamp is followed by a random
+        suffix, so concurrent requests never share their files
+
+        Returns:
+            str: Name of the output files, without extension
+        """
+        timestamp = str(datetime.now()).replace(" ", "___").replace(":", "_")[:-7]
+        return f"{timestamp}_{uuid.uuid4().hex[:8]}"
+
+    @staticmethod
+    def output_path(output_name: str, extension: str) -> Path:
+        """Gets the location of an output file of a request
+
+        Args:
+            output_name (str): Name of the output files, without extension
+            extension (str): Extension of the file ("mid", "wav" or "txt")
+
+        Returns:
+            Path: Location of the file
+        """
+        return Path(Constants.OUTPUT_SAVE_DIR, f"{output_name}.{extension}")
+
+    @staticmethod
+    def _audio_event(output_name: str) -> AudioReady | GenerationFailed:
+        """Reports whether the audio of a saved song exists; rendering failures are not raised
+
+        Args:
+            output_name (str): Name of the output files, without extension
+
+        Returns:
+            AudioReady | GenerationFailed: Event describing the audio of the song
+        """
+        wav_path = Predictor.output_path(output_name, "wav")
+        if wav_path.is_file():
+            return AudioReady(wav_path)
+        return GenerationFailed("The song could not be converted to audio")
+
+    def generate_song(
+        self,
+        sentiment: Sentiment,
+        output_name: str,
+        song_length: int = 128,
+        seed: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        """Generates music and saves it to disk, as MIDI and WAV
+
+        Args:
+            sentiment (Sentiment): Sentiment of the song
+            output_name (str): Name of the output files, without extension
+            song_length (int, optional): Song length expressed in number of notes/chords.
+                Defaults to 128.
+            seed (Optional[int], optional): Seed of the song. Defaults to a new seed.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_progress (Optional[ProgressCallback], optional): Receives the melody, MIDI and
+                audio events of the song. Defaults to None.
+        """
+        seeds = None if seed is None else [seed]
+        on_song_progress = None
+        if on_progress is not None:
+            on_song_progress = lambda _, event: on_progress(event)
+        self.generate_song_variants(
+            sentiment, [output_name], song_length, seeds, deadline, on_song_progress
+        )
+
+    def generate_song_variants(
+        self,
+        sentiment: Sentiment,
+        output_names: list[str],
+        song_length: int = 128,
+        seeds: Optional[list[int]] = None,
+        deadline: Optional[Deadline] = None,
+        on_progress: Optional[Callable[[int, ProgressEvent], None]] = None,
+    ) -> None:
+        """Generates several songs with the same sentiment, each with its own melodies, and saves
+        them to disk, as MIDI and WAV. The melodies of all the songs are predicted as one batch
+
+        Args:
+            sentiment (Sentiment): Sentiment of the songs
+            output_names (list[str]): Name of the output files of every song, without extension
+            song_length (int, optional): Song length expressed in number of notes/chords.
+                Defaults to 128.
+            seeds (Optional[list[int]], optional): Seed of every song. Defaults to new seeds.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_progress (Optional[Callable[[int, ProgressEvent], None]], optional): Called with
+                the position of the song and the event, for the melody, MIDI and audio events of
+                every song. Defaults to None.
+        """
+        seeds = seeds or [RequestSeed.new() for _ in output_names]
+        rngs = [RequestSeed.rng(seed, "music") for seed in seeds]
+        music_creator = MusicCreator(
+            self._music_model,
+            self._music_seed,
+            self._music_reverse_index,
+            self._music_notes_per_token,
         )
+        songs = [SentimentToMelodies(rng).run(sentiment) for rng in rngs]
+        on_melody = None
+        if on_progress is not None:
+            on_melody = lambda s, i, n_melodies: on_progress(s, MelodyComposed(i, n_melodies))
+        scores = music_creator.run_batch(song_length, songs, rngs, deadline, on_melody)
+        for s, (output_name, score) in enumerate(zip(output_names, scores)):
+            on_midi_written = None
+            if on_progress is not None:
+                midi_path = self.output_path(output_name, "mid")
+                on_midi_written = lambda s=s, path=midi_path: on_progress(s, MidiWritten(path))
+            SongSaver.save_song_to_disk(
+                score,
+                str(Path(Constants.OUTPUT_SAVE_DIR, output_name)),
+                self.FLUIDSYNTH_EXE,
+                self.SOUNDFONT,
+                on_midi_written=on_midi_written,
+            )
+            if on_progress is not None:
+                on_progress(s, self._audio_event(output_name))
 
-    def _generate_lyrics(self, n_verses: int) -> list[str]:
-        """Generates verses and saves output to disk
+    def generate_lyrics(
+        self,
+        sentiment: Sentiment,
+        n_verses: int,
+        output_name: Optional[str] = None,
+        seed: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> list[str]:
+        """Generates verses and, if an output name is given, saves them to disk
 
         Args:
+            sentiment (Sentiment): Sentiment of the verses
             n_verses (int): Number of verses
+            output_name (Optional[str], optional): Name of the output file, without extension.
+                Defaults to None.
+            seed (Optional[int], optional): Seed of the song. Defaults to a new seed.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_progress (Optional[ProgressCallback], optional): Receives an event for every
+                verse, as soon as it is ready. Defaults to None.
 
         Returns:
             list[str]: List of verses
         """
+        seeds = None if seed is None else [seed]
+        on_set_progress = None
+        if on_progress is not None:
+            on_set_progress = lambda _, event: on_progress(event)
+        return self.generate_lyrics_variants(
+            sentiment, n_verses, [output_name], seeds, deadline, on_set_progress
+        )[0]
+
+    def generate_lyrics_variants(
+        self,
+        sentiment: Sentiment,
+        n_verses: int,
+        output_names: list[Optional[str]],
+        seeds: Optional[list[int]] = None,
+        deadline: Optional[Deadline] = None,
+        on_progress: Optional[Callable[[int, ProgressEvent], None]] = None,
+    ) -> list[list[str]]:
+        """Generates several sets of verses with the same sentiment, decoded as one batch, and
+        saves the sets which have an output name to disk
+
+        Args:
+            sentiment (Sentiment): Sentiment of the verses
+            n_verses (int): Number of verses of every set
+            output_names (list[Optional[str]]): Name of the output file of every set, without
+                extension, or None if the set is not saved
+            seeds (Optional[list[int]], optional): Seed of every set. Defaults to new seeds.
+            deadline (Optional[Deadline], optional): Time budget of the request. Defaults to
+                None.
+            on_progress (Optional[Callable[[int, ProgressEvent], None]], optional): Called with
+                the position of the set and an event for every verse, as soon as it is ready.
+                Defaults to None.
+
+        Returns:
+            list[list[str]]: Verses of every set
+        """
+        seeds = seeds or [RequestSeed.new() for _ in output_names]
         lyric_generator = LyricGenerator(
-            Constants.LYRICS_MAX_SEQ_LEN, self._lyrics_tokenizer, self._lyrics_model
+            Constants.LYRICS_MAX_SEQ_LEN,
+            self._lyrics_tokenizer,
+            self._lyrics_model,
+            self._lyrics_seeds,
+        )
+        on_verse = None
+        if on_progress is not None:
+            on_verse = lambda v, i, verse: on_progress(v, VerseReady(i, verse))
+        variants = lyric_generator.run_batch(
+            n_verses,
+            sentiment,
+            [RequestSeed.rng(seed, "lyrics") for seed in seeds],
+            deadline,
+            on_verse,
+        )
+        for output_name, lyrics in zip(output_names, variants):
+            if output_name is not None:
+                self.output_path(output_name, "txt").write_text("\n".join(lyrics))
+        return variants
+
+    def generate(
+        self,
+        prompt: str,
+        n_verses: int,
+        seed: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> GenerationResult:
+        """Given a prompt, detects the sentiment expressed in it and creates verses and melodies
+        accordingly. Nothing is stored in the predictor, so concurrent requests can share it
+
+        Args:
+            prompt (str): Prompt that is used for classifying the sentiment
+            n_verses (int): Number of output verses
+            seed (Optional[int], optional): Seed of the song; the same prompt, number of verses
+                and seed always give the same song. Defaults to a new seed.
+            time_budget (Optional[float], optional): Seconds the generation should take at most;
+                work is cut when the budget gets short. Defaults to no limit.
+            on_progress (Optional[ProgressCallback], optional): Receives the events of every
+                stage, from the threads which run them. Defaults to None.
+
+        Returns:
+            GenerationResult: Sentiment, verses, name of the output files, seed and degradations
+        """
+        deadline = None if time_budget is None else Deadline(time_budget)
+        seed = RequestSeed.new() if seed is None else seed
+        sentiment = self.classify(prompt)
+        if on_progress is not None:
+            on_progress(Classified(sentiment))
+        output_name = self.new_output_name()
+        music_thread = threading.Thread(
+            target=self.generate_song,
+            args=(sentiment, output_name, 128, seed, deadline, on_progress),
         )
-        lyrics = lyric_generator.run(n_verses, self._sentiment)
-        Path(f"{Constants.OUTPUT_SAVE_DIR}/{self._output_name}.txt").write_text("\n".join(lyrics))
+        music_thread.start()
+        lyrics = self.generate_lyrics(sentiment, n_verses, output_name, seed, deadline, on_progress)
+        music_thread.join()
+        degradations = [] if deadline is None else deadline.degradations
+        return GenerationResult(sentiment, lyrics, output_name, seed, degradations)
+
+    def run_variants(
+        self,
+        prompt: str,
+        n: int,
+        n_verses: int,
+        seed: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[GenerationResult]:
+        """Given a prompt, detects the sentiment expressed in it once and creates several songs
+        accordingly, each with its own verses and melodies. The verses of all the songs, and their
+        melodies, are decoded as batches, so n songs cost little more than one
+
+        Args:
+            prompt (str): Prompt that is used for classifying the sentiment
+            n (int): Number of songs
+            n_verses (int): Number of output verses of every song
+            seed (Optional[int], optional): Seed of the request, from which the seed of every
+                song is derived. Defaults to new seeds.
+            time_budget (Optional[float], optional): Seconds the generation should take at most;
+                work is cut when the budget gets short. Defaults to no limit.
+
+        Returns:
+            list[GenerationResult]: Sentiment, verses, name of the output files, seed and
+                degradations of every song; `generate` with the seed of a song gives the same
+                song, unless it was degraded
+        """
+        deadline = None if time_budget is None else Deadline(time_budget)
+        seeds = (
+            [RequestSeed.new() for _ in range(n)] if seed is None else RequestSeed.derive(seed, n)
+        )
+        sentiment = self.classify(prompt)
+        output_names = [self.new_output_name() for _ in range(n)]
+        music_thread = threading.Thread(
+            target=self.generate_song_variants,
+            args=(sentiment, output_names, 128, seeds, deadline),
+        )
+        music_thread.start()
+        variants = self.generate_lyrics_variants(sentiment, n_verses, output_names, seeds, deadline)
+        music_thread.join()
+        degradations = [] if deadline is None else deadline.degradations
+        return [
+            GenerationResult(sentiment, lyrics, output_name, seed, degradations)
+            for lyrics, output_name, seed in zip(variants, output_names, seeds)
+        ]
+
+    def _generate_to_files(
+        self,
+        sentiment: Sentiment,
+        n_verses: int,
+        output_name: str,
+        seed: int,
+        checkpoint: Callable[[], None],
+    ) -> list[str]:
+        """Generates a whole song and saves its files, before returning
+
+        Args:
+            sentiment (Sentiment): Sentiment of the song
+            n_verses (int): Number of verses
+            output_name (str): Name of the output files, without extension
+            seed (int): Seed of the song
+            checkpoint (Callable[[], None]): Called after every verse, after every melody and
+                before the rendering, so the generation can be paused there
+
+        Returns:
+            list[str]: List of verses
+        """
+        # the progress events mark the ends of the stages
+        lyrics = self.generate_lyrics(
+            sentiment, n_verses, output_name, seed, on_progress=lambda _: checkpoint()
+        )
+        self.generate_song(sentiment, output_name, 128, seed, on_progress=lambda _: checkpoint())
         return lyrics
 
-    def run(self, prompt: str, n_verses: int) -> None:
+    def start_song_pool(
+        self,
+        n_verses_options: list[int] = Constants.SONG_POOL_N_VERSES,
+        pool_size: int = Constants.SONG_POOL_SIZE,
+    ) -> None:
+        """Starts keeping ready songs in the background, which `run` hands out when it can. The
+        artifacts must be loaded
+
+        Args:
+            n_verses_options (list[int], optional): Numbers of verses for which songs are kept
+                ready. Defaults to Constants.SONG_POOL_N_VERSES.
+            pool_size (int, optional): Maximum number of ready songs for every sentiment and
+                number of verses. Defaults to Constants.SONG_POOL_SIZE.
+        """
+        self._song_pool = SongPool(self._generate_to_files, n_verses_options, pool_size)
+        self._song_pool.start()
+
+    def _live_request(self) -> AbstractContextManager:
+        return self._song_pool.live_request() if self._song_pool else nullcontext()
+
+    def _generate_song_live(
+        self,
+        sentiment: Sentiment,
+        output_name: str,
+        seed: int,
+        deadline: Optional[Deadline],
+        on_progress: Optional[ProgressCallback],
+    ) -> None:
+        with self._live_request():
+            try:
+                self.generate_song(sentiment, output_name, 128, seed, deadline, on_progress)
+            except Exception as e:
+                # the caller is not waiting for this thread, so it has to be told
+                if on_progress is not None:
+                    on_progress(GenerationFailed(f"The song could not be generated: {e}"))
+                raise
+
+    def run(
+        self,
+        prompt: str,
+        n_verses: int,
+        seed: Optional[int] = None,
+        time_budget: Optional[float] = None,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
         """Given a prompt, detects the sentiment expressed in it and creates
-        verses and melodies accordingly
+        verses and melodies accordingly. If no seed is given and a ready song matches the
+        request, it is handed out right away, otherwise the music is saved in the background.
+        The end of the music is only known from the audio event (or the failure event)
 
         Args:
             prompt (str): Prompt that is used for classifying the sentiment
             n_verses (int): Number of output verses
+            seed (Optional[int], optional): Seed of the song. Defaults to a new seed.
+            time_budget (Optional[float], optional): Seconds the generation should take at most;
+                work is cut when the budget gets short. Defaults to no limit.
+            on_progress (Optional[ProgressCallback], optional): Receives the events of every
+                stage, from the threads which run them. Defaults to None.
         """
-        self._sentiment = self._classify_sentiment(prompt)
-        self._output_name = str(datetime.now()).replace(" ", "___").replace(":", "_")[:-7]
-        music_thread = threading.Thread(target=self._generate_music)
-        music_thread.start()
-        self._lyrics = self._generate_lyrics(n_verses)
+        self._deadline = None if time_budget is None else Deadline(time_budget)
+        with self._live_request():
+            self._sentiment = self.classify(prompt)
+            if on_progress is not None:
+                on_progress(Classified(self._sentiment))
+            self._output_name = self.new_output_name()
+            if self._song_pool and seed is None:
+                song = self._song_pool.take(self._sentiment, n_verses, self._output_name)
+                if song is not None:
+                    self._lyrics, self._seed = song
+                    if on_progress is not None:
+                        for i, verse in enumerate(self._lyrics):
+                            on_progress(VerseReady(i, verse))
+                        on_progress(MidiWritten(self.output_path(self._output_name, "mid")))
+                        on_progress(self._audio_event(self._output_name))
+                    return
+            self._seed = RequestSeed.new() if seed is None else seed
+            music_thread = threading.Thread(
+                target=self._generate_song_live,
+                args=(
+                    self._sentiment,
+                    self._output_name,
+                    self._seed,
+                    self._deadline,
+                    on_progress,
+                ),
+            )
+            music_thread.start()
+            self._lyrics = self.generate_lyrics(
+                self._sentiment,
+                n_verses,
+                self._output_name,
+                self._seed,
+                self._deadline,
+                on_progress,
+            )
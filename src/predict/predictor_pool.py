@@ -0,0 +1,276 @@
+from concurrent.futures import Future
+import itertools
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Optional
+import numpy as np
+
+from constants import Constants
+from predict.deadline import Deadline
+from predict.predict import GenerationResult, Predictor
+from sentiment import Sentiment
+
+
+class ModelProxy:
+    """Stands in for a model inside a worker process, forwarding every call to the parent"""
+
+    def __init__(self, connection: Connection) -> None:
+        self._connection = connection
+        self._lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        pass
+
+    def __call__(self, x: np.ndarray) -> np.ndarray:
+        with self._lock:
+            self._connection.send(np.asarray(x))
+            output = self._connection.recv()
+        if isinstance(output, Exception):
+            raise output
+        return output
+
+
+class PredictorPool:
+    """Runs the requests of a predictor in pre-forked worker processes, so the music21-heavy
+    composition of several songs runs in parallel, outside of the GIL of a single process.
+
+    The workers are forked first, while the process has a single thread: loading the artifacts
+    starts the thread pools of TensorFlow and the batching threads, and a process forked from a
+    multithreaded one can deadlock on the locks those threads held. Every worker then maps the
+    artifact bundle itself, so the music seed and the output weights of the lyrics model are
+    shared through the page cache instead of being copied per worker. The TensorFlow models only
+    run in the parent: the workers call them through proxies, and the parent runs the calls of
+    all workers through the predictor's models (batched, if a batch size is given).
+
+    If a worker dies, the pool is broken, as a `ProcessPoolExecutor` would be: the other workers
+    are stopped and every pending and later request fails, instead of waiting forever. Has the
+    same request methods as `Predictor`"""
+
+    def __init__(
+        self,
+        predictor: Predictor,
+        n_workers: int = os.cpu_count() or 1,
+        max_batch_size: Optional[int] = None,
+    ) -> None:
+        """
+        Args:
+            predictor (Predictor): Predictor whose artifacts are not loaded yet; the pool loads
+                them after forking the workers
+            n_workers (int, optional): Number of worker processes. Defaults to the CPU count.
+            max_batch_size (Optional[int], optional): Batch size the artifacts are loaded with,
+                see `Predictor.load_artifacts`. Defaults to None.
+
+        Raises:
+            ValueError: If no artifact bundle was exported, since the workers map it
+        """
+        if not Path(Constants.ARTIFACT_BUNDLE_PATH).exists():
+            raise ValueError(
+                f"No artifact bundle at {Constants.ARTIFACT_BUNDLE_PATH}, export it first"
+            )
+        self._predictor = predictor
+        self._n_workers = n_workers
+        context = multiprocessing.get_context("fork")
+        self._tasks = context.SimpleQueue()
+        self._results = context.SimpleQueue()
+        self._pending: dict[int, tuple[Future, list[Deadline]]] = {}
+        self._pending_lock = threading.Lock()
+        # set once a worker died, with the error every request fails with
+        self._broken: Optional[RuntimeError] = None
+        self._job_ids = itertools.count()
+
+        connections = [
+            {name: context.Pipe() for name in Predictor.MODEL_NAMES} for _ in range(n_workers)
+        ]
+        self._workers = [
+            context.Process(
+                target=self._run_worker,
+                args=({name: child for name, (_, child) in pipes.items()},),
+                daemon=True,
+            )
+            for pipes in connections
+        ]
+        for worker in self._workers:
+            worker.start()
+
+        predictor.load_artifacts(max_batch_size)
+        models = predictor.models
+        self._threads = [
+            threading.Thread(target=self._collect_results, daemon=True),
+            threading.Thread(target=self._watch_workers, daemon=True),
+        ]
+        for pipes in connections:
+            for name, (parent, _) in pipes.items():
+                self._threads.append(
+                    threading.Thread(
+                        target=self._serve_model, args=(models[name], parent), daemon=True
+                    )
+                )
+        for thread in self._threads:
+            thread.start()
+
+    def _run_worker(self, connections: dict[str, Connection]) -> None:
+        """Maps the artifact bundle, then runs requests until the pool is closed. Runs in a worker
+        process
+
+        Args:
+            connections (dict[str, Connection]): Connection to the parent for every model
+        """
+        self._predictor.load_bundle_with_models(
+            {name: ModelProxy(c) for name, c in connections.items()}
+        )
+        while (task := self._tasks.get()) is not None:
+            job_id, method, args = task
+            try:
+                value, error = getattr(self._predictor, method)(*args), None
+            except Exception as e:
+                value, error = None, RuntimeError(f"{method} failed: {e!r}")
+            # the worker has its own copy of the deadlines, so their degradations are sent back
+            degradations = [arg.degradations for arg in args if isinstance(arg, Deadline)]
+            self._results.put((job_id, error, value, degradations))
+
+    @staticmethod
+    def _serve_model(model: Callable[[np.ndarray], np.ndarray], connection: Connection) -> None:
+        """Runs the model calls of a worker. Runs in a thread of the parent
+
+        Args:
+            model (Callable[[np.ndarray], np.ndarray]): Model
+            connection (Connection): Connection to the worker
+        """
+        while True:
+            try:
+                x = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                output = model(x)
+            except Exception as e:
+                output = e
+            connection.send(output)
+
+    def _watch_workers(self) -> None:
+        """Breaks the pool as soon as a worker dies. Runs in a thread of the parent"""
+        remaining = {worker.sentinel: worker for worker in self._workers}
+        while remaining:
+            for sentinel in wait(list(remaining)):
+                worker = remaining.pop(sentinel)
+                worker.join()
+                if worker.exitcode != 0:
+                    self._break(RuntimeError(f"A worker exited with code {worker.exitcode}"))
+                    return
+
+    def _break(self, error: RuntimeError) -> None:
+        """Fails the pending requests and stops the workers. The requests a dead worker was
+        running cannot be told apart from the queued ones, and a worker killed while reading the
+        queue can block the others, so the pool is not used any more
+
+        Args:
+            error (RuntimeError): Error the requests fail with
+        """
+        with self._pending_lock:
+            self._broken = error
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future, _ in pending:
+            future.set_exception(error)
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+
+    def _collect_results(self) -> None:
+        """Completes the futures of the finished requests. Runs in a thread of the parent"""
+        while (result := self._results.get()) is not None:
+            job_id, error, value, degradations = result
+            with self._pending_lock:
+                if job_id not in self._pending:
+                    # already failed by a broken pool
+                    continue
+                future, deadlines = self._pending.pop(job_id)
+            for deadline, deadline_degradations in zip(deadlines, degradations):
+                for degradation in deadline_degradations:
+                    deadline.degrade(degradation)
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(value)
+
+    def submit(self, method: str, *args) -> Future:
+        """Queues a request for the workers
+
+        Args:
+            method (str): Request method of the predictor
+
+        Returns:
+            Future: Result of the request
+
+        Raises:
+            RuntimeError: If a worker died, so the pool is broken
+        """
+        future: Future = Future()
+        job_id = next(self._job_ids)
+        deadlines = [arg for arg in args if isinstance(arg, Deadline)]
+        with self._pending_lock:
+            if self._broken is not None:
+                raise self._broken
+            self._pending[job_id] = (future, deadlines)
+        self._tasks.put((job_id, method, args))
+        return future
+
+    @staticmethod
+    def new_output_name() -> str:
+        return Predictor.new_output_name()
+
+    def classify(self, prompt: str) -> Sentiment:
+        return self.submit("classify", prompt).result()
+
+    def generate_song(
+        self,
+        sentiment: Sentiment,
+        output_name: str,
+        song_length: int = 128,
+        seed: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> None:
+        self.submit("generate_song", sentiment, output_name, song_length, seed, deadline).result()
+
+    def generate_lyrics(
+        self,
+        sentiment: Sentiment,
+        n_verses: int,
+        output_name: Optional[str] = None,
+        seed: Optional[int] = None,
+        deadline: Optional[Deadline] = None,
+    ) -> list[str]:
+        return self.submit(
+            "generate_lyrics", sentiment, n_verses, output_name, seed, deadline
+        ).result()
+
+    def generate(
+        self,
+        prompt: str,
+        n_verses: int,
+        seed: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> GenerationResult:
+        return self.submit("generate", prompt, n_verses, seed, time_budget).result()
+
+    def run_variants(
+        self,
+        prompt: str,
+        n: int,
+        n_verses: int,
+        seed: Optional[int] = None,
+        time_budget: Optional[float] = None,
+    ) -> list[GenerationResult]:
+        return self.submit("run_variants", prompt, n, n_verses, seed, time_budget).result()
+
+    def close(self) -> None:
+        """Stops the workers, once the queued requests are done"""
+        if self._broken is None:
+            for _ in self._workers:
+                self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
@@ -0,0 +1,44 @@
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable
+
+from sentiment import Sentiment
+
+
+@dataclass
+class Classified:
+    sentiment: Sentiment
+
+
+@dataclass
+class VerseReady:
+    index: int
+    verse: str
+
+
+@dataclass
+class MelodyComposed:
+    index: int
+    n_melodies: int
+
+
+@dataclass
+class MidiWritten:
+    path: Path
+
+
+@dataclass
+class AudioReady:
+    path: Path
+
+
+@dataclass
+class GenerationFailed:
+    message: str
+
+
+ProgressEvent = (
+    Classified | VerseReady | MelodyComposed | MidiWritten | AudioReady | GenerationFailed
+)
+# called from the threads of the generation, so it must be thread-safe (for instance queue.put)
+ProgressCallback = Callable[[ProgressEvent], None]
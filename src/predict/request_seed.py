@@ -0,0 +1,45 @@
+import os
+import random
+
+
+class RequestSeed:
+    """Seeds the random choices of a request. Every stage of the generation gets its own random
+    generator, derived from the seed of the request and the name of the stage, so stages which run
+    in parallel threads do not change each other's choices, and the same seed always gives the
+    same song"""
+
+    @staticmethod
+    def new() -> int:
+        """Draws a seed for a request which does not give one
+
+        Returns:
+            int: Seed
+        """
+        return int.from_bytes(os.urandom(4), "little")
+
+    @staticmethod
+    def rng(seed: int, stage: str) -> random.Random:
+        """Creates the random generator of a stage
+
+        Args:
+            seed (int): Seed of the request
+            stage (str): Name of the stage
+
+        Returns:
+            random.Random: Random generator of the stage
+        """
+        return random.Random(f"{seed}/{stage}")
+
+    @staticmethod
+    def derive(seed: int, n: int) -> list[int]:
+        """Derives the seeds of the songs of a request which makes several songs
+
+        Args:
+            seed (int): Seed of the request
+            n (int): Number of songs
+
+        Returns:
+            list[int]: Seed of every song
+        """
+        rng = RequestSeed.rng(seed, "variants")
+        return [rng.getrandbits(32) for _ in range(n)]
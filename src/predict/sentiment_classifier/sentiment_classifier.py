@@ -2,13 +2,16 @@ import numpy as np
 from sentiment import Sentiment
 from tensorflow.keras.preprocessing.sequence import pad_sequences
 from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.models import Model
+from predict.batching_scheduler import BatchingScheduler
+from predict.inference_model import InferenceModel
 
 
 class SentimentClassifier:
     CONFIDENCE_THRESHOLD = 0.4
 
-    def __init__(self, tokenizer: Tokenizer, model: Model, max_seq_len: int) -> None:
+    def __init__(
+        self, tokenizer: Tokenizer, model: InferenceModel | BatchingScheduler, max_seq_len: int
+    ) -> None:
         self._tokenizer = tokenizer
         self._model = model
         self._max_seq_len = max_seq_len
@@ -26,7 +29,7 @@ class SentimentClassifier:
         seq = self._tokenizer.texts_to_sequences([prompt])
         padded = pad_sequences(seq, maxlen=self._max_seq_len)
 
-        prediction = self._model.predict(padded)
+        prediction = self._model(padded)
 
         max_index = np.argmax(prediction)
         prediction_confidence = prediction[0][max_index]
@@ -0,0 +1,210 @@
+from collections import deque
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import threading
+from typing import Callable, Iterator, Optional
+
+from constants import Constants
+from predict.request_seed import RequestSeed
+from sentiment import Sentiment
+
+
+class SongPool:
+    """Keeps a few fully rendered songs (lyrics, MIDI and WAV) ready for every sentiment and
+    number of verses, so a request can be answered right after the classification. A background
+    thread refills the pool, at the lowest CPU priority and only while no live request is being
+    processed. A song which is already being generated when a live request arrives is paused at
+    its next checkpoint (after every verse, after every melody and before the rendering) until
+    the live requests are done. The pool still competes with a live request for the work between
+    two checkpoints (a verse, the attempts of the melodies), and for the model calls of its song,
+    which run on the shared model threads, at their normal priority; only the refill thread and
+    the synthesizer it starts have the lowest priority. The songs are kept on disk, so the pool
+    survives restarts"""
+
+    FILE_EXTENSIONS = ("txt", "mid", "wav")
+    # seconds to wait after a failed generation, so a broken setup does not use the CPU
+    RETRY_DELAY = 60.0
+
+    def __init__(
+        self,
+        generate: Callable[[Sentiment, int, str, int, Callable[[], None]], list[str]],
+        n_verses_options: list[int],
+        pool_size: int,
+    ) -> None:
+        """
+        Args:
+            generate (Callable[[Sentiment, int, str, int, Callable[[], None]], list[str]]):
+                Generates a song with a sentiment, a number of verses and a seed, saves its files
+                under an output name and returns its verses. The last argument is called at every
+                checkpoint of the generation, where it blocks while live requests are processed
+            n_verses_options (list[int]): Numbers of verses for which songs are kept ready
+            pool_size (int): Maximum number of ready songs for every sentiment and number of
+                verses
+        """
+        self._generate = generate
+        self._pool_size = pool_size
+        self._songs: dict[tuple[Sentiment, int], deque[tuple[str, list[str], int]]] = {
+            (sentiment, n_verses): deque()
+            for sentiment in Sentiment
+            for n_verses in n_verses_options
+        }
+        self._condition = threading.Condition()
+        self._n_live_requests = 0
+        self._stopped = False
+        self._refill_thread = threading.Thread(target=self._refill, daemon=True)
+
+    @staticmethod
+    def _path(output_name: str, extension: str) -> Path:
+        return Path(Constants.OUTPUT_SAVE_DIR, f"{output_name}.{extension}")
+
+    @staticmethod
+    def _remove(output_name: str) -> None:
+        for extension in SongPool.FILE_EXTENSIONS:
+            SongPool._path(output_name, extension).unlink(missing_ok=True)
+
+    @staticmethod
+    def _is_complete(output_name: str) -> bool:
+        # the synthesizer does not report its errors, so the audio may be missing
+        return all(SongPool._path(output_name, e).is_file() for e in SongPool.FILE_EXTENSIONS)
+
+    def _load_existing(self) -> None:
+        """Adds the songs left by a previous run to the pool, and removes the incomplete ones and
+        the ones which do not fit"""
+        pool_dir = Path(Constants.OUTPUT_SAVE_DIR, Constants.SONG_POOL_DIR)
+        pool_dir.mkdir(parents=True, exist_ok=True)
+        names = {path.stem for path in pool_dir.iterdir() if path.is_file()}
+        for name in sorted(names):
+            output_name = f"{Constants.SONG_POOL_DIR}/{name}"
+            try:
+                sentiment, n_verses, seed = name.split("_")
+                key = (Sentiment(sentiment), int(n_verses))
+                seed = int(seed)
+            except ValueError:
+                key = None
+            if (
+                key in self._songs
+                and len(self._songs[key]) < self._pool_size
+                and self._is_complete(output_name)
+            ):
+                lyrics = self._path(output_name, "txt").read_text().split("\n")
+                self._songs[key].append((output_name, lyrics, seed))
+            else:
+                self._remove(output_name)
+
+    @contextmanager
+    def live_request(self) -> Iterator[None]:
+        """Marks a live request as being processed, which pauses the refilling"""
+        with self._condition:
+            self._n_live_requests += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._n_live_requests -= 1
+                self._condition.notify_all()
+
+    def take(
+        self, sentiment: Sentiment, n_verses: int, output_name: str
+    ) -> Optional[tuple[list[str], int]]:
+        """Hands out a ready song, moving its files to the given output name
+
+        Args:
+            sentiment (Sentiment): Sentiment of the song
+            n_verses (int): Number of verses of the song
+            output_name (str): Name of the output files, without extension
+
+        Returns:
+            Optional[tuple[list[str], int]]: Verses and seed of the song, or None if no song is
+                ready or its files could not be moved, so the song is generated live
+        """
+        with self._condition:
+            songs = self._songs.get((sentiment, n_verses))
+            if not songs:
+                return None
+            pool_name, lyrics, seed = songs.popleft()
+            self._condition.notify_all()
+        try:
+            for extension in self.FILE_EXTENSIONS:
+                os.replace(self._path(pool_name, extension), self._path(output_name, extension))
+        except OSError as e:
+            print(f"Pre-generated song {pool_name} could not be taken: {e}")
+            self._remove(pool_name)
+            self._remove(output_name)
+            return None
+        return lyrics, seed
+
+    def _yield_to_live_requests(self) -> None:
+        """Blocks while a live request is being processed, unless the pool is stopped. Called by
+        the refill thread at the checkpoints of the generation"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._stopped or not self._n_live_requests)
+
+    def _next_key(self) -> Optional[tuple[Sentiment, int]]:
+        """Finds the sentiment and number of verses with the fewest ready songs
+
+        Returns:
+            Optional[tuple[Sentiment, int]]: Key of the songs to refill, or None if the pool is
+                full
+        """
+        if not self._songs:
+            return None
+        key, songs = min(self._songs.items(), key=lambda item: len(item[1]))
+        return key if len(songs) < self._pool_size else None
+
+    def _wait_for_work(self) -> Optional[tuple[Sentiment, int]]:
+        """Waits until the pool is not full and no live request is being processed
+
+        Returns:
+            Optional[tuple[Sentiment, int]]: Key of the songs to refill, or None once the pool is
+                stopped
+        """
+        with self._condition:
+            while not self._stopped:
+                key = self._next_key()
+                if key is not None and not self._n_live_requests:
+                    return key
+                self._condition.wait()
+        return None
+
+    @staticmethod
+    def _lower_priority() -> None:
+        # on Linux, the priority of a single thread is set through its id; processes started by
+        # the thread, like the synthesizer, inherit it
+        if hasattr(os, "setpriority"):
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), Constants.SONG_POOL_NICENESS)
+
+    def _refill(self) -> None:
+        """Generates songs until the pool is stopped. Runs in the refill thread"""
+        self._lower_priority()
+        while (key := self._wait_for_work()) is not None:
+            sentiment, n_verses = key
+            # the seed is part of the name, so it is known again after a restart
+            seed = RequestSeed.new()
+            output_name = f"{Constants.SONG_POOL_DIR}/{sentiment.value}_{n_verses}_{seed}"
+            try:
+                lyrics = self._generate(
+                    sentiment, n_verses, output_name, seed, self._yield_to_live_requests
+                )
+                if not self._is_complete(output_name):
+                    raise RuntimeError("Some files of the song were not saved")
+            except Exception as e:
+                print(f"Pre-generation failed: {e}")
+                self._remove(output_name)
+                with self._condition:
+                    self._condition.wait_for(lambda: self._stopped, self.RETRY_DELAY)
+                continue
+            with self._condition:
+                self._songs[key].append((output_name, lyrics, seed))
+
+    def start(self) -> None:
+        """Loads the songs left by a previous run and starts refilling the pool"""
+        self._load_existing()
+        self._refill_thread.start()
+
+    def stop(self) -> None:
+        """Stops refilling the pool, once the song being generated is finished"""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._refill_thread.join()
@@ -0,0 +1,24 @@
+import asyncio
+
+from constants import Constants
+from predict.predict import Predictor
+from predict.predictor_pool import PredictorPool
+from service.generation_service import GenerationService
+
+if __name__ == "__main__":
+    predictor = Predictor()
+    if Constants.SERVICE_N_WORKERS:
+        # the workers are forked before the artifacts are loaded
+        predictor = PredictorPool(
+            predictor, Constants.SERVICE_N_WORKERS, Constants.SERVICE_MAX_BATCH_SIZE
+        )
+    else:
+        predictor.load_artifacts(Constants.SERVICE_MAX_BATCH_SIZE)
+    service = GenerationService(
+        predictor,
+        Constants.SERVICE_MAX_CONCURRENT_REQUESTS,
+        Constants.SERVICE_MAX_QUEUED_REQUESTS,
+        Constants.SERVICE_REQUEST_TIMEOUT,
+        Constants.SERVICE_TIME_BUDGET,
+    )
+    asyncio.run(service.serve(Constants.SERVICE_HOST, Constants.SERVICE_PORT))
@@ -0,0 +1,311 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+from http import HTTPStatus
+import re
+from typing import Any, AsyncIterator, Callable
+
+from predict.deadline import Deadline
+from predict.predict import Predictor
+from predict.predictor_pool import PredictorPool
+from predict.request_seed import RequestSeed
+from sentiment import Sentiment
+from service.http_server import HttpError, HttpRequest, HttpResponse, HttpServer
+
+
+class GenerationService:
+    """Serves the predictor over HTTP. The number of requests which are processed at once is
+    limited, the other ones wait in a bounded queue, and requests which do not fit in the queue
+    are rejected with 503, so a burst cannot pile up unbounded work. Every request has a
+    deadline (504 when exceeded), and the work of a request is dropped when its client
+    disconnects. The models are called from worker threads, so the event loop keeps accepting
+    connections; a stage which has already started is finished, but no further stage is run. The
+    slot of an abandoned request is only released when its started stages are finished, so the
+    number of generations which run at once never exceeds the limit"""
+
+    MAX_VERSES = 12
+    SONG_PATH_PATTERN = re.compile(r"^/songs/([\w-]+)\.(mid|wav)$")
+    CONTENT_TYPES = {"mid": "audio/midi", "wav": "audio/wav"}
+
+    def __init__(
+        self,
+        predictor: Predictor | PredictorPool,
+        max_concurrent_requests: int,
+        max_queued_requests: int,
+        request_timeout: float,
+        time_budget: float,
+    ) -> None:
+        """
+        Args:
+            predictor (Predictor | PredictorPool): Predictor with loaded artifacts, or a pool of
+                worker processes, shared by all requests
+            max_concurrent_requests (int): Number of requests which are processed at once
+            max_queued_requests (int): Number of requests which can wait for processing
+            request_timeout (float): Seconds after which a request is abandoned, including the
+                time spent in the queue
+            time_budget (float): Seconds after which the generation of a request starts cutting
+                work (melody retries, verse rejections, verses), including the time spent in the
+                queue; lower than the timeout, so the degraded song can still be returned
+        """
+        self._predictor = predictor
+        self._max_queued_requests = max_queued_requests
+        self._request_timeout = request_timeout
+        self._time_budget = time_budget
+        self._slots = asyncio.Semaphore(max_concurrent_requests)
+        # a song runs its lyrics and its music at the same time
+        self._executor = ThreadPoolExecutor(2 * max_concurrent_requests)
+        self._n_active = 0
+        self._n_queued = 0
+        # tasks which release the slots of abandoned requests, referenced until they are done
+        self._releases: set[asyncio.Task] = set()
+        self._routes: dict[tuple[str, str], Callable] = {
+            ("GET", "/health"): self._health,
+            ("POST", "/classify"): self._classify,
+            ("POST", "/lyrics"): self._lyrics,
+            ("POST", "/song"): self._song,
+        }
+
+    def _release_slot(self) -> None:
+        self._n_active -= 1
+        self._slots.release()
+
+    async def _release_when_finished(self, stages: list[Future]) -> None:
+        await asyncio.wait([asyncio.wrap_future(stage) for stage in stages])
+        self._release_slot()
+
+    @asynccontextmanager
+    async def _admit(self) -> AsyncIterator[list[Future]]:
+        """Waits for a processing slot, if the queue is not full. The stages of the request are
+        run with `_run` on the yielded list; when the request is abandoned, the stages which have
+        not started are cancelled, and the slot is kept until the started ones are finished,
+        since their threads cannot be stopped
+
+        Raises:
+            HttpError: If the queue is full
+        """
+        if self._slots.locked() and self._n_queued >= self._max_queued_requests:
+            raise HttpError(HTTPStatus.SERVICE_UNAVAILABLE, "Too many requests, try again later")
+        self._n_queued += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._n_queued -= 1
+        self._n_active += 1
+        stages: list[Future] = []
+        try:
+            yield stages
+        finally:
+            running = [stage for stage in stages if not stage.cancel() and not stage.done()]
+            if running:
+                release = asyncio.create_task(self._release_when_finished(running))
+                self._releases.add(release)
+                release.add_done_callback(self._releases.discard)
+            else:
+                self._release_slot()
+
+    async def _run(self, stages: list[Future], function: Callable, *args) -> Any:
+        """Runs a blocking stage of the generation in a worker thread
+
+        Args:
+            stages (list[Future]): Stages of the request, given by `_admit`
+            function (Callable): Stage
+
+        Returns:
+            Any: Result of the stage
+        """
+        stage = self._executor.submit(partial(function, *args))
+        stages.append(stage)
+        return await asyncio.wrap_future(stage)
+
+    @staticmethod
+    def _get_prompt(data: dict[str, Any]) -> str:
+        prompt = data.get("prompt")
+        if not isinstance(prompt, str) or not prompt.strip():
+            raise HttpError(HTTPStatus.BAD_REQUEST, "A non-empty prompt is required")
+        return prompt
+
+    def _get_n_verses(self, data: dict[str, Any]) -> int:
+        n_verses = data.get("n_verses", 6)
+        if not isinstance(n_verses, int) or not 1 <= n_verses <= self.MAX_VERSES:
+            raise HttpError(
+                HTTPStatus.BAD_REQUEST, f"n_verses must be between 1 and {self.MAX_VERSES}"
+            )
+        return n_verses
+
+    @staticmethod
+    def _get_seed(data: dict[str, Any]) -> int:
+        """Gets the seed given in the request, so a song can be made again, or draws a new one
+
+        Args:
+            data (dict[str, Any]): Request body
+
+        Raises:
+            HttpError: If the seed is not a non-negative integer
+
+        Returns:
+            int: Seed of the request
+        """
+        seed = data.get("seed")
+        if seed is None:
+            return RequestSeed.new()
+        if not isinstance(seed, int) or isinstance(seed, bool) or seed < 0:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "seed must be a non-negative integer")
+        return seed
+
+    async def _get_sentiment(self, stages: list[Future], data: dict[str, Any]) -> Sentiment:
+        """Gets the sentiment given in the request, or classifies the prompt if there is none
+
+        Args:
+            stages (list[Future]): Stages of the request, given by `_admit`
+            data (dict[str, Any]): Request body
+
+        Raises:
+            HttpError: If the sentiment is unknown
+
+        Returns:
+            Sentiment: Sentiment of the request
+        """
+        if "sentiment" not in data:
+            return await self._run(stages, self._predictor.classify, self._get_prompt(data))
+        try:
+            return Sentiment(data["sentiment"])
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, f"Unknown sentiment {data['sentiment']}")
+
+    async def _health(self, _: HttpRequest) -> HttpResponse:
+        return HttpResponse.from_json(
+            {"status": "ok", "active": self._n_active, "queued": self._n_queued}
+        )
+
+    async def _classify(self, request: HttpRequest) -> HttpResponse:
+        prompt = self._get_prompt(request.json())
+        async with self._admit() as stages:
+            sentiment = await self._run(stages, self._predictor.classify, prompt)
+        return HttpResponse.from_json({"sentiment": sentiment.value})
+
+    async def _lyrics(self, request: HttpRequest) -> HttpResponse:
+        data = request.json()
+        n_verses = self._get_n_verses(data)
+        seed = self._get_seed(data)
+        deadline = Deadline(self._time_budget)
+        async with self._admit() as stages:
+            sentiment = await self._get_sentiment(stages, data)
+            lyrics = await self._run(
+                stages, self._predictor.generate_lyrics, sentiment, n_verses, None, seed, deadline
+            )
+        return HttpResponse.from_json(
+            {
+                "sentiment": sentiment.value,
+                "lyrics": lyrics,
+                "seed": seed,
+                "degraded": deadline.degradations,
+            }
+        )
+
+    async def _song(self, request: HttpRequest) -> HttpResponse:
+        data = request.json()
+        n_verses = self._get_n_verses(data)
+        seed = self._get_seed(data)
+        deadline = Deadline(self._time_budget)
+        async with self._admit() as stages:
+            sentiment = await self._get_sentiment(stages, data)
+            output_name = self._predictor.new_output_name()
+            lyrics, _ = await asyncio.gather(
+                self._run(
+                    stages,
+                    self._predictor.generate_lyrics,
+                    sentiment,
+                    n_verses,
+                    output_name,
+                    seed,
+                    deadline,
+                ),
+                self._run(
+                    stages,
+                    self._predictor.generate_song,
+                    sentiment,
+                    output_name,
+                    128,
+                    seed,
+                    deadline,
+                ),
+            )
+        return HttpResponse.from_json(
+            {
+                "sentiment": sentiment.value,
+                "lyrics": lyrics,
+                "midi": f"/songs/{output_name}.mid",
+                "wav": f"/songs/{output_name}.wav",
+                "seed": seed,
+                "degraded": deadline.degradations,
+            }
+        )
+
+    def _song_file(self, request: HttpRequest) -> HttpResponse:
+        """Streams a MIDI or WAV file of a generated song
+
+        Args:
+            request (HttpRequest): Request for /songs/<name>.<mid|wav>
+
+        Raises:
+            HttpError: If there is no such file
+
+        Returns:
+            HttpResponse: Streamed file
+        """
+        match = self.SONG_PATH_PATTERN.match(request.path)
+        if request.method != "GET" or match is None:
+            raise HttpError(HTTPStatus.NOT_FOUND, "Not found")
+        output_name, extension = match.groups()
+        file_path = Predictor.output_path(output_name, extension)
+        if not file_path.is_file():
+            raise HttpError(HTTPStatus.NOT_FOUND, "Not found")
+        return HttpResponse(content_type=self.CONTENT_TYPES[extension], file_path=file_path)
+
+    async def handle(self, request: HttpRequest, disconnected: asyncio.Event) -> HttpResponse:
+        """Answers a request, within the request timeout, unless the client disconnects first
+
+        Args:
+            request (HttpRequest): Request
+            disconnected (asyncio.Event): Set when the client disconnects
+
+        Raises:
+            HttpError: If the request fails or takes too long
+
+        Returns:
+            HttpResponse: Response
+        """
+        route = self._routes.get((request.method, request.path.split("?")[0]))
+        if route is None:
+            return self._song_file(request)
+
+        work = asyncio.create_task(route(request))
+        disconnect = asyncio.create_task(disconnected.wait())
+        try:
+            done, _ = await asyncio.wait(
+                {work, disconnect},
+                timeout=self._request_timeout,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            disconnect.cancel()
+        if work in done:
+            return work.result()
+
+        work.cancel()
+        if disconnect in done:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "The client disconnected")
+        raise HttpError(HTTPStatus.GATEWAY_TIMEOUT, "The request took too long")
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serves requests until cancelled
+
+        Args:
+            host (str): Address the service listens on
+            port (int): Port the service listens on
+        """
+        try:
+            await HttpServer(self.handle).serve(host, port)
+        finally:
+            self._executor.shutdown(wait=False, cancel_futures=True)
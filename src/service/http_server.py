@@ -0,0 +1,191 @@
+import asyncio
+from dataclasses import dataclass, field
+from http import HTTPStatus
+import json
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+
+@dataclass
+class HttpRequest:
+    method: str
+    path: str
+    headers: dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+    def json(self) -> dict[str, Any]:
+        """Parses the body as a JSON object
+
+        Raises:
+            HttpError: If the body is not a JSON object
+
+        Returns:
+            dict[str, Any]: Parsed body
+        """
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "The body is not valid JSON")
+        if not isinstance(data, dict):
+            raise HttpError(HTTPStatus.BAD_REQUEST, "The body must be a JSON object")
+        return data
+
+
+@dataclass
+class HttpResponse:
+    status: HTTPStatus = HTTPStatus.OK
+    body: bytes = b""
+    content_type: str = "application/json"
+    # if set, the file is streamed in chunks instead of the body
+    file_path: Optional[Path] = None
+
+    @staticmethod
+    def from_json(data: Any, status: HTTPStatus = HTTPStatus.OK) -> "HttpResponse":
+        return HttpResponse(status, json.dumps(data).encode())
+
+
+class HttpError(Exception):
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+Handler = Callable[[HttpRequest, asyncio.Event], Awaitable[HttpResponse]]
+
+
+class HttpServer:
+    """Minimal HTTP/1.1 server on top of asyncio streams. Every connection carries one request.
+    While the request is handled, the connection is watched, so the handler is told (through an
+    event) when the client goes away and can drop the work"""
+
+    MAX_HEADER_SIZE = 16 * 1024
+    MAX_BODY_SIZE = 1024 * 1024
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, handler: Handler) -> None:
+        """
+        Args:
+            handler (Handler): Coroutine which answers a request; it gets an event which is set
+                when the client disconnects
+        """
+        self._handler = handler
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> HttpRequest:
+        """Reads the request line, the headers and the body of a request
+
+        Args:
+            reader (asyncio.StreamReader): Connection
+
+        Raises:
+            HttpError: If the request is malformed or too large
+
+        Returns:
+            HttpRequest: Parsed request
+        """
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, "Headers are too large")
+        except asyncio.IncompleteReadError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Incomplete request")
+
+        request_line, *header_lines = head.decode("latin-1").rstrip("\r\n").split("\r\n")
+        try:
+            method, path, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed request line")
+        headers = {}
+        for line in header_lines:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            content_length = int(headers.get("content-length", 0))
+        except ValueError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Malformed Content-Length")
+        if content_length > self.MAX_BODY_SIZE:
+            raise HttpError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "The body is too large")
+        try:
+            body = await reader.readexactly(content_length) if content_length else b""
+        except asyncio.IncompleteReadError:
+            raise HttpError(HTTPStatus.BAD_REQUEST, "Incomplete body")
+        return HttpRequest(method.upper(), path, headers, body)
+
+    @staticmethod
+    def _head(status: HTTPStatus, headers: dict[str, str]) -> bytes:
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def _write_response(self, writer: asyncio.StreamWriter, response: HttpResponse) -> None:
+        """Writes a response. Files are sent with chunked encoding, waiting for the client to
+        accept every chunk, so slow clients do not fill the memory. Files are read in the default
+        executor, so a slow disk does not block the event loop
+
+        Args:
+            writer (asyncio.StreamWriter): Connection
+            response (HttpResponse): Response
+        """
+        headers = {"Content-Type": response.content_type, "Connection": "close"}
+        if response.file_path is None:
+            headers["Content-Length"] = str(len(response.body))
+            writer.write(self._head(response.status, headers) + response.body)
+            await writer.drain()
+            return
+
+        headers["Transfer-Encoding"] = "chunked"
+        writer.write(self._head(response.status, headers))
+        with await asyncio.to_thread(open, response.file_path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, self.CHUNK_SIZE):
+                writer.write(f"{len(chunk):X}\r\n".encode() + chunk + b"\r\n")
+                await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    async def _watch_disconnect(reader: asyncio.StreamReader, disconnected: asyncio.Event) -> None:
+        # the client sends nothing after its request, so the end of the stream means it is gone
+        while await reader.read(1024):
+            pass
+        disconnected.set()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            try:
+                request = await self._read_request(reader)
+                disconnected = asyncio.Event()
+                watcher = asyncio.create_task(self._watch_disconnect(reader, disconnected))
+                try:
+                    response = await self._handler(request, disconnected)
+                finally:
+                    watcher.cancel()
+            except HttpError as e:
+                response = HttpResponse.from_json({"error": e.message}, e.status)
+            except Exception as e:
+                print(f"Request failed: {e}")
+                response = HttpResponse.from_json(
+                    {"error": "Internal error"}, HTTPStatus.INTERNAL_SERVER_ERROR
+                )
+            if not writer.is_closing():
+                await self._write_response(writer, response)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        """Serves requests until cancelled
+
+        Args:
+            host (str): Address the server listens on
+            port (int): Port the server listens on
+        """
+        server = await asyncio.start_server(
+            self._handle_connection, host, port, limit=self.MAX_HEADER_SIZE
+        )
+        async with server:
+            print(f"Listening on http://{host}:{port}")
+            await server.serve_forever()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the parsers import each other from the music creator directory, where they are run
+sys.path.insert(0, str(Path(__file__).parent.parent / "train" / "music_creator"))
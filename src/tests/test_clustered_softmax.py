@@ -0,0 +1,57 @@
+import pytest
+
+pytest.importorskip("numpy")
+import numpy as np
+from predict.lyric_generation.clustered_softmax import ClusteredSoftmax
+
+HIDDEN_SIZE = 32
+VOCABULARY_SIZE = 1000
+
+
+def _softmax(kernel: np.ndarray, bias: np.ndarray) -> ClusteredSoftmax:
+    # the tests give the encodings directly, so the encoder is the identity
+    return ClusteredSoftmax(lambda x: x, kernel, bias, head_size=100, cluster_size=64)
+
+
+def _full_top_k(
+    kernel: np.ndarray, bias: np.ndarray, hidden: np.ndarray, k: int
+) -> tuple[np.ndarray, np.ndarray]:
+    logits = hidden @ kernel + bias
+    top = np.argsort(-logits, kind="stable")[:k]
+    return top, logits[top]
+
+
+@pytest.mark.parametrize("k", [1, 5, 40])
+def test_top_k_matches_full_output_layer(k: int) -> None:
+    rng = np.random.default_rng(k)
+    kernel = rng.normal(size=(HIDDEN_SIZE, VOCABULARY_SIZE)).astype(np.float32)
+    bias = rng.normal(size=VOCABULARY_SIZE).astype(np.float32)
+    softmax = _softmax(kernel, bias)
+    for hidden in rng.normal(size=(20, HIDDEN_SIZE)).astype(np.float32):
+        ids, logits = softmax.top_k_of_hidden(hidden, k)
+        expected_ids, expected_logits = _full_top_k(kernel, bias, hidden, k)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(logits, expected_logits, rtol=1e-5)
+
+
+def test_top_k_batch_matches_full_output_layer() -> None:
+    rng = np.random.default_rng(0)
+    kernel = rng.normal(size=(HIDDEN_SIZE, VOCABULARY_SIZE)).astype(np.float32)
+    bias = rng.normal(size=VOCABULARY_SIZE).astype(np.float32)
+    hiddens = rng.normal(size=(8, HIDDEN_SIZE)).astype(np.float32)
+    for hidden, (ids, logits) in zip(hiddens, _softmax(kernel, bias).top_k_batch(hiddens, 10)):
+        expected_ids, expected_logits = _full_top_k(kernel, bias, hidden, 10)
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(logits, expected_logits, rtol=1e-5)
+
+
+def test_rare_words_are_pruned() -> None:
+    # like a trained model, frequent words have larger biases than rare ones
+    rng = np.random.default_rng(0)
+    kernel = rng.normal(scale=0.1, size=(HIDDEN_SIZE, VOCABULARY_SIZE)).astype(np.float32)
+    bias = np.linspace(5.0, -5.0, VOCABULARY_SIZE, dtype=np.float32)
+    softmax = _softmax(kernel, bias)
+    for hidden in rng.normal(size=(20, HIDDEN_SIZE)).astype(np.float32):
+        ids, _ = softmax.top_k_of_hidden(hidden, 5)
+        np.testing.assert_array_equal(ids, _full_top_k(kernel, bias, hidden, 5)[0])
+    assert softmax.scored_fraction < 0.5
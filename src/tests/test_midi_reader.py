@@ -0,0 +1,109 @@
+from typing import Optional
+
+import pytest
+
+pytest.importorskip("numpy")
+from parser.midi_reader import MidiReader
+
+TICKS_PER_QUARTER = 480
+
+
+def _variable_length(value: int) -> bytes:
+    groups = [value & 0x7F]
+    value >>= 7
+    while value:
+        groups.append(value & 0x7F | 0x80)
+        value >>= 7
+    return bytes(reversed(groups))
+
+
+def _chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return chunk_type + len(data).to_bytes(4, "big") + data
+
+
+def _track(
+    notes: Optional[list[tuple[float, float, int]]] = None,
+    program: Optional[int] = None,
+    time_signature: Optional[tuple[int, int]] = None,
+) -> bytes:
+    """Builds a track chunk
+
+    Args:
+        notes (list[tuple[float, float, int]], optional): Start and duration, in quarter notes,
+            and pitch of every note. Defaults to None.
+        program (Optional[int], optional): Program of the track. Defaults to None.
+        time_signature (Optional[tuple[int, int]], optional): Numerator and power of two of the
+            denominator. Defaults to None.
+
+    Returns:
+        bytes: Track chunk
+    """
+    # note-offs come before the note-ons of the same tick
+    events: list[tuple[int, int, bytes]] = []
+    if time_signature is not None:
+        events.append((0, 0, bytes([0xFF, 0x58, 4, *time_signature, 24, 8])))
+    if program is not None:
+        events.append((0, 0, bytes([0xC0, program])))
+    for start, length, pitch in notes or []:
+        events.append((round(start * TICKS_PER_QUARTER), 2, bytes([0x90, pitch, 100])))
+        events.append((round((start + length) * TICKS_PER_QUARTER), 1, bytes([0x80, pitch, 0])))
+    data = b""
+    tick = 0
+    for event_tick, _, event in sorted(events, key=lambda e: e[:2]):
+        data += _variable_length(event_tick - tick) + event
+        tick = event_tick
+    return _chunk(b"MTrk", data + b"\x00\xff\x2f\x00")
+
+
+def _midi_file(tracks: list[bytes]) -> bytes:
+    header = (1).to_bytes(2, "big") + len(tracks).to_bytes(2, "big")
+    return _chunk(b"MThd", header + TICKS_PER_QUARTER.to_bytes(2, "big")) + b"".join(tracks)
+
+
+# the first track of every file is a conductor track, as written by most sequencers
+SAMPLES: dict[str, tuple[list[bytes], list[str]]] = {
+    "melody": (
+        [_track(), _track([(0, 1, 60), (1, 0.5, 62), (1.5, 0.5, 64), (2, 2, 65)])],
+        ["C4", "D4", "E4", "F4"],
+    ),
+    "tie_across_barline": ([_track(), _track([(3, 2, 60)])], ["C4", "C4"]),
+    "tie_over_measures": ([_track(), _track([(0, 12, 64)])], ["E4", "E4", "E4"]),
+    "tied_chord": (
+        [_track(), _track([(3, 2, 60), (3, 2, 64), (3, 2, 67)])],
+        ["0.4.7", "0.4.7"],
+    ),
+    "off_grid_onset": ([_track(), _track([(3.95, 1, 67)])], ["G4"]),
+    "spread_chord": (
+        [_track(), _track([(0, 1, 60), (0.05, 0.95, 64), (0.1, 0.9, 67), (1, 1, 72)])],
+        ["0.4.7", "C5"],
+    ),
+    "triplets": (
+        [_track(), _track([(i / 3, 1 / 3, 60 + i) for i in range(6)])],
+        ["C4", "C#4", "D4", "E-4", "E4", "F4"],
+    ),
+    "three_four": ([_track(time_signature=(3, 2)), _track([(2, 2, 62)])], ["D4", "D4"]),
+    "same_program": (
+        [_track(), _track([(0, 1, 60), (1, 1, 62)], 0), _track([(0, 2, 48)], 0)],
+        ["C4", "C3", "D4"],
+    ),
+    "two_programs": (
+        [_track(), _track([(0, 1, 60)], 0), _track([(0, 1, 69)], 40)],
+        ["C4", "A4"],
+    ),
+}
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_notes(name: str) -> None:
+    tracks, expected = SAMPLES[name]
+    assert MidiReader(_midi_file(tracks)).notes() == expected
+
+
+@pytest.mark.parametrize("name", sorted(SAMPLES))
+def test_notes_match_music21(name: str, tmp_path) -> None:
+    pytest.importorskip("music21")
+    from parser.d1_parser import D1Parser
+
+    midi_file = tmp_path / f"{name}.mid"
+    midi_file.write_bytes(_midi_file(SAMPLES[name][0]))
+    assert D1Parser(n_workers=1).compare_readers([midi_file]) == []
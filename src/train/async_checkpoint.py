@@ -0,0 +1,221 @@
+import os
+from pathlib import Path
+import queue
+import tempfile
+import threading
+from typing import Optional
+import numpy as np
+import tensorflow as tf
+
+from tensorflow.keras.callbacks import Callback
+from tensorflow.keras.models import Model
+
+from train.distributed import DataParallelLauncher
+
+
+class AsyncWeightsCheckpoint(Callback):
+    """Checkpoint which copies the trainable weights to memory at the end of an epoch and writes
+    them to disk from a background thread, so the epoch does not wait for the disk. Frozen weights
+    (the pre-trained embeddings) are never written, since they are rebuilt from the shared
+    embedding cache when the model is created. Two snapshots are kept:
+    - the best weights, according to the monitored metric
+    - the last state (weights, optimizer variables, epoch), used to resume training
+    The full model is only saved once, with the best weights, when training ends. In data-parallel
+    training, only the chief worker writes to the checkpoint directory. At most two snapshots wait
+    for the disk, after that the epoch waits. Keras skips the end of the training when `fit`
+    raises, so callers stop the background thread with `stop` once `fit` returns or raises."""
+
+    BEST_FILE = "best.npz"
+    LAST_FILE = "last.npz"
+
+    def __init__(
+        self,
+        model_path: str,
+        checkpoint_dir: str,
+        monitor: str,
+        mode: str = "max",
+        initial_value_threshold: Optional[float] = None,
+        target_model: Optional[Model] = None,
+        verbose: int = 0,
+    ) -> None:
+        """
+        Args:
+            model_path (str): Location of the full model, saved when training ends
+            checkpoint_dir (str): Directory of the weights snapshots
+            monitor (str): Metric which decides the best weights
+            mode (str, optional): "max" or "min", depending on the metric. Defaults to "max".
+            initial_value_threshold (Optional[float], optional): Value the metric has to beat
+                before the weights are saved. Defaults to None.
+            target_model (Optional[Model], optional): Model which is saved, if it is not the
+                trained one, but shares its layers with it. Defaults to None.
+            verbose (int, optional): If set, a message is printed for every best snapshot.
+                Defaults to 0.
+
+        Raises:
+            ValueError: If the mode is neither "max" nor "min"
+        """
+        super().__init__()
+        if mode not in ("max", "min"):
+            raise ValueError(f"Unknown mode {mode}")
+        self._model_path = model_path
+        self._checkpoint_dir = Path(checkpoint_dir)
+        self._monitor = monitor
+        self._sign = 1.0 if mode == "max" else -1.0
+        self._best = (
+            -np.inf if initial_value_threshold is None else self._sign * initial_value_threshold
+        )
+        self._target_model = target_model
+        self._verbose = verbose
+        self._best_weights: Optional[list[np.ndarray]] = None
+        self._is_chief = DataParallelLauncher.current_worker().is_chief
+
+        # a slow disk makes the epochs wait, instead of keeping a snapshot of every epoch in memory
+        self._writes: queue.Queue = queue.Queue(maxsize=2)
+        self._write_error: Optional[Exception] = None
+        self._writer: Optional[threading.Thread] = None
+
+    @property
+    def _saved_model(self) -> Model:
+        return self._target_model if self._target_model is not None else self.model
+
+    def _optimizer_variables(self) -> list[tf.Variable]:
+        variables = self.model.optimizer.variables
+        # legacy optimizers expose the variables through a method
+        return variables() if callable(variables) else variables
+
+    def _write_snapshots(self) -> None:
+        """Writes the snapshots that are queued, one at a time. Runs in the background thread"""
+        while True:
+            snapshot = self._writes.get()
+            if snapshot is None:
+                return
+            file_name, arrays = snapshot
+            try:
+                if self._write_error is None:
+                    tmp_path = self._checkpoint_dir / f"{file_name}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        np.savez(f, **arrays)
+                    os.replace(tmp_path, self._checkpoint_dir / file_name)
+            except Exception as e:
+                self._write_error = e
+
+    def stop(self) -> None:
+        """Waits for the queued snapshots to be written, then stops the background thread. Does
+        nothing if it is already stopped"""
+        if self._writer is not None:
+            self._writes.put(None)
+            self._writer.join()
+            self._writer = None
+
+    def _flush(self) -> None:
+        """Waits for the queued snapshots to be written, then stops the background thread
+
+        Raises:
+            Exception: The first error of the background thread, if any
+        """
+        self.stop()
+        if self._write_error is not None:
+            raise self._write_error
+
+    @staticmethod
+    def read_score(checkpoint_dir: str) -> Optional[float]:
+        """Reads the best value of the monitored metric from the last state of a training
+
+        Args:
+            checkpoint_dir (str): Directory of the weights snapshots
+
+        Returns:
+            Optional[float]: Best value, negated for metrics which are minimized (so higher is
+                always better), or None if no epoch has improved on the threshold
+        """
+        last_path = Path(checkpoint_dir, AsyncWeightsCheckpoint.LAST_FILE)
+        if not last_path.exists():
+            return None
+        with np.load(last_path) as snapshot:
+            best = float(snapshot["best"])
+        return best if np.isfinite(best) else None
+
+    def restore(self) -> int:
+        """Restores the last state of the training, if there is one. Must be called after the
+        model has been compiled and before training starts
+
+        Returns:
+            int: Epoch from which the training continues
+        """
+        last_path = self._checkpoint_dir / self.LAST_FILE
+        if not last_path.exists():
+            return 0
+
+        with np.load(last_path) as snapshot:
+            weights = self._saved_model.trainable_weights
+            for i, weight in enumerate(weights):
+                weight.assign(snapshot[f"weight_{i}"])
+
+            optimizer = self.model.optimizer
+            if hasattr(optimizer, "build"):
+                optimizer.build(self.model.trainable_variables)
+            else:
+                optimizer._create_all_weights(self.model.trainable_variables)
+            variables = self._optimizer_variables()
+            n_variables = int(snapshot["n_optimizer_variables"])
+            if n_variables != len(variables):
+                raise ValueError("The optimizer of the checkpoint does not match the model")
+            for i, variable in enumerate(variables):
+                variable.assign(snapshot[f"optimizer_{i}"])
+
+            self._best = float(snapshot["best"])
+            epoch = int(snapshot["epoch"]) + 1
+
+        best_path = self._checkpoint_dir / self.BEST_FILE
+        if best_path.exists():
+            with np.load(best_path) as snapshot:
+                self._best_weights = [snapshot[f"weight_{i}"] for i in range(len(snapshot.files))]
+        return epoch
+
+    def on_train_begin(self, logs: Optional[dict] = None) -> None:
+        if self._is_chief:
+            self._checkpoint_dir.mkdir(parents=True, exist_ok=True)
+            self._writer = threading.Thread(target=self._write_snapshots, daemon=True)
+            self._writer.start()
+
+    def on_epoch_end(self, epoch: int, logs: Optional[dict] = None) -> None:
+        if self._write_error is not None:
+            raise self._write_error
+
+        # copying to memory is the only synchronous part
+        weights = [weight.numpy() for weight in self._saved_model.trainable_weights]
+        value = (logs or {}).get(self._monitor)
+        if value is not None and self._sign * value > self._best:
+            if self._verbose and self._is_chief:
+                print(f"\nEpoch {epoch + 1}: {self._monitor} improved to {value:.5f}")
+            self._best = self._sign * value
+            self._best_weights = weights
+            if self._is_chief:
+                self._writes.put(
+                    (self.BEST_FILE, {f"weight_{i}": w for i, w in enumerate(weights)})
+                )
+
+        if not self._is_chief:
+            return
+
+        state = {f"weight_{i}": w for i, w in enumerate(weights)}
+        variables = self._optimizer_variables()
+        state.update({f"optimizer_{i}": v.numpy() for i, v in enumerate(variables)})
+        state["n_optimizer_variables"] = np.array(len(variables))
+        state["best"] = np.array(self._best)
+        state["epoch"] = np.array(epoch)
+        self._writes.put((self.LAST_FILE, state))
+
+    def on_train_end(self, logs: Optional[dict] = None) -> None:
+        self._flush()
+        if self._best_weights is None:
+            return
+        model = self._saved_model
+        for weight, value in zip(model.trainable_weights, self._best_weights):
+            weight.assign(value)
+        if self._is_chief:
+            model.save(self._model_path)
+        else:
+            # saving can synchronize the workers, so the other workers save to a temporary location
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                model.save(str(Path(tmp_dir, Path(self._model_path).name)))
@@ -0,0 +1,256 @@
+from dataclasses import dataclass, replace
+import json
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import socket
+from typing import Any, Callable, Optional
+import numpy as np
+import tensorflow as tf
+
+
+@dataclass
+class Worker:
+    index: int
+    n_workers: int
+
+    @property
+    def is_chief(self) -> bool:
+        return self.index == 0
+
+
+class DataParallelLauncher:
+    """Runs a trainer in several local processes, each one training on its own shard of the data.
+    The processes form a multi-worker cluster on localhost, so the gradients are averaged after
+    every step and all workers keep the same weights. The batch size of a trainer is the global
+    one: it is split between the workers, so a step sees as many samples, and the learning rate
+    and the number of steps per epoch keep their meaning, whatever the number of workers. Only the
+    chief (worker 0) writes to disk"""
+
+    HOST = "localhost"
+    _strategy: Optional[tf.distribute.Strategy] = None
+
+    def __init__(self, n_workers: int = 1) -> None:
+        """
+        Args:
+            n_workers (int, optional): Number of worker processes. With a single worker, the
+                trainer runs in the current process. Defaults to 1.
+
+        Raises:
+            ValueError: If the number of workers is not positive
+        """
+        if n_workers < 1:
+            raise ValueError("There must be at least one worker")
+        self._n_workers = n_workers
+
+    @property
+    def n_workers(self) -> int:
+        return self._n_workers
+
+    @staticmethod
+    def current_worker() -> Worker:
+        """Gets the worker which runs in the current process, from the cluster configuration
+
+        Returns:
+            Worker: The current worker, or a single worker outside of a cluster
+        """
+        tf_config = json.loads(os.environ.get("TF_CONFIG", "{}"))
+        if "task" not in tf_config:
+            return Worker(0, 1)
+        return Worker(tf_config["task"]["index"], len(tf_config["cluster"]["worker"]))
+
+    @staticmethod
+    def strategy() -> tf.distribute.Strategy:
+        """Gets the distribution strategy of the current process. It is created once, before any
+        model, since the workers connect to each other when it is created
+
+        Returns:
+            tf.distribute.Strategy: Multi-worker strategy inside a cluster, the default one
+                otherwise
+        """
+        if DataParallelLauncher._strategy is None:
+            if DataParallelLauncher.current_worker().n_workers > 1:
+                DataParallelLauncher._strategy = tf.distribute.MultiWorkerMirroredStrategy()
+            else:
+                DataParallelLauncher._strategy = tf.distribute.get_strategy()
+        return DataParallelLauncher._strategy
+
+    @staticmethod
+    def worker_batch_size(global_batch_size: int) -> int:
+        """Gets the part of the global batch which the current worker computes. The gradients of
+        the workers are averaged, so a step is equivalent to a step on the whole batch in a
+        single process. When the batch cannot be split evenly, the few remaining samples are left
+        out of every step
+
+        Args:
+            global_batch_size (int): Number of samples in a step, over all workers
+
+        Raises:
+            ValueError: If there are fewer samples in a step than workers
+
+        Returns:
+            int: Number of samples in a step of the current worker
+        """
+        n_workers = DataParallelLauncher.current_worker().n_workers
+        if global_batch_size < n_workers:
+            raise ValueError("The batch size must be at least the number of workers")
+        return global_batch_size // n_workers
+
+    @staticmethod
+    def without_auto_sharding(dataset: tf.data.Dataset) -> tf.data.Dataset:
+        """Disables the automatic sharding of a dataset, since every worker already gets its own
+        shard of the data
+
+        Args:
+            dataset (tf.data.Dataset): Input pipeline
+
+        Returns:
+            tf.data.Dataset: Same pipeline, which is not sharded again when distributed
+        """
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+        return dataset.with_options(options)
+
+    def shard_indices(
+        self, n_samples: int, groups: Optional[np.ndarray] = None
+    ) -> list[np.ndarray]:
+        """Splits the samples between the workers. Every worker gets the same number of samples
+        from every group (ex. the length buckets of the sentences), so all workers run the same
+        number of steps; since the gradients are synchronized after every step, a worker with more
+        steps would wait forever. The few samples which cannot be split evenly are dropped
+
+        Args:
+            n_samples (int): Number of samples
+            groups (Optional[np.ndarray], optional): Group of every sample, if the batches are
+                formed within groups. Defaults to None.
+
+        Returns:
+            list[np.ndarray]: Sorted indices of the samples of every worker
+        """
+        if groups is None:
+            groups = np.zeros(n_samples, dtype=np.int64)
+        shards: list[list[np.ndarray]] = [[] for _ in range(self._n_workers)]
+        for group in np.unique(groups):
+            indices = np.flatnonzero(groups == group)
+            indices = indices[: len(indices) - len(indices) % self._n_workers]
+            for worker, shard in enumerate(shards):
+                shard.append(indices[worker :: self._n_workers])
+        return [
+            np.sort(np.concatenate(shard)) if shard else np.zeros(0, dtype=np.int64)
+            for shard in shards
+        ]
+
+    def shard(
+        self, data_container: Any, splits: list[tuple[list[str], Optional[np.ndarray]]]
+    ) -> list[Any]:
+        """Splits the data of a container between the workers
+
+        Args:
+            data_container (Any): Dataclass which holds the data
+            splits (list[tuple[list[str], Optional[np.ndarray]]]): Every data split which is
+                sharded, as the fields which hold its samples (ex. features and targets) and the
+                group of every sample, if any. The other fields are given to every worker
+
+        Returns:
+            list[Any]: Container of every worker
+        """
+        if self._n_workers == 1:
+            return [data_container]
+        shards: list[dict[str, np.ndarray]] = [{} for _ in range(self._n_workers)]
+        for fields, groups in splits:
+            n_samples = len(getattr(data_container, fields[0]))
+            for shard, indices in zip(shards, self.shard_indices(n_samples, groups)):
+                shard.update({field: getattr(data_container, field)[indices] for field in fields})
+        return [replace(data_container, **shard) for shard in shards]
+
+    @staticmethod
+    def _free_ports(n_ports: int) -> list[int]:
+        """Finds ports which are not in use on localhost
+
+        Args:
+            n_ports (int): Number of ports
+
+        Returns:
+            list[int]: Free ports
+        """
+        sockets = []
+        try:
+            for _ in range(n_ports):
+                s = socket.socket()
+                s.bind((DataParallelLauncher.HOST, 0))
+                sockets.append(s)
+            return [s.getsockname()[1] for s in sockets]
+        finally:
+            for s in sockets:
+                s.close()
+
+    @staticmethod
+    def _run_worker(
+        cluster: dict[str, list[str]],
+        index: int,
+        target: Callable[..., None],
+        shard: Any,
+        args: tuple,
+    ) -> None:
+        """Entry point of a worker process
+
+        Args:
+            cluster (dict[str, list[str]]): Addresses of all workers
+            index (int): Index of this worker
+            target (Callable[..., None]): Trainer
+            shard (Any): Data of this worker
+            args (tuple): Other arguments of the trainer
+        """
+        os.environ["TF_CONFIG"] = json.dumps(
+            {"cluster": cluster, "task": {"type": "worker", "index": index}}
+        )
+        # the cores are split between the workers, instead of every worker using all of them
+        n_threads = max((os.cpu_count() or 1) // len(cluster["worker"]), 1)
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(n_threads)
+        target(shard, *args)
+
+    def run(self, target: Callable[..., None], shards: list[Any], *args) -> None:
+        """Runs a trainer in every worker process, as `target(shard, *args)`. The target has to be
+        a module-level function, so the worker processes can import it
+
+        Args:
+            target (Callable[..., None]): Trainer
+            shards (list[Any]): Data of every worker
+
+        Raises:
+            ValueError: If there is not one shard for every worker
+            RuntimeError: If a worker fails; the other workers are then stopped, since they would
+                wait for it forever
+        """
+        if len(shards) != self._n_workers:
+            raise ValueError("There must be one shard for every worker")
+        if self._n_workers == 1:
+            target(shards[0], *args)
+            return
+
+        ports = self._free_ports(self._n_workers)
+        cluster = {"worker": [f"{self.HOST}:{port}" for port in ports]}
+        # workers are spawned, since TensorFlow cannot be used in a forked process
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=self._run_worker, args=(cluster, index, target, shard, args))
+            for index, shard in enumerate(shards)
+        ]
+        for process in processes:
+            process.start()
+
+        running = {process.sentinel: index for index, process in enumerate(processes)}
+        failed: Optional[int] = None
+        while running:
+            for sentinel in wait(list(running)):
+                index = running.pop(sentinel)
+                processes[index].join()
+                if processes[index].exitcode != 0 and failed is None:
+                    failed = index
+                    # the peers of a dead worker block in the collective operations of the steps
+                    for other in running.values():
+                        processes[other].terminate()
+
+        if failed is not None:
+            raise RuntimeError(f"Worker {failed} failed, the other workers were stopped")
@@ -0,0 +1,298 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import product
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import random
+import sqlite3
+from typing import Any, Optional
+import tensorflow as tf
+
+from constants import Constants
+from sentiment import Sentiment
+from train.async_checkpoint import AsyncWeightsCheckpoint
+from train.lyric_generation.data_loader import DataLoader as DataLoaderLyrics
+from train.lyric_generation.model_creator import ModelCreator as ModelCreatorLyrics
+from train.music_creator.model_creator import ModelCreator as ModelCreatorMusic
+from train.sentiment_classifier.data_loader import DataLoader as DataLoaderSentiment
+from train.sentiment_classifier.model_creator import ModelCreator as ModelCreatorSentiment
+from train.train import prepare_music_data
+
+
+@dataclass
+class Trial:
+    trial_id: int
+    params: dict[str, Any]
+    score: Optional[float] = None
+
+
+class HyperparameterSearch:
+    """Searches the hyperparameters of a trainer with successive halving. Every trial trains a
+    model for a few epochs; only the best 1/eta of the trials are trained further, for eta times
+    more epochs, until a single trial is left or the epoch budget is reached. Trials run in
+    parallel worker processes and continue from their own checkpoints, so no epoch is trained
+    twice. The results are recorded in a local SQLite store, which also lets an interrupted search
+    continue where it stopped"""
+
+    SEARCH_SPACES: dict[str, dict[str, list]] = {
+        "sentiment": {
+            "batch_size": [128, 256, 512],
+            "n_units": [128, 256, 512],
+            "dropout_rate": [0.1, 0.2, 0.35],
+        },
+        "music": {
+            "batch_size": [128, 256, 512],
+            "learning_rate": [0.001, 0.005, 0.01],
+            "first_layer_units": [256, 512],
+            "dropout_rate": [0.15, 0.25, 0.35],
+        },
+        "lyrics": {
+            "batch_size": [256, 512, 1024],
+            "learning_rate": [0.001, 0.005, 0.01],
+            "n_units": [64, 128, 256],
+            "dropout_rate": [0.2, 0.35, 0.5],
+        },
+    }
+    STORE_PATH = Path(Constants.HYPERPARAMETER_SEARCH_DIR, "trials.sqlite")
+
+    # data of the trainer, loaded once in every worker process
+    _data: tuple[Any, Optional[dict[str, int]]] = (None, None)
+
+    def __init__(
+        self,
+        trainer: str,
+        n_trials: int = 27,
+        min_epochs: int = 2,
+        max_epochs: int = 54,
+        eta: int = 3,
+        n_workers: int = os.cpu_count() or 1,
+        search_space: Optional[dict[str, list]] = None,
+        study: Optional[str] = None,
+        seed: int = 42,
+    ) -> None:
+        """
+        Args:
+            trainer (str): "sentiment", "music" or "lyrics"
+            n_trials (int, optional): Number of sampled configurations. Defaults to 27.
+            min_epochs (int, optional): Epochs of every trial in the first round. Defaults to 2.
+            max_epochs (int, optional): Maximum number of epochs of a trial. Defaults to 54.
+            eta (int, optional): Reduction factor between rounds. Defaults to 3.
+            n_workers (int, optional): Number of trials trained at once. Defaults to the CPU
+                count.
+            search_space (Optional[dict[str, list]], optional): Values of every
+                hyperparameter. Defaults to the search space of the trainer.
+            study (Optional[str], optional): Name of the search in the store. Defaults to the
+                name of the trainer.
+            seed (int, optional): Seed used to sample the configurations. Defaults to 42.
+
+        Raises:
+            ValueError: If the trainer is unknown or the budget is not valid
+        """
+        if trainer not in self.SEARCH_SPACES:
+            raise ValueError(f"Unknown trainer {trainer}")
+        if eta < 2 or not 0 < min_epochs <= max_epochs:
+            raise ValueError("The reduction factor or the epoch budget is not valid")
+        self._trainer = trainer
+        self._n_trials = n_trials
+        self._min_epochs = min_epochs
+        self._max_epochs = max_epochs
+        self._eta = eta
+        self._n_workers = n_workers
+        self._search_space = search_space or self.SEARCH_SPACES[trainer]
+        self._study = study or trainer
+        self._seed = seed
+
+    def _sample_trials(self) -> list[Trial]:
+        """Samples distinct configurations from the search space. The sampling is seeded, so a
+        search which continues gets the same trials
+
+        Returns:
+            list[Trial]: Sampled trials
+        """
+        names = sorted(self._search_space)
+        grid = list(product(*(self._search_space[name] for name in names)))
+        configurations = random.Random(self._seed).sample(grid, min(self._n_trials, len(grid)))
+        return [
+            Trial(trial_id, dict(zip(names, values)))
+            for trial_id, values in enumerate(configurations)
+        ]
+
+    def _trial_dir(self, trial: Trial) -> Path:
+        return Path(Constants.HYPERPARAMETER_SEARCH_DIR, self._study, f"trial_{trial.trial_id}")
+
+    def _load_data(self) -> tuple[Any, Optional[dict[str, int]]]:
+        """Loads the data of the trainer, which is shared by all trials
+
+        Returns:
+            tuple[Any, Optional[dict[str, int]]]: Data container and word index, if any
+        """
+        if self._trainer == "sentiment":
+            data_container, tokenizer = DataLoaderSentiment().run()
+            return data_container, tokenizer.word_index
+        if self._trainer == "lyrics":
+            data_container, tokenizer = DataLoaderLyrics().run()
+            return data_container, tokenizer.word_index
+        return prepare_music_data(), None
+
+    @staticmethod
+    def _init_worker(data: tuple[Any, Optional[dict[str, int]]], n_threads: int) -> None:
+        """Initializes a worker process, which trains one trial at a time
+
+        Args:
+            data (tuple[Any, Optional[dict[str, int]]]): Data of the trainer
+            n_threads (int): Number of threads used by TensorFlow
+        """
+        HyperparameterSearch._data = data
+        tf.config.threading.set_intra_op_parallelism_threads(n_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(n_threads)
+
+    @staticmethod
+    def _run_trial(trainer: str, params: dict[str, Any], n_epochs: int, trial_dir: str) -> None:
+        """Trains a trial up to a number of epochs, continuing from its checkpoint. Runs in a
+        worker process
+
+        Args:
+            trainer (str): "sentiment", "music" or "lyrics"
+            params (dict[str, Any]): Hyperparameters of the trial
+            n_epochs (int): Total number of epochs of the trial after this round
+            trial_dir (str): Directory of the checkpoints and the model of the trial
+        """
+        data_container, word_index = HyperparameterSearch._data
+        model_path = str(Path(trial_dir, "model.keras"))
+        if trainer == "sentiment":
+            model_creator = ModelCreatorSentiment(
+                len(Sentiment),
+                word_index,
+                params["batch_size"],
+                data_container,
+                model_path=model_path,
+                checkpoint_dir=trial_dir,
+            )
+            model = model_creator.get_new_model(params["n_units"], params["dropout_rate"])
+        elif trainer == "music":
+            model_creator = ModelCreatorMusic(
+                validation_size=0.2,
+                batch_size=params["batch_size"],
+                learning_rate=params["learning_rate"],
+                data_container=data_container,
+                model_path=model_path,
+                checkpoint_dir=trial_dir,
+            )
+            model = model_creator.create_model(params["first_layer_units"], params["dropout_rate"])
+        else:
+            model_creator = ModelCreatorLyrics(
+                word_index,
+                params["batch_size"],
+                data_container,
+                params.get("num_sampled"),
+                params["learning_rate"],
+                model_path=model_path,
+                checkpoint_dir=trial_dir,
+            )
+            model = model_creator.get_new_model(params["n_units"], params["dropout_rate"])
+        model_creator.train_model(model, n_epochs, resume=True)
+
+    def _open_store(self) -> sqlite3.Connection:
+        self.STORE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.STORE_PATH)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS trials ("
+            "study TEXT, trial INTEGER, rung INTEGER, params TEXT, epochs INTEGER, score REAL, "
+            "PRIMARY KEY (study, trial, rung))"
+        )
+        return connection
+
+    def _recorded_scores(self, store: sqlite3.Connection, rung: int) -> dict[int, Optional[float]]:
+        rows = store.execute(
+            "SELECT trial, score FROM trials WHERE study = ? AND rung = ?", (self._study, rung)
+        )
+        return dict(rows.fetchall())
+
+    def _run_rung(
+        self,
+        executor: ProcessPoolExecutor,
+        store: sqlite3.Connection,
+        trials: list[Trial],
+        rung: int,
+        n_epochs: int,
+    ) -> None:
+        """Trains the trials of a round and records their scores. Trials which are already
+        recorded are not trained again
+
+        Args:
+            executor (ProcessPoolExecutor): Worker processes
+            store (sqlite3.Connection): Results store
+            trials (list[Trial]): Trials of the round
+            rung (int): Index of the round
+            n_epochs (int): Total number of epochs of every trial after this round
+        """
+        recorded = self._recorded_scores(store, rung)
+        futures = {}
+        for trial in trials:
+            if trial.trial_id in recorded:
+                trial.score = recorded[trial.trial_id]
+                continue
+            trial_dir = self._trial_dir(trial)
+            trial_dir.mkdir(parents=True, exist_ok=True)
+            futures[trial.trial_id] = executor.submit(
+                self._run_trial, self._trainer, trial.params, n_epochs, str(trial_dir)
+            )
+
+        for trial in trials:
+            if trial.trial_id not in futures:
+                continue
+            try:
+                futures[trial.trial_id].result()
+                trial.score = AsyncWeightsCheckpoint.read_score(str(self._trial_dir(trial)))
+            except Exception as e:
+                print(f"Trial {trial.trial_id} failed: {e}")
+                trial.score = None
+            with store:
+                store.execute(
+                    "INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        self._study,
+                        trial.trial_id,
+                        rung,
+                        json.dumps(trial.params),
+                        n_epochs,
+                        trial.score,
+                    ),
+                )
+            print(f"Rung {rung}, trial {trial.trial_id}: {trial.params} -> {trial.score}")
+
+    def run(self) -> Trial:
+        """Runs the search
+
+        Returns:
+            Trial: Best trial, with its score on the validation data (negated for losses)
+        """
+        trials = self._sample_trials()
+        data = self._load_data()
+        n_workers = min(self._n_workers, len(trials))
+        # the cores are split between the workers, instead of every worker using all of them
+        n_threads = max((os.cpu_count() or 1) // n_workers, 1)
+
+        with self._open_store() as store, ProcessPoolExecutor(
+            n_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=self._init_worker,
+            initargs=(data, n_threads),
+        ) as executor:
+            rung = 0
+            n_epochs = self._min_epochs
+            while True:
+                self._run_rung(executor, store, trials, rung, n_epochs)
+                trials.sort(
+                    key=lambda trial: -float("inf") if trial.score is None else trial.score,
+                    reverse=True,
+                )
+                if len(trials) == 1 or n_epochs == self._max_epochs:
+                    break
+                trials = trials[: max(len(trials) // self._eta, 1)]
+                rung += 1
+                n_epochs = min(n_epochs * self._eta, self._max_epochs)
+        store.close()
+        return trials[0]
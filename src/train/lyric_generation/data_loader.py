@@ -1,11 +1,21 @@
+from dataclasses import dataclass
+from itertools import chain
 import pickle
-import tensorflow.keras.utils as ku
-from tensorflow.keras.preprocessing.sequence import pad_sequences
+import numpy as np
+import tensorflow as tf
 from tensorflow.keras.preprocessing.text import Tokenizer
 from sklearn.model_selection import train_test_split
 
 from constants import Constants
-from train.utils import DataContainer
+from train.distributed import DataParallelLauncher
+
+
+@dataclass
+class PrefixDataContainer:
+    tokens: np.ndarray
+    train_pairs: np.ndarray
+    test_pairs: np.ndarray
+    max_sequence_len: int
 
 
 class DataLoader:
@@ -15,20 +25,24 @@ class DataLoader:
         Returns:
             list[str]: Filtered lyrics
         """
-        all_lines = set()
         with open("../data/Datasets/lyrics/all_lyrics.txt", "r") as f:
-            lines = f.readlines()
-            all_lines.update(lines)
-
-        count = {}
-        for line in all_lines:
-            for word in line.split():
-                if word not in count:
-                    count[word] = 0
-                count[word] += 1
-        filtered_lines = [l for l in all_lines if all(count[w] >= 45 for w in l.split())]
-        filtered_lines = [l for l in filtered_lines if len(l.split()) > 2]
-        return filtered_lines
+            all_lines = sorted(set(f))
+
+        words_per_line = [line.split() for line in all_lines]
+        line_lengths = np.fromiter(map(len, words_per_line), dtype=np.int64, count=len(all_lines))
+        all_words = np.array(list(chain.from_iterable(words_per_line)))
+        _, word_ids, word_counts = np.unique(all_words, return_inverse=True, return_counts=True)
+
+        # frequency of the rarest word of every line
+        non_empty = line_lengths > 0
+        line_starts = np.cumsum(line_lengths) - line_lengths
+        min_counts = np.zeros(len(all_lines), dtype=np.int64)
+        min_counts[non_empty] = np.minimum.reduceat(
+            word_counts[word_ids.reshape(-1)], line_starts[non_empty]
+        )
+
+        keep = (min_counts >= 45) & (line_lengths > 2)
+        return [line for line, kept in zip(all_lines, keep) if kept]
 
     def _get_new_tokenizer(self, filtered_lines: list[str]) -> Tokenizer:
         """Creates a new tokenizer, fits it on the provided verses, and saves it to disk
@@ -45,41 +59,71 @@ class DataLoader:
             pickle.dump(tokenizer, tokenizer_path)
         return tokenizer
 
-    def run(self) -> tuple[DataContainer, Tokenizer]:
-        """Loads data, splits it into feature/targets, then into training/test. This is then
-        converted to numeric form using a tokenizer.
+    @staticmethod
+    def create_dataset(
+        tokens: np.ndarray,
+        pairs: np.ndarray,
+        max_sequence_len: int,
+        batch_size: int,
+        shuffle: bool,
+    ) -> tf.data.Dataset:
+        """Creates a pipeline which expands the lines into padded prefix/target pairs, one batch
+        at a time, so the expanded dataset is never held in memory
+
+        Args:
+            tokens (np.ndarray): Token ids of all lines, concatenated
+            pairs (np.ndarray): Start of the line and position of the target, for every sample
+            max_sequence_len (int): Length of the padded prefixes
+            batch_size (int): Number of samples in a batch
+            shuffle (bool): If set, the samples are shuffled on every pass
 
         Returns:
-            tuple[DataContainer, Tokenizer]: The resulting data splits and the new tokenizer
+            tf.data.Dataset: Batches of pre-padded prefixes and integer targets
         """
-        features, targets = [], []
-        filtered_lines = self._filter_lines()
-
-        for line in filtered_lines:
-            token_list = line.split()
-            for i in range(1, len(token_list)):
-                feature = token_list[:i]
-                target = token_list[i]
-
-                features.append(feature)
-                targets.append([target])
-
-        x_train, x_test, y_train, y_test = train_test_split(
-            features, targets, test_size=0.2, random_state=42
+        all_tokens = tf.constant(tokens, dtype=tf.int32)
+        relative_positions = tf.range(-max_sequence_len, 0, dtype=tf.int64)
+
+        def expand(batch_pairs: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+            line_starts = batch_pairs[:, 0:1]
+            target_positions = batch_pairs[:, 1:2]
+            positions = target_positions + relative_positions
+            prefixes = tf.where(
+                positions >= line_starts,
+                tf.gather(all_tokens, tf.maximum(positions, 0)),
+                tf.zeros_like(positions, dtype=tf.int32),
+            )
+            return prefixes, tf.gather(all_tokens, batch_pairs[:, 1])
+
+        dataset = tf.data.Dataset.from_tensor_slices(pairs)
+        if shuffle:
+            dataset = dataset.shuffle(len(pairs), reshuffle_each_iteration=True)
+        return DataParallelLauncher.without_auto_sharding(
+            dataset.batch(batch_size)
+            .map(expand, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE)
         )
 
+    def run(self) -> tuple[PrefixDataContainer, Tokenizer]:
+        """Loads data, converts every line to token ids using a tokenizer, then splits the
+        prefix/target pairs into training/test. Every line is stored once; the pairs only hold
+        the start of the line and the position of the target.
+
+        Returns:
+            tuple[PrefixDataContainer, Tokenizer]: The resulting data splits and the new tokenizer
+        """
+        filtered_lines = self._filter_lines()
         tokenizer = self._get_new_tokenizer(filtered_lines)
-        total_words = len(tokenizer.word_index) + 1
         max_sequence_len = max(len(line.split()) for line in filtered_lines)
 
-        x_train = tokenizer.texts_to_sequences(x_train)
-        x_test = tokenizer.texts_to_sequences(x_test)
-        y_train = tokenizer.texts_to_sequences(y_train)
-        y_test = tokenizer.texts_to_sequences(y_test)
+        sequences = tokenizer.texts_to_sequences(filtered_lines)
+        line_lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        tokens = np.fromiter(chain.from_iterable(sequences), dtype=np.int32)
 
-        x_train = pad_sequences(x_train, maxlen=max_sequence_len)
-        x_test = pad_sequences(x_test, maxlen=max_sequence_len)
-        y_train = ku.to_categorical(y_train, num_classes=total_words)
-        y_test = ku.to_categorical(y_test, num_classes=total_words)
+        # every token, apart from the first one of its line, is the target of a prefix
+        line_starts = np.repeat(np.cumsum(line_lengths) - line_lengths, line_lengths)
+        positions = np.arange(len(tokens), dtype=np.int64)
+        is_target = positions > line_starts
+        pairs = np.stack([line_starts[is_target], positions[is_target]], axis=1)
 
-        return DataContainer(x_train, x_test, y_train, y_test), tokenizer
+        train_pairs, test_pairs = train_test_split(pairs, test_size=0.2, random_state=42)
+        return PrefixDataContainer(tokens, train_pairs, test_pairs, max_sequence_len), tokenizer
@@ -1,15 +1,21 @@
+from pathlib import Path
+from typing import Optional
 import numpy as np
+import tensorflow as tf
 
 from tensorflow.keras.models import Sequential, Model
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, History
+from tensorflow.keras.callbacks import EarlyStopping, History
 
-import numpy as np
-from tensorflow.keras.layers import Embedding, LSTM, Dense, Dropout, Bidirectional
-from tensorflow.keras.metrics import CategoricalAccuracy
+from tensorflow.keras.layers import Embedding, Input, LSTM, Dense, Dropout, Bidirectional
+from tensorflow.keras.metrics import SparseCategoricalAccuracy
 from tensorflow.keras.optimizers import RMSprop
 
 from constants import Constants
-from train.utils import DataContainer, Utils
+from train.async_checkpoint import AsyncWeightsCheckpoint
+from train.distributed import DataParallelLauncher
+from train.lyric_generation.data_loader import DataLoader, PrefixDataContainer
+from train.lyric_generation.sampled_softmax import SampledSoftmaxLoss
+from train.utils import Utils
 
 
 class ModelCreator:
@@ -17,15 +23,78 @@ class ModelCreator:
         self,
         word_index: dict[str, int],
         batch_size: int,
-        data_container: DataContainer,
+        data_container: PrefixDataContainer,
+        num_sampled: Optional[int] = None,
+        learning_rate: float = 0.005,
+        model_path: str = Constants.LYRICS_MODEL_PATH,
+        checkpoint_dir: str = str(Path(Constants.CHECKPOINTS_DIR, "lyrics")),
     ) -> None:
+        """
+        Args:
+            word_index (dict[str, int]): Mapping of words to numerical indices
+            batch_size (int): Number of samples in a batch, over all the training workers
+            data_container (PrefixDataContainer): Training and test data
+            num_sampled (Optional[int], optional): If set, the model is trained with a sampled
+                softmax using this many sampled words per batch. Defaults to None.
+            learning_rate (float, optional): Learning rate. Defaults to 0.005.
+            model_path (str, optional): Location of the trained model. Defaults to
+                Constants.LYRICS_MODEL_PATH.
+            checkpoint_dir (str, optional): Directory of the training checkpoints. Defaults to
+                the lyrics directory in Constants.CHECKPOINTS_DIR.
+        """
         self._word_index = word_index
         self._vocabulary_size = len(word_index) + 1
         self._batch_size = batch_size
         self._data_container = data_container
+        self._num_sampled = num_sampled
+        self._learning_rate = learning_rate
+        self._model_path = model_path
+        self._checkpoint_dir = checkpoint_dir
+
+    def _create_dataset(self, pairs: np.ndarray, shuffle: bool) -> tf.data.Dataset:
+        """Creates the input pipeline for a data split
+
+        Args:
+            pairs (np.ndarray): Prefix/target pairs of the split
+            shuffle (bool): If set, the samples are shuffled on every pass
+
+        Returns:
+            tf.data.Dataset: Batches of padded prefixes and integer targets
+        """
+        return DataLoader.create_dataset(
+            self._data_container.tokens,
+            pairs,
+            self._data_container.max_sequence_len,
+            DataParallelLauncher.worker_batch_size(self._batch_size),
+            shuffle,
+        )
+
+    def _create_sampled_training_model(self, model: Model) -> Model:
+        """Creates a model which shares its layers with the given one, but outputs the sampled
+        softmax loss of every sample, instead of the full vocabulary distribution
+
+        Args:
+            model (Model): Model that is trained, ending in the vocabulary-sized Dense layer
+
+        Returns:
+            Model: Compiled training model, taking the prefixes and the targets as inputs
+        """
+        prefixes = Input(shape=model.input_shape[1:], dtype="int32")
+        targets = Input(shape=(), dtype="int32")
+        hidden = prefixes
+        for layer in model.layers[:-1]:
+            hidden = layer(hidden)
+        loss = SampledSoftmaxLoss(model.layers[-1], self._num_sampled)([hidden, targets])
+
+        training_model = Model([prefixes, targets], loss)
+        training_model.compile(
+            loss=lambda _, sample_loss: sample_loss,
+            optimizer=RMSprop(learning_rate=self._learning_rate),
+        )
+        return training_model
 
     def _create_model(
-        self, embedding_matrix: list[np.ndarray], n_units: int, dropout_rate: float
+        self, embedding_matrix: np.ndarray, n_units: int, dropout_rate: float
     ) -> Model:
         """Creates a new model
 
@@ -51,16 +120,16 @@ class ModelCreator:
         model.add(Dropout(dropout_rate))
         model.add(LSTM(n_units // 2))
         model.add(Dense(self._vocabulary_size, activation="softmax"))
-        optimizer = RMSprop(learning_rate=0.005)
+        optimizer = RMSprop(learning_rate=self._learning_rate)
         model.compile(
-            loss="categorical_crossentropy",
+            loss="sparse_categorical_crossentropy",
             optimizer=optimizer,
-            metrics=["accuracy", CategoricalAccuracy()],
+            metrics=["accuracy", SparseCategoricalAccuracy()],
         )
         return model
 
     def get_new_model(self, n_units: int = 128, dropout_rate: float = 0.35) -> Model:
-        """Creates new model. If necessary, the embedding matrix is downloaded and loaded into memory
+        """Creates new model. If necessary, the embedding matrix is downloaded and cached
 
         Args:
             n_units (int, optional): Number of units in the first LSTM layer. Defaults to 128.
@@ -69,41 +138,63 @@ class ModelCreator:
         Returns:
             Model: Compiled model (not yet trained)
         """
-        if not Utils.EMBEDDING_MATRIX_PATH.exists():
-            Utils.download_embedding_matrix()
         embedding_matrix = Utils.load_embedding_matrix(self._vocabulary_size, self._word_index)
         return self._create_model(embedding_matrix, n_units, dropout_rate)
 
-    def train_model(self, model: Model, n_epochs: int) -> History:
+    def train_model(self, model: Model, n_epochs: int, resume: bool = False) -> History:
         """Trains a model for a number of epochs. The best model (defined by its validation
-        accuracy) is saved after every epoch. Moreover, the process stops if no progress is
-        made for 100 epochs. Training starts in epoch 0.
+        accuracy, or its full validation loss when training with a sampled softmax) is kept
+        after every epoch and written to disk in the background. Moreover, the process stops if
+        no progress is made for 100 epochs. Training starts in epoch 0, unless it is resumed.
 
         Args:
             model (Model): Model that is trained
             n_epochs (int): Number of epochs that the model is trained for.
+            resume (bool, optional): If set, the training continues from the last checkpoint,
+                including the optimizer state. Defaults to False.
 
         Returns:
             History: Contains the progression of the main training metrics (loss, accuracy, ..)
         """
-        checkpoint = ModelCheckpoint(
-            Constants.LYRICS_MODEL_PATH,
-            monitor="val_categorical_accuracy",
-            save_best_only=True,
-            save_freq="epoch",
+        train_dataset = self._create_dataset(self._data_container.train_pairs, shuffle=True)
+        test_dataset = self._create_dataset(self._data_container.test_pairs, shuffle=False)
+        if self._num_sampled:
+            # the sampled loss is only an estimate, so progress is measured with the full loss
+            # on the validation data
+            monitor, mode, initial_value_threshold = "val_loss", "min", None
+            training_model = self._create_sampled_training_model(model)
+            train_dataset, test_dataset = [
+                dataset.map(lambda prefixes, targets: ((prefixes, targets), targets))
+                for dataset in [train_dataset, test_dataset]
+            ]
+        else:
+            monitor, mode, initial_value_threshold = "val_sparse_categorical_accuracy", "max", 0
+            training_model = model
+
+        checkpoint = AsyncWeightsCheckpoint(
+            self._model_path,
+            self._checkpoint_dir,
+            monitor=monitor,
+            mode=mode,
+            initial_value_threshold=initial_value_threshold,
+            target_model=model,
             verbose=2,
-            initial_value_threshold=0,
-        )
-        stop_early = EarlyStopping(monitor="val_categorical_accuracy", patience=100)
-
-        history = model.fit(
-            self._data_container.x_train_pad,
-            self._data_container.y_train,
-            batch_size=self._batch_size,
-            epochs=n_epochs,
-            callbacks=[checkpoint, stop_early],
-            validation_data=(self._data_container.x_test, self._data_container.y_test),
         )
+        checkpoint.set_model(training_model)
+        initial_epoch = checkpoint.restore() if resume else 0
+        stop_early = EarlyStopping(monitor=monitor, mode=mode, patience=100)
+
+        # the checkpoint writer is not stopped by Keras when fit raises
+        try:
+            history = training_model.fit(
+                train_dataset,
+                epochs=n_epochs,
+                initial_epoch=initial_epoch,
+                callbacks=[checkpoint, stop_early],
+                validation_data=test_dataset,
+            )
+        finally:
+            checkpoint.stop()
 
         return history
 
@@ -117,8 +208,6 @@ class ModelCreator:
             list[str]: Validation loss and accuracy
         """
         result = model.evaluate(
-            self._data_container.x_test,
-            self._data_container.y_test,
-            batch_size=self._batch_size,
+            self._create_dataset(self._data_container.test_pairs, shuffle=False)
         )
         return result
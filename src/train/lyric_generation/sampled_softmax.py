@@ -0,0 +1,30 @@
+import tensorflow as tf
+from tensorflow.keras.layers import Dense, Layer
+
+
+class SampledSoftmaxLoss(Layer):
+    """Computes the loss of the output layer of the lyrics model. During training, the softmax is
+    approximated with a small number of sampled words, drawn from a log-uniform distribution,
+    which matches the tokenizer ids (ordered by decreasing frequency). Otherwise, the loss is
+    computed over the full vocabulary, so validation metrics stay comparable."""
+
+    def __init__(self, output_layer: Dense, num_sampled: int, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self._output_layer = output_layer
+        self._num_sampled = num_sampled
+
+    def call(self, inputs: list[tf.Tensor], training: bool = None) -> tf.Tensor:
+        hidden, targets = inputs
+        targets = tf.cast(tf.reshape(targets, (-1,)), tf.int64)
+        kernel, bias = self._output_layer.kernel, self._output_layer.bias
+        if training:
+            return tf.nn.sampled_softmax_loss(
+                weights=tf.transpose(kernel),
+                biases=bias,
+                labels=tf.expand_dims(targets, -1),
+                inputs=hidden,
+                num_sampled=self._num_sampled,
+                num_classes=self._output_layer.units,
+            )
+        logits = tf.matmul(hidden, kernel) + bias
+        return tf.nn.sparse_softmax_cross_entropy_with_logits(labels=targets, logits=logits)
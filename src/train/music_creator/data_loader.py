@@ -1,111 +1,216 @@
+from array import array
+from dataclasses import dataclass
+import json
+from pathlib import Path
 import pickle
 import numpy as np
 from sklearn.model_selection import train_test_split
-import tensorflow
 
 from constants import Constants
-from train.utils import DataContainer
 
 
-class DataLoader:
-    def __init__(self, lim: int) -> None:
-        self._lim = lim
+@dataclass
+class DataContainer:
+    # the windows are not materialized: a sample is the start of its window in the token file,
+    # so the data takes 4 bytes per sample and the tokens stay on disk
+    tokens_path: str
+    train_indices: np.ndarray
+    seed_indices: np.ndarray
+    vocab_size: int
+
+    @property
+    def tokens(self) -> np.ndarray:
+        return DataLoader.load_tokens(self.tokens_path)
+
+
+@dataclass
+class NoteVocabulary:
+    groups: list[str]
+    counts: np.ndarray
 
-    def get_notes_from_txt(self, txt_path: str) -> list[str]:
-        """Extracts notes and chords from txt file, in groups of 8
 
+class DataLoader:
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, lim: int, notes_per_token: int = Constants.MUSIC_NOTES_PER_TOKEN) -> None:
+        """
         Args:
-            txt_path (str): File which contains notes and chords
+            lim (int): Tokens which appear fewer than this many times are filtered out
+            notes_per_token (int, optional): Number of notes and chords joined in a token. With 1,
+                every note or chord is a token, which gives a much smaller vocabulary. Defaults
+                to Constants.MUSIC_NOTES_PER_TOKEN.
 
-        Returns:
-            list[str]: List of note and chord groups
+        Raises:
+            ValueError: If a group of notes cannot be split into whole tokens
         """
-        all_notes = []
-        with open(txt_path, "r") as f:
-            lines = f.readlines()
-            for line in lines:
-                all_notes.extend(line.split())
-        groups = []
-        group_size = 8
-        for i in range(0, len(all_notes), group_size):
-            groups.append("/".join(all_notes[i : i + group_size]))
-        return groups
-
-    def filter_notes(self, all_notes: list[str]) -> list[str]:
-        """Filters note groups based on their frequency
+        if notes_per_token < 1 or Constants.MUSIC_GROUP_SIZE % notes_per_token:
+            raise ValueError(
+                f"Notes per token must divide the group size ({Constants.MUSIC_GROUP_SIZE})"
+            )
+        self._lim = lim
+        self._notes_per_token = notes_per_token
+
+    def tokenize_notes_txt(self, txt_path: str, tokens_path: str) -> NoteVocabulary:
+        """Streams the notes and chords from the txt file, line by line, in groups of
+        `notes_per_token`. Every group gets an id in order of appearance, the ids are written to a
+        binary file and the frequency of every group is counted in the same pass
 
         Args:
-            all_notes (list[str]): All note groups
+            txt_path (str): File which contains notes and chords
+            tokens_path (str): Binary file where the group ids are written (int32)
 
         Returns:
-            list[str]: List of filtered notes
+            NoteVocabulary: Groups, in the order of their ids, and their frequencies
         """
-        count = {}
-        for n in all_notes:
-            if n not in count:
-                count[n] = 0
-            count[n] += 1
-        filtered_notes = [n for n in all_notes if count[n] >= self._lim]
-        return filtered_notes
-
-    def create_indices(self, filtered_notes: list[str]) -> dict[str, int]:
-        """Creates indices of the note groups (similar to a tokenizer).
-        A reverse index is also saved to disk
+        group_size = self._notes_per_token
+        ids: dict[str, int] = {}
+        counts: list[int] = []
+        chunk = array("i")
+        pending: list[str] = []
+
+        def add_group(group: str) -> None:
+            token = ids.setdefault(group, len(ids))
+            if token == len(counts):
+                counts.append(0)
+            counts[token] += 1
+            chunk.append(token)
+
+        with open(txt_path, "r") as f, open(tokens_path, "wb") as tokens_file:
+            for line in f:
+                # groups can continue on the next line
+                pending.extend(line.split())
+                n_complete = len(pending) - len(pending) % group_size
+                for i in range(0, n_complete, group_size):
+                    add_group("/".join(pending[i : i + group_size]))
+                del pending[:n_complete]
+                if len(chunk) >= self.CHUNK_SIZE:
+                    chunk.tofile(tokens_file)
+                    del chunk[:]
+            if pending:
+                add_group("/".join(pending))
+            chunk.tofile(tokens_file)
+
+        return NoteVocabulary(list(ids), np.array(counts, dtype=np.int64))
+
+    def create_indices(self, vocabulary: NoteVocabulary) -> tuple[np.ndarray, int]:
+        """Creates indices of the note groups which are frequent enough (similar to a tokenizer).
+        A reverse index is also saved to disk, along with the number of notes per token, which the
+        predictions need to split the tokens
 
         Args:
-            filtered_notes (list[str]): Note groups
+            vocabulary (NoteVocabulary): Groups found in the txt file and their frequencies
 
         Returns:
-            dict[str, int]: Index from note to its numerical value
+            tuple[np.ndarray, int]: Lookup from the id of every group to its numerical value, or
+                -1 if the group is filtered out, and the size of the vocabulary (the number of
+                groups which are kept)
         """
-        unique_notes = sorted(list(set(filtered_notes)))
+        unique_notes = sorted(
+            group
+            for group, count in zip(vocabulary.groups, vocabulary.counts)
+            if count >= self._lim
+        )
 
         index = {note: ind for ind, note in enumerate(unique_notes)}
         reverse_index = dict(enumerate(unique_notes))
         with open(Constants.MUSIC_REVERSE_INDEX_PATH, "wb") as reverse_index_path:
             pickle.dump(reverse_index, reverse_index_path)
-        return index
+        with open(Constants.MUSIC_TOKEN_INFO_PATH, "w") as token_info_path:
+            json.dump({"notes_per_token": self._notes_per_token}, token_info_path)
+        lookup = np.array([index.get(group, -1) for group in vocabulary.groups], dtype=np.int32)
+        return lookup, len(reverse_index)
+
+    def filter_tokens(self, raw_tokens_path: str, lookup: np.ndarray, tokens_path: str) -> None:
+        """Converts the group ids to their numerical values, in chunks, dropping the groups which
+        were filtered out
+
+        Args:
+            raw_tokens_path (str): Binary file with the ids written by `tokenize_notes_txt`
+            lookup (np.ndarray): Lookup returned by `create_indices`
+            tokens_path (str): Binary file where the numerical values are written (int32)
+        """
+        raw_tokens = DataLoader.load_tokens(raw_tokens_path)
+        with open(tokens_path, "wb") as tokens_file:
+            for i in range(0, len(raw_tokens), self.CHUNK_SIZE):
+                tokens = lookup[raw_tokens[i : i + self.CHUNK_SIZE]]
+                tokens[tokens >= 0].tofile(tokens_file)
+
+    @staticmethod
+    def load_tokens(tokens_path: str) -> np.ndarray:
+        """Memory-maps a binary token file
+
+        Args:
+            tokens_path (str): Binary file with int32 tokens
+
+        Returns:
+            np.ndarray: Read-only view of the tokens
+        """
+        if Path(tokens_path).stat().st_size == 0:
+            return np.zeros(0, dtype=np.int32)
+        return np.memmap(tokens_path, dtype=np.int32, mode="r")
+
+    @staticmethod
+    def gather_windows(
+        tokens: np.ndarray, indices: np.ndarray, vocab_size: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Builds the features and targets of some samples. Only these windows are read from
+        the tokens and converted to floats
+
+        Args:
+            tokens (np.ndarray): All data, as numerical values of the note groups
+            indices (np.ndarray): Start of the window of every sample
+            vocab_size (int): Number of distinct note groups
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Features (float32, scaled by the vocabulary size) and
+                targets (integer ids)
+        """
+        # every window of the token array is a feature, and the token after it is the target
+        windows = np.lib.stride_tricks.sliding_window_view(tokens, Constants.MUSIC_FEATURE_LENGTH)
+        x = windows[indices, :, np.newaxis].astype(np.float32)
+        x /= vocab_size
+        y = np.asarray(tokens[indices + Constants.MUSIC_FEATURE_LENGTH], dtype=np.int32)
+        return x, y
 
     @staticmethod
     def save_seed_to_disk(data_container: DataContainer) -> None:
-        """Saves seed to disk
+        """Saves the seed windows to disk, in chunks, so they are never all in memory at once
 
         Args:
-            data_container (DataContainer): Path where seed is saved
+            data_container (DataContainer): Data whose seed is saved
         """
-        with open(Constants.MUSIC_SEED_PATH, "wb") as music_seed_path:
-            np.save(music_seed_path, data_container.x_seed)
+        tokens = data_container.tokens
+        indices = data_container.seed_indices
+        x_seed = np.lib.format.open_memmap(
+            Constants.MUSIC_SEED_PATH,
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(indices), Constants.MUSIC_FEATURE_LENGTH, 1),
+        )
+        for i in range(0, len(indices), DataLoader.CHUNK_SIZE):
+            chunk = indices[i : i + DataLoader.CHUNK_SIZE]
+            x_seed[i : i + len(chunk)] = DataLoader.gather_windows(
+                tokens, chunk, data_container.vocab_size
+            )[0]
+        x_seed.flush()
 
-    def run(
-        self, filtered_notes: list[str], seed_size: float, index: dict[str, int]
-    ) -> DataContainer:
-        """Computes feature/targets, splits data into test/train, and converts it
-        to numerical form
+    def run(self, tokens_path: str, seed_size: float, vocab_size: int) -> DataContainer:
+        """Splits the samples into train/seed, by the start of their windows. The features and
+        targets are only built, batch by batch, when the samples are used
 
         Args:
-            filtered_notes (list[str]): All data
+            tokens_path (str): Binary file with all data, as numerical values of the note groups
             seed_size (float): Data percentage which will be used as seed
-            index (dict[str, int]): Maps note groups to a numerical value
+            vocab_size (int): Number of distinct note groups
 
         Returns:
             DataContainer: All necessary data sections
         """
-        features = []
-        targets = []
-        for i in range(0, len(filtered_notes) - Constants.MUSIC_FEATURE_LENGTH):
-            feature = filtered_notes[i : i + Constants.MUSIC_FEATURE_LENGTH]
-            target = filtered_notes[i + Constants.MUSIC_FEATURE_LENGTH]
-            features.append([index[j] for j in feature])
-            targets.append(index[target])
-
-        n_datapoints = len(targets)
-
-        vocab_size = len(index)
-        x = (
-            np.reshape(features, (n_datapoints, Constants.MUSIC_FEATURE_LENGTH, 1), order="C")
-        ) / float(vocab_size)
-        y = tensorflow.keras.utils.to_categorical(targets)
-        x_train, x_seed, y_train, y_seed = train_test_split(
-            x, y, test_size=seed_size, random_state=42
+        n_tokens = len(DataLoader.load_tokens(tokens_path))
+        # the last window has no target
+        n_samples = max(n_tokens - Constants.MUSIC_FEATURE_LENGTH, 0)
+        index_dtype = np.int32 if n_tokens < np.iinfo(np.int32).max else np.int64
+        train_indices, seed_indices = train_test_split(
+            np.arange(n_samples, dtype=index_dtype), test_size=seed_size, random_state=42
         )
-        return DataContainer(x_train, y_train, x_seed, y_seed)
+        return DataContainer(tokens_path, train_indices, seed_indices, vocab_size)
@@ -1,12 +1,17 @@
+from pathlib import Path
+import numpy as np
+import tensorflow as tf
 from tensorflow.keras.models import Model
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import LSTM, Dense, Dropout
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, History
+from tensorflow.keras.callbacks import EarlyStopping, History
 from tensorflow.keras.optimizers import Adamax
-from tensorflow.keras.metrics import CategoricalAccuracy
+from tensorflow.keras.metrics import SparseCategoricalAccuracy
 
 from constants import Constants
-from train.utils import DataContainer
+from train.async_checkpoint import AsyncWeightsCheckpoint
+from train.distributed import DataParallelLauncher
+from train.music_creator.data_loader import DataContainer, DataLoader
 
 
 class ModelCreator:
@@ -16,11 +21,50 @@ class ModelCreator:
         batch_size: int,
         learning_rate: float,
         data_container: DataContainer,
+        model_path: str = Constants.MUSIC_MODEL_PATH,
+        checkpoint_dir: str = str(Path(Constants.CHECKPOINTS_DIR, "music")),
     ) -> None:
         self._validation_size = validation_size
         self._batch_size = batch_size
         self._learning_rate = learning_rate
         self._data_container = data_container
+        self._model_path = model_path
+        self._checkpoint_dir = checkpoint_dir
+
+    def _create_dataset(self, indices: np.ndarray, shuffle: bool) -> tf.data.Dataset:
+        """Creates the input pipeline for a data split. The windows of a batch are read from the
+        memory-mapped tokens and converted when the batch is needed, so the corpus may be larger
+        than the memory
+
+        Args:
+            indices (np.ndarray): Start of the window of every sample
+            shuffle (bool): If set, the samples are shuffled on every pass
+
+        Returns:
+            tf.data.Dataset: Batches of features and targets
+        """
+        tokens = self._data_container.tokens
+        vocab_size = self._data_container.vocab_size
+        # only the indices are shuffled, so the shuffle buffer stays small
+        dataset = tf.data.Dataset.from_tensor_slices(indices)
+        if shuffle:
+            dataset = dataset.shuffle(len(indices), reshuffle_each_iteration=True)
+
+        def gather(batch_indices: tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+            x, y = tf.numpy_function(
+                lambda i: DataLoader.gather_windows(tokens, i, vocab_size),
+                [batch_indices],
+                (tf.float32, tf.int32),
+            )
+            x.set_shape([None, Constants.MUSIC_FEATURE_LENGTH, 1])
+            y.set_shape([None])
+            return x, y
+
+        return DataParallelLauncher.without_auto_sharding(
+            dataset.batch(DataParallelLauncher.worker_batch_size(self._batch_size))
+            .map(gather, num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE)
+        )
 
     def create_model(self, first_layer_units: int = 512, dropout_rate: float = 0.25) -> Model:
         """Creates a new model
@@ -36,11 +80,7 @@ class ModelCreator:
         model.add(
             LSTM(
                 first_layer_units,
-                input_shape=(
-                    self._data_container.x_train_pad.shape[1]
-                    + self._data_container.x_test_pad.shape[1],
-                    self._data_container.x_train_pad.shape[2],
-                ),
+                input_shape=(Constants.MUSIC_FEATURE_LENGTH, 1),
                 return_sequences=True,
             )
         )
@@ -48,48 +88,57 @@ class ModelCreator:
         model.add(LSTM(first_layer_units // 2))
         model.add(Dense(first_layer_units // 2))
         model.add(Dropout(dropout_rate))
-        model.add(
-            Dense(
-                self._data_container.y_train.shape[1] + self._data_container.y_test.shape[1],
-                activation="softmax",
-            )
-        )
+        model.add(Dense(self._data_container.vocab_size, activation="softmax"))
         optimizer = Adamax(learning_rate=self._learning_rate)
         model.compile(
-            loss="categorical_crossentropy", optimizer=optimizer, metrics=[CategoricalAccuracy()]
+            loss="sparse_categorical_crossentropy",
+            optimizer=optimizer,
+            metrics=[SparseCategoricalAccuracy()],
         )
 
         return model
 
-    def train_model(self, model: Model, n_epochs: int) -> History:
+    def train_model(self, model: Model, n_epochs: int, resume: bool = False) -> History:
         """Trains a model for a number of epochs. The best model (defined by its validation
-        accuracy) is saved after every epoch. Moreover, the process stops if no progress is
-        made for half the number of epochs. Training starts in epoch 0.
+        accuracy) is kept after every epoch and written to disk in the background. Moreover, the
+        process stops if no progress is made for half the number of epochs. Training starts in
+        epoch 0, unless it is resumed.
 
         Args:
             model (Model): Model that is trained
             n_epochs (int): Number of epochs that the model is trained for.
+            resume (bool, optional): If set, the training continues from the last checkpoint,
+                including the optimizer state. Defaults to False.
 
         Returns:
             History: Contains the progression of the main training metrics (loss, accuracy, ..)
         """
-        checkpoint = ModelCheckpoint(
-            Constants.MUSIC_MODEL_PATH,
-            monitor="val_categorical_accuracy",
-            save_best_only=True,
-            save_freq="epoch",
+        checkpoint = AsyncWeightsCheckpoint(
+            self._model_path,
+            self._checkpoint_dir,
+            monitor="val_sparse_categorical_accuracy",
             verbose=2,
             initial_value_threshold=0,
         )
-        stop_early = EarlyStopping(monitor="val_categorical_accuracy", patience=n_epochs // 2)
-        history = model.fit(
-            self._data_container.x_train,
-            self._data_container.y_train,
-            batch_size=self._batch_size,
-            epochs=n_epochs,
-            callbacks=[checkpoint, stop_early],
-            validation_split=self._validation_size,
+        checkpoint.set_model(model)
+        initial_epoch = checkpoint.restore() if resume else 0
+        stop_early = EarlyStopping(
+            monitor="val_sparse_categorical_accuracy", patience=n_epochs // 2
         )
+        # the validation data is the last part of the training data, as with `validation_split`
+        indices = self._data_container.train_indices
+        split_at = int(len(indices) * (1 - self._validation_size))
+        # the checkpoint writer is not stopped by Keras when fit raises
+        try:
+            history = model.fit(
+                self._create_dataset(indices[:split_at], shuffle=True),
+                epochs=n_epochs,
+                initial_epoch=initial_epoch,
+                callbacks=[checkpoint, stop_early],
+                validation_data=self._create_dataset(indices[split_at:], shuffle=False),
+            )
+        finally:
+            checkpoint.stop()
         return history
 
     def evaluate_model(self, model: Model) -> list[str]:
@@ -102,6 +151,6 @@ class ModelCreator:
             list[str]: Validation loss and accuracy
         """
         result = model.evaluate(
-            self._data_container.x_seed, self._data_container.y_seed, batch_size=self._batch_size
+            self._create_dataset(self._data_container.seed_indices, shuffle=False)
         )
         return result
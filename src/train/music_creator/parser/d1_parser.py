@@ -1,35 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import os
 from pathlib import Path
 from music21 import chord, converter, instrument, note, stream
 
 from parser.dataset_parser import DatasetParser
+from parser.midi_reader import MidiReader
+from parser.pitch_class_sets import PitchClassSets
 
 
 class D1Parser(DatasetParser):
-    def _extract_notes(self, converted_midi_files: list[stream.Stream]) -> list[str]:
-        """Extracts notes and chords from a list of converted MIDI files 
+    CACHE_DIR = Path("Cache", "d1")
+
+    def __init__(self, n_workers: int = os.cpu_count() or 1, use_music21: bool = False) -> None:
+        """
+        Args:
+            n_workers (int, optional): Number of parsing processes. Defaults to the CPU count.
+            use_music21 (bool, optional): If set, the files are parsed with music21, otherwise
+                with the direct MIDI reader, which is much faster and gives the same notes and
+                chords (see `compare_readers`). Defaults to False.
+        """
+        self._n_workers = n_workers
+        self._use_music21 = use_music21
+
+    def _extract_notes(self, converted_midi_file: stream.Stream) -> list[str]:
+        """Extracts notes and chords from a converted MIDI file
 
         Args:
-            converted_midi_files (list[stream.Stream]): List of MIDI files that have
-                been parsed with `converter.parse()`
+            converted_midi_file (stream.Stream): MIDI file that has been parsed
+                with `converter.parse()`
 
         Returns:
-            list[str]: List of notes and chords from all input files
+            list[str]: List of notes and chords from the input file
         """
         notes = []
-        for file in converted_midi_files:
-            songs = instrument.partitionByInstrument(file)
-            for part in songs.parts:
-                pick = part.recurse()
-                for element in pick:
-                    if isinstance(element, note.Note):
-                        notes.append(str(element.pitch))
-                    elif isinstance(element, chord.Chord):
-                        notes.append(".".join(str(n) for n in element.normalOrder))
+        songs = instrument.partitionByInstrument(converted_midi_file)
+        for part in songs.parts:
+            pick = part.recurse()
+            for element in pick:
+                if isinstance(element, note.Note):
+                    notes.append(str(element.pitch))
+                elif isinstance(element, chord.Chord):
+                    notes.append(PitchClassSets.normal_order(p.midi for p in element.pitches))
         return notes
 
+    def compare_readers(self, midi_files: list[Path]) -> list[Path]:
+        """Parses sample files with both the direct MIDI reader and music21, in order to check
+        that they produce the same notes and chords
+
+        Args:
+            midi_files (list[Path]): Sample MIDI files
+
+        Returns:
+            list[Path]: Files for which the two readers disagree
+        """
+        return [
+            midi
+            for midi in midi_files
+            if MidiReader.read(midi).notes() != self._extract_notes(converter.parse(midi))
+        ]
+
     def _get_all_files_in_directory(self, root_dir: Path) -> list[Path]:
         """Recursively gets all MIDI files in the directory. These can have either
-        the .mid or the .midi extension.
+        the .mid or the .midi extension. The files are sorted, so the output order is
+        deterministic
 
         Args:
             root_dir (Path): Root directory
@@ -37,18 +71,64 @@ class D1Parser(DatasetParser):
         Returns:
             list[Path]: List of all MIDI file paths
         """
-        return list(root_dir.rglob("*.midi")) + list(root_dir.rglob("*.mid"))
+        return sorted(list(root_dir.rglob("*.midi")) + list(root_dir.rglob("*.mid")))
+
+    def _cache_path(self, midi_file: Path) -> Path:
+        """Gets the location of the cached notes of a MIDI file, based on a hash of its content
+
+        Args:
+            midi_file (Path): MIDI file
+
+        Returns:
+            Path: Location of the cached notes
+        """
+        reader = "music21" if self._use_music21 else "direct"
+        return self.CACHE_DIR / reader / f"{hashlib.sha256(midi_file.read_bytes()).hexdigest()}.txt"
+
+    def _parse_file(self, midi_file: Path, cache_path: Path) -> None:
+        """Parses a MIDI file and caches its notes and chords. Files which cannot be parsed are
+        not cached, so they are parsed again by the next run, for instance after a reader fix.
+        Runs in a worker process
+
+        Args:
+            midi_file (Path): MIDI file
+            cache_path (Path): Location of the cached notes
+        """
+        try:
+            if self._use_music21:
+                notes = self._extract_notes(converter.parse(midi_file))
+            else:
+                notes = MidiReader.read(midi_file).notes()
+        except Exception as e:
+            print(f"Could not parse {midi_file}: {e}")
+            return
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(" ".join(notes))
+        tmp_path.replace(cache_path)
 
     def run(self) -> None:
         """Finds all MIDI files in the dataset directory, converts them to objects so that
-        their notes and chords can be extracted, then outputs those notes to a file on disk"""
-        BATCH_SIZE = 10
+        their notes and chords can be extracted, then outputs those notes to a file on disk.
+        Files are parsed in parallel and their notes are cached by content, so only new or
+        changed files are parsed again"""
         ROOT_DIR = Path("Datasets")
+        OUTPUT_FILE = Path("d1_parsed.txt")
 
         midi_files = self._get_all_files_in_directory(ROOT_DIR)
-        for i in range(0, len(midi_files), BATCH_SIZE):
-            converted_midi_files = [
-                converter.parse(midi) for midi in midi_files[i : i + BATCH_SIZE]
-            ]
-            all_notes = self._extract_notes(converted_midi_files)
-            self._save_to_txt_file(all_notes, "d1_parsed.txt")
+        cache_paths = [self._cache_path(midi) for midi in midi_files]
+        if cache_paths:
+            cache_paths[0].parent.mkdir(parents=True, exist_ok=True)
+
+        missing = {
+            cache: midi for midi, cache in zip(midi_files, cache_paths) if not cache.exists()
+        }
+        if missing:
+            with ProcessPoolExecutor(self._n_workers) as executor:
+                list(executor.map(self._parse_file, missing.values(), missing.keys()))
+
+        OUTPUT_FILE.unlink(missing_ok=True)
+        for cache_path in cache_paths:
+            if not cache_path.exists():
+                # the file could not be parsed
+                continue
+            self._save_to_txt_file(cache_path.read_text().split(), str(OUTPUT_FILE))
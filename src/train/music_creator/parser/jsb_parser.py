@@ -1,34 +1,42 @@
-from music21 import chord
 from pathlib import Path
+import numpy as np
 
 from parser.dataset_parser import DatasetParser
+from parser.pitch_class_sets import PitchClassSets
 
 
 class JSBParser(DatasetParser):
-    def _piano_key_to_midi(self, piano_key: int) -> int:
-        """Converts the note of a piano key to its MIDI value
+    def _piano_key_to_midi(self, piano_key: np.ndarray) -> np.ndarray:
+        """Converts the notes of piano keys to their MIDI values
 
         Args:
-            piano_key (int): Piano key note value (from 0-88)
+            piano_key (np.ndarray): Piano key note values (from 0-88)
 
         Returns:
-            int: MIDI value
+            np.ndarray: MIDI values
         """
         return piano_key + 20
 
-    def _convert_piano_key_numbers_to_chord(self, chord_as_piano_keys: str) -> str:
-        """Creates a chord, given the piano keys
+    def _convert_piano_key_file_to_chords(self, file: Path) -> list[str]:
+        """Creates chords for all rows of piano keys in a CSV file, in bulk. Key 0 stands for
+        silence and is ignored
 
         Args:
-            chord_as_piano_keys (str): Piano key note values
+            file (Path): CSV file, with a header row and one row of piano keys per chord
 
         Returns:
-            str: Chord in C scale notation
+            list[str]: Chords in C scale notation
         """
-        chord_notes = [self._piano_key_to_midi(int(n)) for n in chord_as_piano_keys.split(",")]
-        if 20 in chord_notes:
-            chord_notes.remove(20)
-        return ".".join(str(n) for n in chord.Chord(chord_notes).normalOrder)
+        with open(str(file), "r") as f:
+            rows = [line.strip().split(",") for line in f.readlines()[1:] if line.strip()]
+        if not rows:
+            return []
+
+        piano_keys = np.zeros((len(rows), max(len(row) for row in rows)), dtype=np.int64)
+        for i, row in enumerate(rows):
+            piano_keys[i, : len(row)] = [int(n) for n in row]
+        pitches = np.where(piano_keys > 0, self._piano_key_to_midi(piano_keys), -1)
+        return [c for c in PitchClassSets.bulk_normal_order(pitches) if c]
 
     def _convert_piano_key_folder_to_chords(self, dir: Path, output_file: str) -> None:
         """Creates chords for all piano keys in the given folder
@@ -39,16 +47,12 @@ class JSBParser(DatasetParser):
         """
         BATCH_SIZE = 10
 
-        files = dir.rglob("*.csv")
+        files = sorted(dir.rglob("*.csv"))
         for i in range(0, len(files), BATCH_SIZE):
             chords = []
             for file in files[i : i + BATCH_SIZE]:
                 try:
-                    with open(str(file), "r") as f:
-                        lines = f.readlines()[1:]
-                        chords.extend(
-                            [self._convert_piano_key_numbers_to_chord(line[:-1]) for line in lines]
-                        )
+                    chords.extend(self._convert_piano_key_file_to_chords(file))
                 except Exception as e:
                     print(e)
             self._save_to_txt_file(chords, output_file)
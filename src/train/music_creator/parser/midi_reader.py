@@ -0,0 +1,292 @@
+from fractions import Fraction
+from pathlib import Path
+from typing import Optional
+
+from parser.pitch_class_sets import PitchClassSets
+
+
+class MidiReader:
+    """Minimal Standard MIDI File reader, which only extracts the notes and chords. It reproduces
+    the parts of the music21 import which change the tokens: notes are paired with their note-offs,
+    notes which start and end together are grouped into chords, offsets and durations are quantized
+    to the default music21 grid, notes which cross a barline are split into tied notes (one token
+    per measure), and the tracks are grouped by instrument (program), in the same way
+    `instrument.partitionByInstrument` does. When notes which start together end at different
+    times, music21 moves them to separate voices, which may reorder the tokens of these measures"""
+
+    DRUM_CHANNEL = 9
+    DEFAULT_TICKS_PER_QUARTER = 480
+    # default `quarterLengthDivisors` of music21: offsets and durations are rounded to the closest
+    # multiple of 1/4 or 1/3 of a quarter note
+    QUANTIZATION_DIVISORS = (4, 3)
+    DEFAULT_MEASURE_LENGTH = Fraction(4)
+    PITCH_NAMES = ["C", "C#", "D", "E-", "E", "F", "F#", "G", "G#", "A", "B-", "B"]
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+
+    @staticmethod
+    def read(midi_file: Path) -> "MidiReader":
+        return MidiReader(midi_file.read_bytes())
+
+    @staticmethod
+    def _read_variable_length(data: bytes, pos: int) -> tuple[int, int]:
+        """Reads a variable-length quantity
+
+        Args:
+            data (bytes): Track data
+            pos (int): Position of the first byte of the quantity
+
+        Returns:
+            tuple[int, int]: The value and the position right after it
+        """
+        value = 0
+        while True:
+            byte = data[pos]
+            pos += 1
+            value = (value << 7) | (byte & 0x7F)
+            if not byte & 0x80:
+                return value, pos
+
+    def _chunks(self) -> tuple[int, list[bytes]]:
+        """Splits the file into its header and track chunks
+
+        Raises:
+            ValueError: If the file is not a Standard MIDI File
+
+        Returns:
+            tuple[int, list[bytes]]: Ticks per quarter note and the data of every track
+        """
+        if self._data[:4] != b"MThd":
+            raise ValueError("Not a Standard MIDI File")
+        header_length = int.from_bytes(self._data[4:8], "big")
+        division = int.from_bytes(self._data[12:14], "big")
+        # SMPTE-based timing has no notion of quarter notes
+        ticks_per_quarter = self.DEFAULT_TICKS_PER_QUARTER if division & 0x8000 else division
+
+        tracks = []
+        pos = 8 + header_length
+        while pos + 8 <= len(self._data):
+            chunk_type = self._data[pos : pos + 4]
+            chunk_length = int.from_bytes(self._data[pos + 4 : pos + 8], "big")
+            if chunk_type == b"MTrk":
+                tracks.append(self._data[pos + 8 : pos + 8 + chunk_length])
+            pos += 8 + chunk_length
+        return ticks_per_quarter, tracks
+
+    def _read_track(
+        self, track: bytes
+    ) -> tuple[Optional[int], list[tuple[int, int, int]], list[tuple[int, Fraction]]]:
+        """Reads the notes of a track, ignoring the drum channel. Every note-on is paired with the
+        first following note-off of the same pitch and channel; notes which are never released are
+        dropped
+
+        Args:
+            track (bytes): Track data
+
+        Returns:
+            tuple[Optional[int], list[tuple[int, int, int]], list[tuple[int, Fraction]]]: First
+                program of the track, if any, the start tick, end tick and pitch of every note, in
+                order of their note-on, and the tick and measure length (in quarter notes) of
+                every time signature
+        """
+        program = None
+        notes: list[Optional[tuple[int, int, int]]] = []
+        # position and start tick of the notes which are still sounding, by channel and pitch
+        sounding: dict[tuple[int, int], list[tuple[int, int]]] = {}
+        time_signatures = []
+        pos = 0
+        tick = 0
+        status = None
+        while pos < len(track):
+            delta, pos = self._read_variable_length(track, pos)
+            tick += delta
+            byte = track[pos]
+            if byte == 0xFF:
+                meta_type = track[pos + 1]
+                length, pos = self._read_variable_length(track, pos + 2)
+                if meta_type == 0x58 and length >= 2:  # time signature
+                    numerator, denominator_power = track[pos], track[pos + 1]
+                    time_signatures.append((tick, Fraction(4 * numerator, 2**denominator_power)))
+                pos += length
+                if meta_type == 0x2F:  # end of track
+                    break
+                continue
+            if byte in (0xF0, 0xF7):
+                length, pos = self._read_variable_length(track, pos + 1)
+                pos += length
+                status = None
+                continue
+            if byte & 0x80:
+                status = byte
+                pos += 1
+            elif status is None:
+                raise ValueError("Data byte without a running status")
+
+            kind, channel = status & 0xF0, status & 0x0F
+            n_data_bytes = 1 if kind in (0xC0, 0xD0) else 2
+            event_data = track[pos : pos + n_data_bytes]
+            pos += n_data_bytes
+            if kind in (0x80, 0x90) and channel != self.DRUM_CHANNEL:
+                key = (channel, event_data[0])
+                if kind == 0x90 and event_data[1] > 0:
+                    sounding.setdefault(key, []).append((len(notes), tick))
+                    notes.append(None)
+                elif sounding.get(key):
+                    index, start = sounding[key].pop(0)
+                    notes[index] = (start, tick, event_data[0])
+            elif kind == 0xC0 and program is None:
+                program = event_data[0]
+        return program, [n for n in notes if n is not None], time_signatures
+
+    def _pitch_to_str(self, pitch: int) -> str:
+        return f"{self.PITCH_NAMES[pitch % 12]}{pitch // 12 - 1}"
+
+    def _group_notes(
+        self, notes: list[tuple[int, int, int]], tolerance: Fraction
+    ) -> list[tuple[int, int, str]]:
+        """Groups the notes of a track into notes and chords, as music21 does: the notes which
+        follow a note and start less than the tolerance after it join its chord if they also end
+        within the tolerance of it. Notes which end at a different time stay single
+
+        Args:
+            notes (list[tuple[int, int, int]]): Start tick, end tick and pitch of every note
+            tolerance (Fraction): Tolerance, in ticks
+
+        Returns:
+            list[tuple[int, int, str]]: Start tick, end tick and string form of every note and
+                chord
+        """
+        sounds = []
+        gathered = set()
+        for i, (start, end, pitch) in enumerate(notes):
+            if i in gathered:
+                continue
+            chord = [(start, end, pitch)]
+            for j in range(i + 1, len(notes)):
+                other_start, other_end, _ = notes[j]
+                if abs(other_start - start) >= tolerance:
+                    break
+                if j in gathered or abs(other_end - end) > tolerance:
+                    continue
+                chord.append(notes[j])
+                gathered.add(j)
+            if len(chord) == 1:
+                sounds.append((start, end, self._pitch_to_str(pitch)))
+            else:
+                # the duration of a chord is the one of its last note
+                last_start, last_end, _ = chord[-1]
+                sounds.append(
+                    (
+                        start,
+                        start + last_end - last_start,
+                        PitchClassSets.normal_order(p for _, _, p in chord),
+                    )
+                )
+        return sounds
+
+    @staticmethod
+    def _quantize(value: Fraction, zero_allowed: bool = True) -> Fraction:
+        """Rounds a value, in quarter notes, to the closest multiple of one of the quantization
+        units, as `Stream.quantize` does. Halfway values are rounded down, and the finest unit
+        wins when the errors are equal
+
+        Args:
+            value (Fraction): Offset or duration
+            zero_allowed (bool, optional): If not set, a value rounded to 0 becomes one unit
+                instead, as for durations. Defaults to True.
+
+        Returns:
+            Fraction: Quantized value
+        """
+        matches = []
+        for divisor in MidiReader.QUANTIZATION_DIVISORS:
+            unit = Fraction(1, divisor)
+            low = unit * (value // unit)
+            match = low if value - low <= unit / 2 else low + unit
+            if not zero_allowed and match == 0:
+                match = unit
+            matches.append((abs(value - match), unit, match))
+        return min(matches)[2]
+
+    @staticmethod
+    def _barlines(
+        time_signatures: list[tuple[Fraction, Fraction]], end: Fraction
+    ) -> list[Fraction]:
+        """Computes the offsets of the barlines, as `makeMeasures` places them: measures start at
+        0, and a time signature applies from the first measure which starts at or after it
+
+        Args:
+            time_signatures (list[tuple[Fraction, Fraction]]): Offset and measure length of every
+                time signature, in quarter notes
+            end (Fraction): Offset after which no barline is needed
+
+        Returns:
+            list[Fraction]: Offsets of the barlines, in increasing order
+        """
+        pending = sorted(time_signatures)
+        measure_length = MidiReader.DEFAULT_MEASURE_LENGTH
+        barlines = []
+        measure_start = Fraction(0)
+        while measure_start < end:
+            while pending and pending[0][0] <= measure_start:
+                measure_length = pending.pop(0)[1]
+            measure_start += measure_length
+            barlines.append(measure_start)
+        return barlines
+
+    def notes(self) -> list[str]:
+        """Extracts the notes and chords, in the same string form as the music21 path: pitch name
+        with octave for notes, normal order joined by "." for chords. A note or chord which lasts
+        over barlines appears once for every measure it sounds in, as tied notes do
+
+        Returns:
+            list[str]: List of notes and chords from the file
+        """
+        ticks_per_quarter, tracks = self._chunks()
+        # the chords follow the quantization: their notes start less than one unit apart
+        tolerance = Fraction(ticks_per_quarter, max(self.QUANTIZATION_DIVISORS))
+
+        track_sounds: list[tuple[Optional[int], list[tuple[Fraction, Fraction, str]]]] = []
+        time_signatures: list[tuple[Fraction, Fraction]] = []
+        for track_index, track in enumerate(tracks):
+            program, notes, track_time_signatures = self._read_track(track)
+            # the time signatures of the first (conductor) track apply to all parts
+            if track_index == 0:
+                time_signatures = [
+                    (self._quantize(Fraction(tick, ticks_per_quarter)), length)
+                    for tick, length in track_time_signatures
+                ]
+            sounds = [
+                (
+                    self._quantize(Fraction(start, ticks_per_quarter)),
+                    self._quantize(Fraction(end - start, ticks_per_quarter), zero_allowed=False),
+                    sound,
+                )
+                for start, end, sound in self._group_notes(notes, tolerance)
+            ]
+            track_sounds.append((program, sounds))
+
+        song_end = max(
+            (offset + length for _, sounds in track_sounds for offset, length, _ in sounds),
+            default=Fraction(0),
+        )
+        barlines = self._barlines(time_signatures, song_end)
+
+        # parts are merged by instrument; in a part, sounds are ordered by offset, then by track,
+        # then the sounds which start at an offset come before the tied sounds continued there
+        parts: dict[Optional[int], list[tuple[Fraction, int, int, int, str]]] = {}
+        for track_index, (program, sounds) in enumerate(track_sounds):
+            if not sounds:
+                continue
+            part = parts.setdefault(program, [])
+            for rank, (offset, length, sound) in enumerate(sounds):
+                part.append((offset, track_index, 0, rank, sound))
+                for barline in barlines:
+                    if offset < barline < offset + length:
+                        part.append((barline, track_index, 1, rank, sound))
+
+        notes = []
+        for part in parts.values():
+            notes.extend(sound for *_, sound in sorted(part))
+        return notes
@@ -0,0 +1,103 @@
+from typing import Iterable
+import numpy as np
+
+
+class PitchClassSets:
+    """Precomputed normal orders of all 4096 pitch-class sets. A set is represented as a 12-bit
+    mask, where bit i is set if pitch class i is present. The normal order is the rotation of the
+    sorted pitch classes with the smallest span, ties being broken by the smallest intervals from
+    the first pitch class (Forte), then by the lowest first pitch class, as in music21"""
+
+    N_PITCH_CLASSES = 12
+    NORMAL_ORDERS: list[str] = []
+    TABLE: np.ndarray = np.array([], dtype=object)
+
+    @staticmethod
+    def _compute_normal_order(mask: int) -> list[int]:
+        """Computes the normal order of a pitch-class set
+
+        Args:
+            mask (int): 12-bit pitch-class set
+
+        Returns:
+            list[int]: Pitch classes in normal order
+        """
+        pitch_classes = [pc for pc in range(PitchClassSets.N_PITCH_CLASSES) if mask >> pc & 1]
+        if not pitch_classes:
+            return []
+
+        def packing(rotation: list[int]) -> tuple[int, ...]:
+            intervals = [(pc - rotation[0]) % PitchClassSets.N_PITCH_CLASSES for pc in rotation]
+            return (intervals[-1], *intervals[1:], rotation[0])
+
+        rotations = [pitch_classes[i:] + pitch_classes[:i] for i in range(len(pitch_classes))]
+        return min(rotations, key=packing)
+
+    @staticmethod
+    def mask(pitches: Iterable[int]) -> int:
+        """Converts MIDI pitches (or pitch classes) to a pitch-class set
+
+        Args:
+            pitches (Iterable[int]): MIDI pitches
+
+        Returns:
+            int: 12-bit pitch-class set
+        """
+        mask = 0
+        for pitch in pitches:
+            mask |= 1 << (pitch % PitchClassSets.N_PITCH_CLASSES)
+        return mask
+
+    @staticmethod
+    def normal_order(pitches: Iterable[int]) -> str:
+        """Gets the normal order of a chord, as pitch classes joined by "."
+
+        Args:
+            pitches (Iterable[int]): MIDI pitches of the chord
+
+        Returns:
+            str: Normal order of the chord
+        """
+        return PitchClassSets.NORMAL_ORDERS[PitchClassSets.mask(pitches)]
+
+    @staticmethod
+    def bulk_normal_order(pitches: np.ndarray) -> np.ndarray:
+        """Gets the normal orders of many chords at once
+
+        Args:
+            pitches (np.ndarray): MIDI pitches, one chord per row. Negative values are ignored,
+                so rows with fewer notes can be padded with -1
+
+        Returns:
+            np.ndarray: Normal order of every chord, as strings ("" for empty rows)
+        """
+        bits = np.where(pitches >= 0, np.left_shift(1, pitches % PitchClassSets.N_PITCH_CLASSES), 0)
+        return PitchClassSets.TABLE[np.bitwise_or.reduce(bits, axis=1)]
+
+    @staticmethod
+    def verify_against_music21() -> list[int]:
+        """Compares the table against the normal orders computed by music21
+
+        Returns:
+            list[int]: Pitch-class sets for which the normal orders differ
+        """
+        from music21 import chord
+
+        return [
+            mask
+            for mask in range(1, 1 << PitchClassSets.N_PITCH_CLASSES)
+            if PitchClassSets.NORMAL_ORDERS[mask]
+            != ".".join(
+                str(pc)
+                for pc in chord.Chord(
+                    [pc for pc in range(PitchClassSets.N_PITCH_CLASSES) if mask >> pc & 1]
+                ).normalOrder
+            )
+        ]
+
+
+PitchClassSets.NORMAL_ORDERS = [
+    ".".join(str(pc) for pc in PitchClassSets._compute_normal_order(mask))
+    for mask in range(1 << PitchClassSets.N_PITCH_CLASSES)
+]
+PitchClassSets.TABLE = np.array(PitchClassSets.NORMAL_ORDERS, dtype=object)
@@ -1,5 +1,11 @@
+import hashlib
+import json
+from pathlib import Path
 import pickle
-import re
+import shutil
+from types import MappingProxyType
+from typing import Any, Mapping
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 from tensorflow.keras.preprocessing.sequence import pad_sequences
@@ -12,6 +18,23 @@ from train.utils import DataContainer
 
 
 class DataLoader:
+    DATASET_DIR = Path("../data/Datasets/sentiment")
+    CSV_NAMES = [
+        "isear.csv",
+        "emotion-stimulus.csv",
+        "dailydialog.csv",
+        "anticipation.csv",
+        "trust.csv",
+    ]
+    CACHE_DIR = Path("../data/Cache/sentiment")
+    CLEANING_PATTERNS = [r"(#[\d\w\.]+)", r"(@[\d\w\.]+)"]
+    TOKENIZER_SETTINGS: Mapping[str, Any] = MappingProxyType({})
+    UNUSED_SENTIMENTS = ("shame", "guilt")
+    N_NEUTRAL_SENTENCES = 15000
+    TEST_SIZE = 0.25
+    # seed of the sampling of the neutral sentences and of the split
+    RANDOM_STATE = 42
+
     def _load_csv_files(self) -> pd.DataFrame:
         """Loads sentence dataset from CSV files
 
@@ -20,14 +43,8 @@ class DataLoader:
         """
         return pd.concat(
             [
-                pd.read_csv(f"../data/Datasets/sentiment/{csv_name}", encoding="utf-8")
-                for csv_name in [
-                    "isear.csv",
-                    "emotion-stimulus.csv",
-                    "dailydialog.csv",
-                    "anticipation.csv",
-                    "trust.csv",
-                ]
+                pd.read_csv(self.DATASET_DIR / csv_name, encoding="utf-8")
+                for csv_name in self.CSV_NAMES
             ],
             ignore_index=True,
         )
@@ -45,18 +62,20 @@ class DataLoader:
         neutral_mask = initial_df["Emotion"] == "neutral"
         only_neutral = initial_df[neutral_mask]
         data = initial_df[~neutral_mask]
-        only_neutral = only_neutral.sample(n=15000, random_state=42)
+        only_neutral = only_neutral.sample(
+            n=self.N_NEUTRAL_SENTENCES, random_state=self.RANDOM_STATE
+        )
         return pd.concat([data, only_neutral], ignore_index=True)
 
     def _remove_unused_sentiments(
-        self, data: pd.DataFrame, unused_sentiments: tuple[str] = ("shame", "guilt")
+        self, data: pd.DataFrame, unused_sentiments: tuple[str, ...] = UNUSED_SENTIMENTS
     ) -> pd.DataFrame:
         """Removes unused sentiments from the input data
 
         Args:
             data (pd.DataFrame): Original dataframe
-            unused_sentiments (tuple[str], optional): Sentiments whose sentences have to be removed.
-            Defaults to ("shame", "guilt").
+            unused_sentiments (tuple[str, ...], optional): Sentiments whose sentences have to be
+            removed. Defaults to UNUSED_SENTIMENTS.
 
         Returns:
             pd.DataFrame: Filtered dataframe
@@ -66,20 +85,18 @@ class DataLoader:
             data = data[~mask]
         return data
 
-    @staticmethod
-    def _clean_text(data: str) -> list[str]:
-        """Removes words with unnecessary characters from input text
+    def _clean_texts(self, texts: pd.Series) -> pd.Series:
+        """Removes words with unnecessary characters from all input texts at once
 
         Args:
-            data (str): Input text
+            texts (pd.Series): Input texts
 
         Returns:
-            list[str]: Words from cleaned text
+            pd.Series: Cleaned texts, with the words separated by single spaces
         """
-        data = re.sub(r"(#[\d\w\.]+)", "", data)
-        data = re.sub(r"(@[\d\w\.]+)", "", data)
-
-        return data.split()
+        for pattern in self.CLEANING_PATTERNS:
+            texts = texts.str.replace(pattern, "", regex=True)
+        return texts.str.split().str.join(" ")
 
     def _get_new_tokenizer(self, all_sentences: list[str]) -> Tokenizer:
         """Creates a new tokenizer, fits it on the provided verses, and saves it to disk
@@ -90,13 +107,38 @@ class DataLoader:
         Returns:
             Tokenizer: Fitted tokenizer instance
         """
-        tokenizer = Tokenizer()
+        tokenizer = Tokenizer(**self.TOKENIZER_SETTINGS)
         tokenizer.fit_on_texts(all_sentences)
         with open(Constants.SENTIMENT_TOKENIZER_PATH, "wb") as tokenizer_path:
             pickle.dump(tokenizer, tokenizer_path)
         return tokenizer
 
-    def run(self) -> tuple[DataContainer, Tokenizer]:
+    def _fingerprint(self) -> str:
+        """Computes a fingerprint of everything the preprocessed corpus depends on: the content
+        of the CSV files, the cleaning rules, the removed sentiments and the tokenizer, sampling
+        and split settings
+
+        Returns:
+            str: Fingerprint of the preprocessed corpus
+        """
+        fingerprint = hashlib.sha256()
+        for csv_name in self.CSV_NAMES:
+            fingerprint.update(csv_name.encode("utf-8"))
+            fingerprint.update((self.DATASET_DIR / csv_name).read_bytes())
+        settings = {
+            "cleaning_patterns": self.CLEANING_PATTERNS,
+            "tokenizer": Tokenizer(**self.TOKENIZER_SETTINGS).get_config(),
+            "max_seq_len": Constants.SENTIMENT_MAX_SEQ_LEN,
+            "n_neutral_sentences": self.N_NEUTRAL_SENTENCES,
+            "test_size": self.TEST_SIZE,
+            "unused_sentiments": self.UNUSED_SENTIMENTS,
+            "random_state": self.RANDOM_STATE,
+            "class_names": Sentiment.class_names(),
+        }
+        fingerprint.update(json.dumps(settings, sort_keys=True).encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def _preprocess(self) -> tuple[DataContainer, Tokenizer]:
         """Loads data, cleans and normalizes it, splits it into feature/targets,
         then into training/test. This is then converted to numeric form using a tokenizer.
 
@@ -104,18 +146,15 @@ class DataLoader:
             tuple[DataContainer, Tokenizer]: The resulting data splits and the new tokenizer
         """
         data = self._remove_unused_sentiments(self._normalize_neutral(self._load_csv_files()))
+        sentences = self._clean_texts(data.Text)
 
-        x_train, x_test, y_train, y_test = train_test_split(
-            data.Text, data.Emotion, test_size=0.25, random_state=42
+        sentences_train, sentences_test, y_train, y_test = train_test_split(
+            sentences, data.Emotion, test_size=self.TEST_SIZE, random_state=self.RANDOM_STATE
         )
 
-        all_sentences = [" ".join(self._clean_text(text)) for text in data.Text]
-        sentences_train = [" ".join(self._clean_text(text)) for text in x_train]
-        sentences_test = [" ".join(self._clean_text(text)) for text in x_test]
-
-        tokenizer = self._get_new_tokenizer(all_sentences)
-        sequence_train = tokenizer.texts_to_sequences(sentences_train)
-        sequence_test = tokenizer.texts_to_sequences(sentences_test)
+        tokenizer = self._get_new_tokenizer(list(sentences))
+        sequence_train = tokenizer.texts_to_sequences(list(sentences_train))
+        sequence_test = tokenizer.texts_to_sequences(list(sentences_test))
 
         x_train_pad = pad_sequences(sequence_train, maxlen=Constants.SENTIMENT_MAX_SEQ_LEN)
         x_test_pad = pad_sequences(sequence_test, maxlen=Constants.SENTIMENT_MAX_SEQ_LEN)
@@ -125,3 +164,36 @@ class DataLoader:
         y_test = to_categorical([encoding[x] for x in y_test])
 
         return DataContainer(x_train_pad, x_test_pad, y_train, y_test), tokenizer
+
+    def run(self) -> tuple[DataContainer, Tokenizer]:
+        """Loads the preprocessed corpus from the cache, if the inputs and settings did not change
+        since it was saved. Otherwise, the corpus is preprocessed and cached.
+
+        Returns:
+            tuple[DataContainer, Tokenizer]: The resulting data splits and the tokenizer
+        """
+        fingerprint = self._fingerprint()
+        corpus_path = self.CACHE_DIR / f"{fingerprint}.npz"
+        tokenizer_path = self.CACHE_DIR / f"{fingerprint}.tokenizer.pkl"
+
+        if corpus_path.exists() and tokenizer_path.exists():
+            with np.load(corpus_path) as corpus:
+                data_container = DataContainer(
+                    corpus["x_train_pad"], corpus["x_test_pad"], corpus["y_train"], corpus["y_test"]
+                )
+            with open(tokenizer_path, "rb") as cached_tokenizer:
+                tokenizer = pickle.load(cached_tokenizer)
+            shutil.copyfile(tokenizer_path, Constants.SENTIMENT_TOKENIZER_PATH)
+            return data_container, tokenizer
+
+        data_container, tokenizer = self._preprocess()
+        self.CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        np.savez(
+            corpus_path,
+            x_train_pad=data_container.x_train_pad,
+            x_test_pad=data_container.x_test_pad,
+            y_train=data_container.y_train,
+            y_test=data_container.y_test,
+        )
+        shutil.copyfile(Constants.SENTIMENT_TOKENIZER_PATH, tokenizer_path)
+        return data_container, tokenizer
@@ -1,30 +1,91 @@
+from pathlib import Path
 import numpy as np
+import tensorflow as tf
 
 from tensorflow.keras.models import Sequential, Model
-from tensorflow.keras.layers import Embedding, LSTM, Dense, Dropout
+from tensorflow.keras.layers import Embedding, Input, LSTM, Dense, Dropout
 from tensorflow.keras.metrics import CategoricalAccuracy
-from tensorflow.keras.callbacks import ModelCheckpoint, EarlyStopping, History
+from tensorflow.keras.callbacks import EarlyStopping, History
 
 from constants import Constants
+from train.async_checkpoint import AsyncWeightsCheckpoint
+from train.distributed import DataParallelLauncher
 from train.utils import DataContainer, Utils
 
 
 class ModelCreator:
+    BUCKET_BOUNDARIES = [16, 32, 64, 128, 256]
+
     def __init__(
         self,
         num_classes: int,
         word_index,
         batch_size: int,
         data_container: DataContainer,
+        model_path: str = Constants.SENTIMENT_MODEL_PATH,
+        checkpoint_dir: str = str(Path(Constants.CHECKPOINTS_DIR, "sentiment")),
     ) -> None:
         self._num_classes = num_classes
         self._word_index = word_index
         self._vocabulary_size = len(word_index) + 1
         self._batch_size = batch_size
         self._data_container = data_container
+        self._model_path = model_path
+        self._checkpoint_dir = checkpoint_dir
+
+    @staticmethod
+    def _get_lengths(x_pad: np.ndarray) -> np.ndarray:
+        # every sentence keeps at least one (masked) token, so no batch is empty
+        return np.maximum(np.count_nonzero(x_pad, axis=1), 1)
+
+    @staticmethod
+    def get_buckets(x_pad: np.ndarray) -> np.ndarray:
+        """Gets the length bucket of every sentence, as used when batching
+
+        Args:
+            x_pad (np.ndarray): Pre-padded sentences
+
+        Returns:
+            np.ndarray: Bucket index of every sentence
+        """
+        return np.searchsorted(
+            ModelCreator.BUCKET_BOUNDARIES, ModelCreator._get_lengths(x_pad), side="right"
+        )
+
+    def _create_dataset(self, x_pad: np.ndarray, y: np.ndarray, shuffle: bool) -> tf.data.Dataset:
+        """Creates the input pipeline for a data split. Sentences are batched together with
+        sentences of similar length and only padded to the longest one in their batch; the
+        padding is masked by the embedding layer
+
+        Args:
+            x_pad (np.ndarray): Pre-padded sentences
+            y (np.ndarray): Targets
+            shuffle (bool): If set, the samples are shuffled on every pass
+
+        Returns:
+            tf.data.Dataset: Batches of sentences and targets
+        """
+        max_seq_len = x_pad.shape[1]
+        lengths = self._get_lengths(x_pad)
+        # sequences are pre-padded, so every sentence is at the end of its row
+        in_sentence = (
+            np.arange(max_seq_len)[np.newaxis, :] >= (max_seq_len - lengths)[:, np.newaxis]
+        )
+        sentences = tf.RaggedTensor.from_row_lengths(x_pad[in_sentence], lengths)
+
+        dataset = tf.data.Dataset.from_tensor_slices((sentences, y))
+        if shuffle:
+            dataset = dataset.shuffle(len(lengths), reshuffle_each_iteration=True)
+        batch_size = DataParallelLauncher.worker_batch_size(self._batch_size)
+        dataset = dataset.bucket_by_sequence_length(
+            element_length_func=lambda sentence, _: tf.shape(sentence)[0],
+            bucket_boundaries=self.BUCKET_BOUNDARIES,
+            bucket_batch_sizes=[batch_size] * (len(self.BUCKET_BOUNDARIES) + 1),
+        )
+        return DataParallelLauncher.without_auto_sharding(dataset.prefetch(tf.data.AUTOTUNE))
 
     def _create_model(
-        self, embedding_matrix: list[np.ndarray], n_units: int, dropout_rate: float
+        self, embedding_matrix: np.ndarray, n_units: int, dropout_rate: float
     ) -> Model:
         """Creates a new model
 
@@ -37,13 +98,14 @@ class ModelCreator:
             Model: Compiled model (not yet trained)
         """
         model = Sequential()
+        model.add(Input(shape=(None,), dtype="int32"))
         model.add(
             Embedding(
                 self._vocabulary_size,
                 Utils.N_DIMS_EMBEDDING,
-                input_length=Constants.SENTIMENT_MAX_SEQ_LEN,
                 weights=[embedding_matrix],
                 trainable=False,
+                mask_zero=True,
             )
         )
         model.add(LSTM(n_units))
@@ -55,7 +117,7 @@ class ModelCreator:
         return model
 
     def get_new_model(self, n_units: int = 256, dropout_rate: float = 0.2) -> Model:
-        """Creates new model. If necessary, the embedding matrix is downloaded and loaded into memory
+        """Creates new model. If necessary, the embedding matrix is downloaded and cached
 
         Args:
             n_units (int, optional): Number of units in the first LSTM layer. Defaults to 128.
@@ -64,41 +126,50 @@ class ModelCreator:
         Returns:
             Model: Compiled model (not yet trained)
         """
-        if not Utils.EMBEDDING_MATRIX_PATH.exists():
-            Utils.download_embedding_matrix()
         embedding_matrix = Utils.load_embedding_matrix(self._vocabulary_size, self._word_index)
         return self._create_model(embedding_matrix, n_units, dropout_rate)
 
-    def train_model(self, model: Model, n_epochs: int) -> History:
+    def train_model(self, model: Model, n_epochs: int, resume: bool = False) -> History:
         """Trains a model for a number of epochs. The best model (defined by its validation
-        accuracy) is saved after every epoch. Moreover, the process stops if no progress is
-        made for half the number of epochs. Training starts in epoch 0.
+        accuracy) is kept after every epoch and written to disk in the background. Moreover, the
+        process stops if no progress is made for half the number of epochs. Training starts in
+        epoch 0, unless it is resumed.
 
         Args:
             model (Model): Model that is trained
             n_epochs (int): Number of epochs that the model is trained for.
+            resume (bool, optional): If set, the training continues from the last checkpoint,
+                including the optimizer state. Defaults to False.
 
         Returns:
             History: Contains the progression of the main training metrics (loss, accuracy, ..)
         """
-        checkpoint = ModelCheckpoint(
-            Constants.SENTIMENT_MODEL_PATH,
+        checkpoint = AsyncWeightsCheckpoint(
+            self._model_path,
+            self._checkpoint_dir,
             monitor="val_categorical_accuracy",
-            save_best_only=True,
-            save_freq="epoch",
             verbose=2,
             initial_value_threshold=0,
         )
+        checkpoint.set_model(model)
+        initial_epoch = checkpoint.restore() if resume else 0
         stop_early = EarlyStopping(monitor="val_categorical_accuracy", patience=n_epochs // 2)
 
-        history = model.fit(
-            self._data_container.x_train_pad,
-            self._data_container.y_train,
-            batch_size=self._batch_size,
-            epochs=n_epochs,
-            callbacks=[checkpoint, stop_early],
-            validation_data=(self._data_container.x_test_pad, self._data_container.y_test),
-        )
+        # the checkpoint writer is not stopped by Keras when fit raises
+        try:
+            history = model.fit(
+                self._create_dataset(
+                    self._data_container.x_train_pad, self._data_container.y_train, shuffle=True
+                ),
+                epochs=n_epochs,
+                initial_epoch=initial_epoch,
+                callbacks=[checkpoint, stop_early],
+                validation_data=self._create_dataset(
+                    self._data_container.x_test_pad, self._data_container.y_test, shuffle=False
+                ),
+            )
+        finally:
+            checkpoint.stop()
 
         return history
 
@@ -112,8 +183,8 @@ class ModelCreator:
             list[str]: Validation loss and accuracy
         """
         result = model.evaluate(
-            self._data_container.x_test_pad,
-            self._data_container.y_test,
-            batch_size=self._batch_size,
+            self._create_dataset(
+                self._data_container.x_test_pad, self._data_container.y_test, shuffle=False
+            )
         )
         return result
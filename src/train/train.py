@@ -1,46 +1,106 @@
 from pathlib import Path
+from typing import Optional
 from constants import Constants
 from sentiment import Sentiment
+from train.distributed import DataParallelLauncher
 from train.lyric_generation.data_loader import DataLoader as DataLoaderLyrics
+from train.lyric_generation.data_loader import PrefixDataContainer
 from train.lyric_generation.model_creator import ModelCreator as ModelCreatorLyrics
 from train.music_creator.data_loader import DataContainer as DataContainerMusic
 from train.music_creator.data_loader import DataLoader as DataLoaderMusic
 from train.music_creator.model_creator import ModelCreator as ModelCreatorMusic
 from train.sentiment_classifier.data_loader import DataLoader as DataLoaderSentiment
 from train.sentiment_classifier.model_creator import ModelCreator as ModelCreatorSentiment
+from train.utils import DataContainer
 from tensorflow.keras.models import load_model
 
 
-def train_sentiment_classifier() -> None:
+def _fit_sentiment_classifier(
+    data_container: DataContainer, word_index: dict[str, int], resume: bool
+) -> None:
+    model_creator = ModelCreatorSentiment(len(Sentiment), word_index, 256, data_container)
+    with DataParallelLauncher.strategy().scope():
+        model = model_creator.get_new_model()
+        train_history = model_creator.train_model(model, 50, resume)
+    if DataParallelLauncher.current_worker().is_chief:
+        print(train_history.history)
+
+
+def train_sentiment_classifier(resume: bool = False, n_workers: int = 1) -> None:
     num_classes = len(Sentiment)
 
     data_loader = DataLoaderSentiment()
     data_container, tokenizer = data_loader.run()
+    launcher = DataParallelLauncher(n_workers)
+    shards = launcher.shard(
+        data_container,
+        [
+            (
+                ["x_train_pad", "y_train"],
+                ModelCreatorSentiment.get_buckets(data_container.x_train_pad),
+            ),
+            (
+                ["x_test_pad", "y_test"],
+                ModelCreatorSentiment.get_buckets(data_container.x_test_pad),
+            ),
+        ],
+    )
+    launcher.run(_fit_sentiment_classifier, shards, tokenizer.word_index, resume)
+
     model_creator = ModelCreatorSentiment(
         num_classes,
         tokenizer.word_index,
         256,
         data_container,
     )
-    model = model_creator.get_new_model()
-    train_history = model_creator.train_model(model, 50)
-    print(train_history.history)
     model = load_model(Constants.SENTIMENT_MODEL_PATH)
     eval_history = model_creator.evaluate_model(model)
     print(eval_history)
 
 
-def train_music_creator() -> None:
+def _fit_music_creator(data_container: DataContainerMusic, resume: bool) -> None:
+    model_creator = ModelCreatorMusic(
+        validation_size=0.2,
+        batch_size=256,
+        learning_rate=0.005,
+        data_container=data_container,
+    )
+    with DataParallelLauncher.strategy().scope():
+        model = model_creator.create_model()
+        train_history = model_creator.train_model(model, 100, resume)
+    if DataParallelLauncher.current_worker().is_chief:
+        print(train_history.history)
+
+
+def prepare_music_data(
+    notes_per_token: int = Constants.MUSIC_NOTES_PER_TOKEN,
+) -> DataContainerMusic:
     seed_size = 0.05
     lim = 2
 
     dataset = Path("..", "data", "Datasets", "D1")
-    data_loader = DataLoaderMusic(lim)
-    all_notes = data_loader.get_notes_from_txt(str(dataset / "all_notes.txt"))
-    filtered_notes = data_loader.filter_notes(all_notes)
-    index = data_loader.create_indices(filtered_notes)
-    data_container: DataContainerMusic = data_loader.run(filtered_notes, seed_size, index)
+    data_loader = DataLoaderMusic(lim, notes_per_token)
+    vocabulary = data_loader.tokenize_notes_txt(
+        str(dataset / "all_notes.txt"), str(dataset / "all_notes_raw.tokens")
+    )
+    lookup, vocab_size = data_loader.create_indices(vocabulary)
+    data_loader.filter_tokens(
+        str(dataset / "all_notes_raw.tokens"), lookup, str(dataset / "all_notes.tokens")
+    )
+    data_container: DataContainerMusic = data_loader.run(
+        str(dataset / "all_notes.tokens"), seed_size, vocab_size
+    )
     DataLoaderMusic.save_seed_to_disk(data_container)
+    return data_container
+
+
+def train_music_creator(
+    notes_per_token: int = Constants.MUSIC_NOTES_PER_TOKEN, resume: bool = False, n_workers: int = 1
+) -> None:
+    data_container = prepare_music_data(notes_per_token)
+    launcher = DataParallelLauncher(n_workers)
+    shards = launcher.shard(data_container, [(["train_indices"], None)])
+    launcher.run(_fit_music_creator, shards, resume)
 
     model_creator = ModelCreatorMusic(
         validation_size=0.2,
@@ -48,22 +108,35 @@ def train_music_creator() -> None:
         learning_rate=0.005,
         data_container=data_container,
     )
-
-    model = model_creator.create_model()
-    train_history = model_creator.train_model(model, 100)
-    print(train_history.history)
     model = load_model(Constants.MUSIC_MODEL_PATH)
     eval_history = model_creator.evaluate_model(model)
     print(eval_history)
 
 
-def train_lyric_generator() -> None:
+def _fit_lyric_generator(
+    data_container: PrefixDataContainer,
+    word_index: dict[str, int],
+    num_sampled: Optional[int],
+    resume: bool,
+) -> None:
+    model_creator = ModelCreatorLyrics(word_index, 512, data_container, num_sampled)
+    with DataParallelLauncher.strategy().scope():
+        model = model_creator.get_new_model()
+        train_history = model_creator.train_model(model, 1000, resume)
+    if DataParallelLauncher.current_worker().is_chief:
+        print(train_history.history)
+
+
+def train_lyric_generator(
+    num_sampled: Optional[int] = None, resume: bool = False, n_workers: int = 1
+) -> None:
     data_loader = DataLoaderLyrics()
     data_container, tokenizer = data_loader.run()
-    model_creator = ModelCreatorLyrics(tokenizer.word_index, 512, data_container)
-    model = model_creator.get_new_model()
-    train_history = model_creator.train_model(model, 1000)
-    print(train_history.history)
+    launcher = DataParallelLauncher(n_workers)
+    shards = launcher.shard(data_container, [(["train_pairs"], None), (["test_pairs"], None)])
+    launcher.run(_fit_lyric_generator, shards, tokenizer.word_index, num_sampled, resume)
+
+    model_creator = ModelCreatorLyrics(tokenizer.word_index, 512, data_container, num_sampled)
     model = load_model(Constants.LYRICS_MODEL_PATH)
     eval_history = model_creator.evaluate_model(model)
     print(eval_history)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
 from pathlib import Path
 import numpy as np
+import pickle
 import urllib.request
 import zipfile
 
@@ -18,6 +19,9 @@ class Utils:
     EMBEDDINGS_DIR = "../data/embeddings"
     EMBEDDING_MATRIX_PATH = Path(f"{EMBEDDINGS_DIR}/{EMBEDDING_MATRIX_NAME}")
     N_DIMS_EMBEDDING = 300
+    EMBEDDING_CACHE_MATRIX_PATH = Path(f"{EMBEDDINGS_DIR}/{EMBEDDING_MATRIX_NAME}.npy")
+    EMBEDDING_CACHE_INDEX_PATH = Path(f"{EMBEDDINGS_DIR}/{EMBEDDING_MATRIX_NAME}.index.pkl")
+    EMBEDDING_CACHE_DTYPE = np.float32
 
     @staticmethod
     def download_embedding_matrix() -> None:
@@ -32,25 +36,62 @@ class Utils:
         Path(f"{Utils.EMBEDDING_MATRIX_PATH}.zip").unlink()
 
     @staticmethod
-    def load_embedding_matrix(vocabulary_size: int, word_index: dict[str, int]) -> list[np.ndarray]:
-        """Loads the embeddings of the words available in the index
+    def build_embedding_cache() -> None:
+        """Converts the text embedding file into a binary matrix and an index from words to
+        matrix rows. This only has to be done once, since the cache is shared by all trainers"""
+        if not Utils.EMBEDDING_MATRIX_PATH.exists():
+            Utils.download_embedding_matrix()
+
+        words: dict[str, int] = {}
+        vectors: list[np.ndarray] = []
+        with open(
+            Utils.EMBEDDING_MATRIX_PATH, "r", encoding="utf-8", newline="\n", errors="ignore"
+        ) as f:
+            for line in f:
+                word, _, vector = line.rstrip().partition(" ")
+                vector = np.array(vector.split(), dtype=np.float32)
+                # the first line is a header with the number of words and dimensions
+                if len(vector) < Utils.N_DIMS_EMBEDDING:
+                    continue
+                words[word] = len(vectors)
+                vectors.append(vector[: Utils.N_DIMS_EMBEDDING])
+
+        np.save(
+            Utils.EMBEDDING_CACHE_MATRIX_PATH, np.stack(vectors).astype(Utils.EMBEDDING_CACHE_DTYPE)
+        )
+        with open(Utils.EMBEDDING_CACHE_INDEX_PATH, "wb") as index_path:
+            pickle.dump(words, index_path)
+
+    @staticmethod
+    def load_embedding_matrix(vocabulary_size: int, word_index: dict[str, int]) -> np.ndarray:
+        """Loads the embeddings of the words available in the index. The binary cache is built
+        first, if necessary, then only the rows of the words in the index are read from it
 
         Args:
             vocabulary_size (int): Number of words in the resulting matrix
             word_index (dict[str, int]): Mapping of words to numerical indices
 
         Returns:
-            list[np.ndarray]: Word embedding matrix
+            np.ndarray: Word embedding matrix
         """
-        embedding_matrix = np.zeros((vocabulary_size, Utils.N_DIMS_EMBEDDING))
-        with open(
-            Utils.EMBEDDING_MATRIX_PATH, "r", encoding="utf-8", newline="\n", errors="ignore"
-        ) as f:
-            for line in f:
-                word, *vector = line.split()
-                if word in word_index:
-                    idx = word_index[word]
-                    embedding_matrix[idx] = np.array(vector, dtype=np.float32)[
-                        : Utils.N_DIMS_EMBEDDING
-                    ]
+        if not (
+            Utils.EMBEDDING_CACHE_MATRIX_PATH.exists() and Utils.EMBEDDING_CACHE_INDEX_PATH.exists()
+        ):
+            Utils.build_embedding_cache()
+
+        all_embeddings = np.load(Utils.EMBEDDING_CACHE_MATRIX_PATH, mmap_mode="r")
+        with open(Utils.EMBEDDING_CACHE_INDEX_PATH, "rb") as index_path:
+            embedding_rows: dict[str, int] = pickle.load(index_path)
+
+        known_words = [
+            (idx, embedding_rows[word])
+            for word, idx in word_index.items()
+            if word in embedding_rows
+        ]
+        embedding_matrix = np.zeros((vocabulary_size, Utils.N_DIMS_EMBEDDING), dtype=np.float32)
+        if known_words:
+            indices, rows = np.array(known_words, dtype=np.int64).T
+            # reading the rows in order keeps the accesses to the memory-mapped file sequential
+            order = np.argsort(rows)
+            embedding_matrix[indices[order]] = all_embeddings[rows[order]]
         return embedding_matrix
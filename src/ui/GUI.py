@@ -1,21 +1,50 @@
+from dataclasses import dataclass
+from pathlib import Path
+import queue
 import threading
 from tkinter import Menu, Tk, Scale
 import tkinter as tk
 from typing import Final, Optional
 
-from constants import Constants
 from predict.predict import Predictor
+from predict.progress import (
+    AudioReady,
+    Classified,
+    GenerationFailed,
+    MelodyComposed,
+    MidiWritten,
+    ProgressEvent,
+    VerseReady,
+)
 import simpleaudio as sa
 
 from ui.menu_toolbar import MenuToolbar
 
 
+@dataclass
+class _LyricsDone:
+    """Posted once the predictor returns, so the lyrics are written, while the music may still be
+    composed in the background"""
+
+
 class GUI:
     FONT_LARGE = ("Roman", 18)
     FONT_SMALL = ("Roman", 16)
+    POLL_INTERVAL_MS = 100
+    LOADING_TEXT = "Loading the models..."
 
     def __init__(self) -> None:
         self._predictor = Predictor()
+        # filled by the generation threads, emptied by the Tk loop only; every event carries the
+        # number of its request, so late events of a previous request are ignored
+        self._events: queue.Queue[tuple[int, ProgressEvent | _LyricsDone]] = queue.Queue()
+        self._predictor_loaded = threading.Event()
+        self._request_id: int = 0
+        # the lyrics and the music of a request finish in any order
+        self._lyrics_done: bool = True
+        self._music_done: bool = True
+        self._lyrics: list[str] = []
+        self._wav_path: Optional[Path] = None
         self._main_window: Tk = self._create_main_window()
         self._user_input: tk.Entry = self._create_user_input_section()
         self._n_verses_scale: tk.Scale = Scale(
@@ -30,15 +59,24 @@ class GUI:
         )
         self._n_verses_scale.set(6)
         self._n_verses_scale.grid(row=2, column=0, padx=10, pady=10)
-        submit_button = tk.Button(
+        self._submit_button = tk.Button(
             self._main_window,
             text="Submit",
             command=self._on_submit_action,
+            state="disabled",
             width=10,
             height=1,
             font=self.FONT_SMALL,
         )
-        submit_button.grid(row=2, column=2, padx=10, pady=10)
+        self._submit_button.grid(row=2, column=2, padx=10, pady=10)
+        self._status_label = tk.Label(
+            self._main_window,
+            text=self.LOADING_TEXT,
+            anchor="w",
+            justify="left",
+            font=self.FONT_SMALL,
+        )
+        self._status_label.grid(row=3, column=0, padx=10, pady=10, columnspan=3)
         self._sentiment_label = tk.Label(
             self._main_window,
             text="You seem to be experiencing...",
@@ -82,27 +120,101 @@ class GUI:
 
         return main_window
 
-    def _refresh_view(self) -> None:
-        self._lyrics_label.config(text="\n".join(self._predictor.lyrics))
-        if "neutral" in self._predictor.sentiment:
+    def _show_sentiment(self, sentiment: str) -> None:
+        if "neutral" in sentiment:
             label_text = "You seem pretty neutral today"
         else:
-            label_text = f"You seem to be experiencing {self._predictor.sentiment.upper()}"
+            label_text = f"You seem to be experiencing {sentiment.upper()}"
         self._sentiment_label.config(text=label_text)
 
+    @property
+    def _is_busy(self) -> bool:
+        return not (self._lyrics_done and self._music_done)
+
+    def _handle_event(self, event: ProgressEvent | _LyricsDone) -> None:
+        """Updates the view with an event of the current request. Runs in the Tk loop
+
+        Args:
+            event (ProgressEvent | _LyricsDone): Event posted by the generation
+        """
+        if isinstance(event, Classified):
+            self._show_sentiment(event.sentiment.value)
+            self._status_label.config(text="Writing the lyrics and composing the music...")
+        elif isinstance(event, VerseReady):
+            self._lyrics.append(event.verse)
+            self._lyrics_label.config(text="\n".join(self._lyrics))
+        elif isinstance(event, MelodyComposed):
+            self._status_label.config(
+                text=f"Composed melody {event.index + 1} of {event.n_melodies}..."
+            )
+        elif isinstance(event, MidiWritten):
+            self._status_label.config(text="Rendering the audio...")
+        elif isinstance(event, AudioReady):
+            self._wav_path = event.path
+            self._music_done = True
+            if self._lyrics_done:
+                self._status_label.config(text="Your song is ready")
+            else:
+                self._status_label.config(text="Finishing the lyrics...")
+        elif isinstance(event, GenerationFailed):
+            self._music_done = True
+            self._status_label.config(text=event.message)
+        elif isinstance(event, _LyricsDone):
+            self._lyrics_done = True
+            if self._music_done and self._wav_path is not None:
+                self._status_label.config(text="Your song is ready")
+
+    def _poll_events(self) -> None:
+        """Applies the events posted since the last poll and updates the buttons, then
+        schedules the next poll, so the window never waits for the generation"""
+        while True:
+            try:
+                request_id, event = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if request_id == self._request_id:
+                self._handle_event(event)
+        is_ready = self._predictor_loaded.is_set() and not self._is_busy
+        if is_ready and self._status_label["text"] == self.LOADING_TEXT:
+            self._status_label.config(text="")
+        self._submit_button["state"] = "normal" if is_ready else "disabled"
+        can_play = self._wav_path is not None or self._is_playing
+        self._play_song_button["state"] = "normal" if can_play else "disabled"
+        self._main_window.after(self.POLL_INTERVAL_MS, self._poll_events)
+
+    def _generate(self, request_id: int, prompt: str, n_verses: int) -> None:
+        def on_progress(event: ProgressEvent) -> None:
+            self._events.put((request_id, event))
+
+        try:
+            self._predictor.run(prompt, n_verses, on_progress=on_progress)
+        except Exception as e:
+            on_progress(GenerationFailed(f"The request failed: {e}"))
+        self._events.put((request_id, _LyricsDone()))
+
     def _on_submit_action(self) -> None:
         prompt = self._user_input.get("1.0", "end-1c")
         n_verses = int(self._n_verses_scale.get())
-        self._predictor.run(prompt, n_verses)
-        self._refresh_view()
-        self._play_song_button["state"] = "normal"
+        if self._is_playing:
+            self._change_playing_state()
+        self._request_id += 1
+        self._lyrics_done = False
+        self._music_done = False
+        self._lyrics = []
+        self._wav_path = None
+        self._lyrics_label.config(text="")
+        self._sentiment_label.config(text="You seem to be experiencing...")
+        self._status_label.config(text="Reading your mood...")
+        self._submit_button["state"] = "disabled"
+        self._play_song_button["state"] = "disabled"
+        threading.Thread(
+            target=self._generate, args=(self._request_id, prompt, n_verses), daemon=True
+        ).start()
 
     def _change_playing_state(self) -> None:
         self._is_playing = not self._is_playing
         if self._is_playing:
-            wave_obj = sa.WaveObject.from_wave_file(
-                f"{Constants.OUTPUT_SAVE_DIR}/{self._predictor.output_name}.wav"
-            )
+            wave_obj = sa.WaveObject.from_wave_file(str(self._wav_path))
             self._song = wave_obj.play()
             self._play_song_button.config(text="Stop")
         else:
@@ -118,7 +230,19 @@ class GUI:
         user_input.grid(row=1, column=0, padx=10, pady=10, columnspan=3)
         return user_input
 
+    def _load_predictor(self) -> None:
+        try:
+            self._predictor.load_artifacts()
+        except Exception as e:
+            self._events.put(
+                (self._request_id, GenerationFailed(f"The models could not be loaded: {e}"))
+            )
+            raise
+        self._predictor_loaded.set()
+        self._predictor.start_song_pool()
+
     def run(self) -> None:
-        thread = threading.Thread(target=self._predictor.load_artifacts)
+        thread = threading.Thread(target=self._load_predictor)
         thread.start()
+        self._poll_events()
         self._main_window.mainloop()